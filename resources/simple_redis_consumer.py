@@ -2,9 +2,10 @@
 This is a simple, standalone Redis consumer. Use it to customize to your needs or to use it as basis for other MQs.
 """
 import redis
-import msgpack
 
 from flowcept.commons.daos.mq_dao.mq_dao_redis import MQDaoRedis
+from flowcept.commons.compression import decompress
+from flowcept.commons.daos.mq_dao.mq_serialization import loads
 from flowcept.configs import MQ_HOST, MQ_PORT, MQ_CHANNEL, KVDB_URI
 # Connect to Redis
 redis_client = (
@@ -29,7 +30,7 @@ for message in pubsub.listen():
         continue
 
     try:
-        msg_obj = msgpack.loads(message["data"], strict_map_key=False)
+        msg_obj = loads(decompress(message["data"]))
         msg_type = msg_obj.get("type", None)
         print(msg_type)
     except Exception as e:
@@ -71,6 +71,10 @@ def __getattr__(name):
         from flowcept.flowcept_api.task_query_api import TaskQueryAPI
 
         return TaskQueryAPI
+    elif name == "get_metrics":
+        from flowcept.commons.flowcept_metrics import get_metrics
+
+        return get_metrics
     raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
 
@@ -88,4 +92,5 @@ __all__ = [
     "WorkflowObject",
     "__version__",
     "SETTINGS_PATH",
+    "get_metrics",
 ]
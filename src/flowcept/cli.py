@@ -321,6 +321,43 @@ def get_task(task_id: str):
     print(json.dumps(Flowcept.db.query(_query), indent=2, default=str))
 
 
+def replay_dead_letters(dead_letter_path: str = None):
+    """
+    Write the documents saved in the DocDB dead-letter file to their DocDBs again.
+
+    Parameters
+    ----------
+    dead_letter_path : str, optional
+        Path of the dead-letter file. Defaults to the one in the settings.
+    """
+    from flowcept.commons.daos.docdb_dao.docdb_dead_letter import DocDBDeadLetter
+    from flowcept.configs import DB_DEAD_LETTER_PATH, LMDB_ENABLED, MONGO_ENABLED
+
+    daos = {}
+
+    def get_dao(dao_name):
+        if dao_name not in daos:
+            daos[dao_name] = None
+            if dao_name == "MongoDBDAO" and MONGO_ENABLED:
+                from flowcept.commons.daos.docdb_dao.mongodb_dao import MongoDBDAO
+
+                daos[dao_name] = MongoDBDAO()
+            elif dao_name == "LMDBDAO" and LMDB_ENABLED:
+                from flowcept.commons.daos.docdb_dao.lmdb_dao import LMDBDAO
+
+                daos[dao_name] = LMDBDAO()
+            else:
+                print(f"{dao_name} is not enabled, so its documents are kept.")
+        return daos[dao_name]
+
+    path = dead_letter_path or DB_DEAD_LETTER_PATH
+    replayed, remaining = DocDBDeadLetter(path).replay(get_dao)
+    for dao in daos.values():
+        if dao is not None:
+            dao.close()
+    print(json.dumps({"path": path, "replayed": replayed, "remaining": remaining}, indent=2))
+
+
 def start_agent():  # TODO: start with gui
     """Start Flowcept agent."""
     from flowcept.agents.flowcept_agent import main
@@ -613,7 +650,7 @@ def start_redis() -> None:
 COMMAND_GROUPS = [
     ("Basic Commands", [version, check_services, show_settings, init_settings, start_services, stop_services]),
     ("Consumption Commands", [start_consumption_services, stop_consumption_services, stream_messages]),
-    ("Database Commands", [workflow_count, query, get_task]),
+    ("Database Commands", [workflow_count, query, get_task, replay_dead_letters]),
     ("Agent Commands", [start_agent, agent_client, start_agent_gui]),
     ("External Services", [start_mongo, start_redis]),
 ]
@@ -0,0 +1,116 @@
+"""Adaptive flush module."""
+
+from flowcept.commons.flowcept_logger import FlowceptLogger
+from flowcept.commons.flowcept_metrics import get_metrics
+
+
+class AdaptiveFlushController:
+    """Adjusts the flush size and interval of an `AutoflushBuffer` from its observed flushes.
+
+    It is meant to be the buffer's `on_flush` callback. After each flush:
+
+    - With a `target_latency`, the size shrinks in proportion when a flush took longer than the
+      target, and grows when a backlog is waiting (more pending items than a flush takes) while
+      flushes are within the target.
+    - Without a target, the size is tuned for throughput (items written per second): it keeps
+      moving in the same direction while full flushes get faster per item, and reverses otherwise.
+
+    The interval shrinks when there is a backlog, so flushes happen as soon as possible, and grows
+    when time-based flushes only carry a few items, so writes are batched. Sizes and intervals stay
+    within the given bounds.
+    """
+
+    GROWTH_FACTOR = 1.5
+    # Relative throughput drop that makes the throughput search reverse its direction.
+    THROUGHPUT_TOLERANCE = 0.05
+
+    def __init__(
+        self,
+        min_size: int,
+        max_size: int,
+        min_interval: float,
+        max_interval: float,
+        target_latency: float = None,
+        name="buffer",
+    ):
+        self.logger = FlowceptLogger()
+        self._min_size = min_size
+        self._max_size = max_size
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._target_latency = target_latency
+        self._name = name
+        self._direction = 1
+        self._last_throughput = None
+        metrics = get_metrics()
+        self._size_metric = metrics.gauge("flowcept_buffer_max_size", "Current flush size of a buffer.", buffer=name)
+        self._interval_metric = metrics.gauge(
+            "flowcept_buffer_flush_interval_seconds", "Current flush interval of a buffer.", buffer=name
+        )
+        self._adjustment_metrics = {
+            (setting, direction): metrics.counter(
+                "flowcept_buffer_adjustments_total",
+                "Adjustments of buffer settings by the adaptive controller.",
+                buffer=name,
+                setting=setting,
+                direction=direction,
+            )
+            for setting in ("size", "interval")
+            for direction in ("up", "down")
+        }
+
+    def _clamp_size(self, size) -> int:
+        return int(min(max(size, self._min_size), self._max_size))
+
+    def _clamp_interval(self, interval) -> float:
+        return min(max(interval, self._min_interval), self._max_interval)
+
+    def _next_size(self, size, n_items, seconds, backlog) -> float:
+        if self._target_latency:
+            if seconds > self._target_latency:
+                return size * max(1 / AdaptiveFlushController.GROWTH_FACTOR, self._target_latency / seconds)
+            if backlog:
+                return size * AdaptiveFlushController.GROWTH_FACTOR
+            return size
+        if n_items < size and not backlog:
+            # Partial flushes tell nothing about how large flushes perform.
+            return size
+        throughput = n_items / seconds if seconds > 0 else float("inf")
+        if self._last_throughput is not None and throughput < (
+            self._last_throughput * (1 - AdaptiveFlushController.THROUGHPUT_TOLERANCE)
+        ):
+            self._direction = -self._direction
+        self._last_throughput = throughput
+        return size * AdaptiveFlushController.GROWTH_FACTOR**self._direction
+
+    def _next_interval(self, interval, n_items, size, backlog) -> float:
+        if interval is None:
+            return self._max_interval
+        if backlog:
+            return interval / AdaptiveFlushController.GROWTH_FACTOR
+        if n_items < size / 4:
+            return interval * AdaptiveFlushController.GROWTH_FACTOR
+        return interval
+
+    def _record(self, setting, old, new):
+        if new == old:
+            return
+        self._adjustment_metrics[(setting, "up" if old is None or new > old else "down")].inc()
+        self.logger.debug(f"Adaptive flush of buffer {self._name}: {setting} changed from {old} to {new}.")
+
+    def __call__(self, buffer, n_items: int, seconds: float):
+        """Observe a flush of `n_items` that took `seconds`, and adjust the buffer."""
+        if not n_items:
+            return
+        size = buffer.max_size
+        interval = buffer.flush_interval
+        backlog = buffer.pending >= size
+
+        new_size = self._clamp_size(self._next_size(size, n_items, seconds, backlog))
+        new_interval = self._clamp_interval(self._next_interval(interval, n_items, size, backlog))
+        self._record("size", size, new_size)
+        self._record("interval", interval, new_interval)
+        buffer.max_size = new_size
+        buffer.flush_interval = new_interval
+        self._size_metric.set(new_size)
+        self._interval_metric.set(new_interval)
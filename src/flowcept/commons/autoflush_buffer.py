@@ -1,11 +1,42 @@
 """Autoflush module."""
 
+import os
+from collections import deque
+from time import perf_counter
 from typing import Callable
-from threading import Thread, Event
+from threading import Thread, Event, Lock, Condition
+
+import orjson
+
+from flowcept.commons.flowcept_logger import FlowceptLogger
+from flowcept.commons.flowcept_metrics import get_metrics, SIZE_BUCKETS
 
 
 class AutoflushBuffer:
-    """Autoflush class."""
+    """Autoflush class.
+
+    Items are appended to the current buffer, which is swapped and flushed by a background thread
+    when it reaches `max_size` items or every `flush_interval` seconds.
+
+    If `max_pending` is set, the number of items appended but not yet flushed is bounded, and
+    `backpressure_policy` defines what happens to new items once the bound is reached:
+
+    - "block": wait up to `block_timeout` seconds for a flush to make room, then drop the item;
+    - "drop_oldest": drop the oldest item not yet being flushed;
+    - "drop_newest": drop the new item;
+    - "spill_to_disk": write the item to disk, to be flushed once there is room again. Spilled items are
+      appended to numbered segments of `spill_path`, read back from an offset, and each segment is removed
+      once fully read, so taking items back does not rewrite what is left.
+
+    Flush latency and size, pending items, and backpressure events are reported to the metrics
+    registry, labeled with the buffer `name`. `on_flush`, if given, is called after each successful
+    flush with the buffer, the number of items flushed, and the flush duration, e.g., to adjust
+    `max_size` and `flush_interval`. If `flush_function` returns a tuple, it is taken as the number
+    of items and the duration given to `on_flush` instead, e.g., to only count the time spent writing.
+    """
+
+    BACKPRESSURE_POLICIES = {"block", "drop_oldest", "drop_newest", "spill_to_disk"}
+    SPILL_SEGMENT_ITEMS = 10_000
 
     def __init__(
         self,
@@ -14,14 +45,69 @@ class AutoflushBuffer:
         flush_interval=None,
         flush_function_args=[],
         flush_function_kwargs={},
+        max_pending=None,
+        backpressure_policy="block",
+        block_timeout=None,
+        spill_path=None,
+        name="buffer",
+        on_flush: Callable = None,
     ):
+        if backpressure_policy not in AutoflushBuffer.BACKPRESSURE_POLICIES:
+            raise Exception(
+                f"Unknown backpressure policy {backpressure_policy}. Use one of {AutoflushBuffer.BACKPRESSURE_POLICIES}"
+            )
+        if backpressure_policy == "spill_to_disk" and spill_path is None:
+            raise Exception("The spill_to_disk backpressure policy requires a spill_path.")
+        self.logger = FlowceptLogger()
         self._max_size = max_size or float("inf")
         self._flush_interval = flush_interval or float("inf")
         self._flush_interval = flush_interval
-        self._buffers = [[], []]
+        self._max_pending = max_pending or float("inf")
+        self._backpressure_policy = backpressure_policy
+        self._block_timeout = block_timeout
+        self._spill_path = spill_path
+        # drop_oldest removes items from the front of the current buffer, which only a deque does in O(1).
+        # Flush functions are still given lists.
+        self._buffer_type = deque if backpressure_policy == "drop_oldest" else list
+        self._buffers = [self._buffer_type(), self._buffer_type()]
         self._current_buffer_index = 0
+        # Guards the swap, so an append on one thread during a flush on another can't lose items.
+        self._lock = Lock()
+        self._room_available = Condition(self._lock)
+        self._pending = 0
+        self._spilled_pending = 0
+        self._spill_segments = deque()
+        self._spill_seq = 0
+        self._spill_segment_items = 0
+        self._spill_read_offset = 0
+        self.dropped_count = 0
+        self.blocked_count = 0
+        self.spilled_count = 0
         self._swap_event = Event()
         self._stop_event = Event()
+        metrics = get_metrics()
+        self._pending_metric = metrics.gauge(
+            "flowcept_buffer_pending", "Items appended but not flushed yet.", buffer=name
+        )
+        self._pending_metric.track(self._get_pending)
+        self._flush_latency_metric = metrics.histogram(
+            "flowcept_buffer_flush_seconds", "Duration of each buffer flush.", buffer=name
+        )
+        self._flush_size_metric = metrics.histogram(
+            "flowcept_buffer_flush_items", "Items in each buffer flush.", buckets=SIZE_BUCKETS, buffer=name
+        )
+        self._flush_errors_metric = metrics.counter(
+            "flowcept_buffer_flush_errors_total", "Buffer flushes that raised an error.", buffer=name
+        )
+        self._dropped_metric = metrics.counter(
+            "flowcept_buffer_dropped_total", "Items dropped by the backpressure policy.", buffer=name
+        )
+        self._blocked_metric = metrics.counter(
+            "flowcept_buffer_blocked_total", "Appends blocked by the backpressure policy.", buffer=name
+        )
+        self._spilled_metric = metrics.counter(
+            "flowcept_buffer_spilled_total", "Items spilled to disk by the backpressure policy.", buffer=name
+        )
 
         self._timer_thread = Thread(target=self.time_based_flush)
         self._timer_thread.start()
@@ -32,21 +118,136 @@ class AutoflushBuffer:
         self._flush_function = flush_function
         self._flush_function_args = flush_function_args
         self._flush_function_kwargs = flush_function_kwargs
+        self._on_flush = on_flush
 
     def append(self, item):
         """Append it."""
-        buffer = self._buffers[self._current_buffer_index]
-        buffer.append(item)
+        with self._lock:
+            if self._pending >= self._max_pending and not self._make_room(item):
+                return
+            buffer = self._buffers[self._current_buffer_index]
+            buffer.append(item)
+            self._pending += 1
         if len(buffer) >= self._max_size:
             self._swap_event.set()
 
     def extend(self, items):
         """Extend it."""
-        buffer = self._buffers[self._current_buffer_index]
-        buffer.extend(items)
+        if self._max_pending != float("inf"):
+            for item in items:
+                self.append(item)
+            return
+        with self._lock:
+            buffer = self._buffers[self._current_buffer_index]
+            buffer.extend(items)
+            self._pending += len(items)
         if len(buffer) >= self._max_size:
             self._swap_event.set()
 
+    def _make_room(self, item) -> bool:
+        """Apply the backpressure policy. Must be called holding the lock.
+
+        Returns True if the item should still be appended to the current buffer.
+        """
+        if self._backpressure_policy == "block":
+            self.blocked_count += 1
+            self._blocked_metric.inc()
+            self._swap_event.set()
+            if self._room_available.wait_for(lambda: self._pending < self._max_pending, timeout=self._block_timeout):
+                return True
+            self._drop()
+            return False
+        elif self._backpressure_policy == "drop_oldest":
+            buffer = self._buffers[self._current_buffer_index]
+            if not len(buffer):
+                # All pending items are being flushed right now.
+                self._drop()
+                return False
+            buffer.popleft()
+            self._pending -= 1
+            self._drop()
+            return True
+        elif self._backpressure_policy == "drop_newest":
+            self._drop()
+            return False
+        else:
+            self._spill(item)
+            return False
+
+    def _drop(self):
+        self.dropped_count += 1
+        self._dropped_metric.inc()
+
+    def _spill(self, item):
+        try:
+            line = orjson.dumps(item)
+        except Exception as e:
+            self.logger.error(f"Could not spill item to disk, dropping it: {e}")
+            self._drop()
+            return
+        if not len(self._spill_segments) or self._spill_segment_items >= self.SPILL_SEGMENT_ITEMS:
+            self._spill_seq += 1
+            self._spill_segments.append(f"{self._spill_path}.{self._spill_seq}")
+            self._spill_segment_items = 0
+        with open(self._spill_segments[-1], "ab") as f:
+            f.write(line)
+            f.write(b"\n")
+        self._spill_segment_items += 1
+        self._spilled_pending += 1
+        self.spilled_count += 1
+        self._spilled_metric.inc()
+
+    def _take_spilled(self):
+        """Read back spilled items, oldest first, as much as there is room for. Must be called holding the lock."""
+        room = max(int(self._max_pending - self._pending), 0)
+        lines = []
+        while len(lines) < room and len(self._spill_segments):
+            segment = self._spill_segments[0]
+            with open(segment, "rb") as f:
+                f.seek(self._spill_read_offset)
+                while len(lines) < room:
+                    line = f.readline()
+                    if not line:
+                        break
+                    lines.append(line)
+                self._spill_read_offset = f.tell()
+            if len(lines) < room:
+                # The segment was fully read. If it was the one being written, the next spill starts a new one.
+                os.remove(segment)
+                self._spill_segments.popleft()
+                self._spill_read_offset = 0
+        self._spilled_pending -= len(lines)
+        self._pending += len(lines)
+        return [orjson.loads(line) for line in lines]
+
+    @property
+    def pending(self):
+        """Number of items appended but not flushed yet, including spilled ones."""
+        return self._pending + self._spilled_pending
+
+    def _get_pending(self):
+        return self.pending
+
+    @property
+    def max_size(self):
+        """Number of items that triggers a flush."""
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, value):
+        self._max_size = value or float("inf")
+        if len(self._buffers[self._current_buffer_index]) >= self._max_size:
+            self._swap_event.set()
+
+    @property
+    def flush_interval(self):
+        """Max time, in seconds, between flushes. Changes take effect after the next flush."""
+        return self._flush_interval
+
+    @flush_interval.setter
+    def flush_interval(self, value):
+        self._flush_interval = value
+
     @property
     def current_buffer(self):
         """Return the currently active buffer (read-only)."""
@@ -59,17 +260,47 @@ class AutoflushBuffer:
             if not self._stop_event.is_set():
                 self._swap_event.set()
 
-    def _do_flush(self):
-        old_buffer_index = self._current_buffer_index
-        self._current_buffer_index = 1 - self._current_buffer_index
-        old_buffer = self._buffers[old_buffer_index]
-        if old_buffer:
-            self._flush_function(
-                old_buffer[:],
+    def _flush(self, buffer):
+        t0 = perf_counter()
+        try:
+            flushed = self._flush_function(
+                buffer,
                 *self._flush_function_args,
                 **self._flush_function_kwargs,
             )
-            self._buffers[old_buffer_index] = []
+        except Exception:
+            self._flush_errors_metric.inc()
+            raise
+        finally:
+            elapsed = perf_counter() - t0
+            self._flush_latency_metric.observe(elapsed)
+            self._flush_size_metric.observe(len(buffer))
+            with self._lock:
+                self._pending -= len(buffer)
+                self._room_available.notify_all()
+        # Called once the flushed items are no longer pending, so it sees the backlog left.
+        if self._on_flush is not None:
+            try:
+                if isinstance(flushed, tuple):
+                    self._on_flush(self, *flushed)
+                else:
+                    self._on_flush(self, len(buffer), elapsed)
+            except Exception as e:
+                self.logger.exception(e)
+
+    def _do_flush(self):
+        with self._lock:
+            old_buffer_index = self._current_buffer_index
+            self._current_buffer_index = 1 - self._current_buffer_index
+            old_buffer = self._buffers[old_buffer_index]
+            self._buffers[old_buffer_index] = self._buffer_type()
+        if old_buffer:
+            self._flush(list(old_buffer) if isinstance(old_buffer, deque) else old_buffer)
+        if self._spilled_pending:
+            with self._lock:
+                spilled = self._take_spilled()
+            if spilled:
+                self._flush(spilled)
 
     def _flush_buffers(self):
         while not self._stop_event.is_set() or any(self._buffers):
@@ -86,5 +317,14 @@ class AutoflushBuffer:
         self._stop_event.set()
         self._swap_event.set()
         self._flush_thread.join()
+        # Waking the timer thread again, in case the flush thread cleared the event before the timer saw it.
+        self._swap_event.set()
         self._timer_thread.join()
         self._do_flush()
+        while self._spilled_pending:
+            self._do_flush()
+        for segment in self._spill_segments:
+            if os.path.exists(segment):
+                os.remove(segment)
+        self._spill_segments.clear()
+        self._pending_metric.untrack(self._get_pending)
@@ -0,0 +1,90 @@
+"""Compression module.
+
+Compressed payloads start with a marker byte that msgpack never produces, followed by one byte
+identifying the codec, so readers can tell compressed and uncompressed payloads apart without
+knowing the writer's settings. MQ messages and LMDB values share this format, so codec ids must
+never be reused.
+"""
+
+import zlib
+from typing import Callable, Dict, Tuple
+
+COMPRESSED_MARKER = 0xC1  # This byte is never used in the msgpack format.
+CODEC_IDS = {"zlib": 1, "lz4": 2, "zstd": 3}
+
+_codecs: Dict[int, Tuple[Callable, Callable]] = {}
+
+
+def _get_codec(codec_id: int) -> Tuple[Callable, Callable]:
+    """Get the (compress, decompress) functions for a codec id, importing the optional libs lazily."""
+    if codec_id not in _codecs:
+        if codec_id == CODEC_IDS["zlib"]:
+            _codecs[codec_id] = (lambda data: zlib.compress(data, 1), zlib.decompress)
+        elif codec_id == CODEC_IDS["lz4"]:
+            try:
+                import lz4.frame
+            except ImportError:
+                raise Exception("Compression lz4 requires the lz4 package. Run `pip install flowcept[compression]`.")
+            _codecs[codec_id] = (lz4.frame.compress, lz4.frame.decompress)
+        elif codec_id == CODEC_IDS["zstd"]:
+            try:
+                import zstandard
+            except ImportError:
+                raise Exception(
+                    "Compression zstd requires the zstandard package. Run `pip install flowcept[compression]`."
+                )
+            _codecs[codec_id] = (zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress)
+        else:
+            raise Exception(f"Unknown compression codec id: {codec_id}")
+    return _codecs[codec_id]
+
+
+def get_codec_id(codec: str, setting: str) -> int:
+    """Get the id of a codec named in the settings, or None if the setting disables compression."""
+    if codec in {None, "none"}:
+        return None
+    if codec not in CODEC_IDS:
+        raise Exception(f"Unknown {setting}: {codec}. Use one of {list(CODEC_IDS)} or none.")
+    return CODEC_IDS[codec]
+
+
+def compress(data: bytes, codec_id: int, min_size: int = 0) -> bytes:
+    """Compress a serialized payload, if a codec is given and the payload is large enough.
+
+    Parameters
+    ----------
+    data : bytes
+        The serialized payload.
+    codec_id : int
+        The id of the codec, in `CODEC_IDS`, or None not to compress.
+    min_size : int, optional
+        The minimum size to compress.
+
+    Returns
+    -------
+    bytes
+        The marked compressed payload, or the original payload.
+    """
+    if codec_id is None or len(data) < min_size:
+        return data
+    compress_func, _ = _get_codec(codec_id)
+    return bytes((COMPRESSED_MARKER, codec_id)) + compress_func(data)
+
+
+def decompress(data: bytes) -> bytes:
+    """Decompress a payload if it carries the compression marker; otherwise, return it as is.
+
+    Parameters
+    ----------
+    data : bytes
+        The payload, compressed or not.
+
+    Returns
+    -------
+    bytes
+        The serialized payload.
+    """
+    if len(data) > 1 and data[0] == COMPRESSED_MARKER:
+        _, decompress_func = _get_codec(data[1])
+        return decompress_func(data[2:])
+    return data
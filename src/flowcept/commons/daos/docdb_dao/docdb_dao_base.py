@@ -95,6 +95,27 @@ class DocumentDBDAO(ABC):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def upsert_curated_tasks(self, indexed_buffer: Dict[str, Dict], indexing_key=None):
+        """Insert or update task documents already merged by `curate_dict_task_messages`.
+
+        Implementations must not change the given documents, as they may be shared with other DAOs
+        writing them at the same time.
+
+        Parameters
+        ----------
+        indexed_buffer : Dict[str, Dict]
+            Curated task documents, by the value of their indexing key. Their times were not converted.
+        indexing_key : str, optional
+            Key to use for indexing documents.
+
+        Raises
+        ------
+        NotImplementedError
+            This method must be implemented by subclasses.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def insert_or_update_workflow(self, wf_obj: WorkflowObject):
         """Insert or update a workflow object.
@@ -111,6 +132,42 @@ class DocumentDBDAO(ABC):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def insert_or_update_many_workflows(self, workflows: List[Dict]):
+        """Insert or update multiple workflow documents at once.
+
+        Parameters
+        ----------
+        workflows : List[Dict]
+            Workflow documents, in the order they were received. Documents with the same workflow_id
+            are merged before they are written.
+
+        Raises
+        ------
+        NotImplementedError
+            This method must be implemented by subclasses.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_curated_workflows(self, indexed_buffer: Dict[str, Dict]):
+        """Insert or update workflow documents already merged by `curate_dict_workflow_messages`.
+
+        Implementations must not change the given documents, as they may be shared with other DAOs
+        writing them at the same time.
+
+        Parameters
+        ----------
+        indexed_buffer : Dict[str, Dict]
+            Curated workflow documents, by workflow_id.
+
+        Raises
+        ------
+        NotImplementedError
+            This method must be implemented by subclasses.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def insert_one_task(self, task_dict: Dict):
         """Insert a single task document.
@@ -0,0 +1,193 @@
+"""DocDB dead-letter module.
+
+Writes to a DocDB are retried with exponential backoff. If a batch still fails, it is written in halves,
+recursively, to isolate the documents that cannot be written, which are appended to a local dead-letter
+file, so they can be replayed later (e.g., with ``flowcept --replay-dead-letters``). If no half can be
+written, the DocDB is assumed to be down, and nothing is dead-lettered.
+"""
+
+import os
+from functools import partial
+from threading import Lock
+from time import monotonic, sleep, time
+from typing import Callable, Dict, Optional, Tuple
+
+import msgpack
+
+from flowcept.commons.daos.mq_dao.mq_serialization import dumps_ext, native_ext_hook
+from flowcept.commons.flowcept_dataclasses.task_object import TaskObject
+from flowcept.commons.flowcept_logger import FlowceptLogger
+
+
+def _try_write(write: Callable[[Dict], bool], docs: Dict, logger) -> bool:
+    try:
+        return bool(write(docs))
+    except Exception as e:
+        logger.exception(e)
+        return False
+
+
+def write_with_retries(write: Callable[[Dict], bool], docs: Dict, retries: int, backoff: float, logger) -> bool:
+    """Write the documents, retrying failed writes after `backoff` seconds, then twice as long each time.
+
+    Parameters
+    ----------
+    write : Callable
+        Writes a dict of curated documents, by their key, returning whether it succeeded.
+    docs : dict
+        The curated documents to write.
+    retries : int
+        Max number of retries.
+    backoff : float
+        Seconds to wait before the first retry.
+    logger : FlowceptLogger
+        Logger for the errors.
+
+    Returns
+    -------
+    bool
+        True if a write succeeded, False otherwise.
+    """
+    for retry in range(retries + 1):
+        if retry > 0:
+            sleep(backoff * 2 ** (retry - 1))
+        if _try_write(write, docs, logger):
+            return True
+    return False
+
+
+def find_unwritable(write: Callable[[Dict], bool], docs: Dict, logger, max_seconds: float = None) -> Optional[Dict]:
+    """Write documents whose write failed in halves, recursively, returning those that cannot be written.
+
+    If no write succeeds within the first tries (twice as many as halvings needed to reach single
+    documents), or within `max_seconds`, the DocDB is assumed to be unavailable, and None is returned.
+    Once a write succeeded, the documents not tried within `max_seconds` are returned as unwritable.
+
+    Parameters
+    ----------
+    write : Callable
+        Writes a dict of curated documents, by their key, returning whether it succeeded.
+    docs : dict
+        The curated documents, by their key, whose write failed.
+    logger : FlowceptLogger
+        Logger for the errors.
+    max_seconds : float, optional
+        Max time to spend writing halves, as each failed write may block up to the DocDB client timeout.
+
+    Returns
+    -------
+    dict or None
+        The documents that were not written, by their key, or None if no write succeeded.
+    """
+    max_failures = 2 * len(docs).bit_length()
+    deadline = None if max_seconds is None else monotonic() + max_seconds
+    failures = 0
+    succeeded = False
+
+    def bisect(docs):
+        nonlocal failures, succeeded
+        if len(docs) <= 1:
+            return docs
+        items = list(docs.items())
+        middle = len(items) // 2
+        unwritable = {}
+        for half in (dict(items[:middle]), dict(items[middle:])):
+            if (not succeeded and failures >= max_failures) or (deadline is not None and monotonic() >= deadline):
+                unwritable.update(half)
+            elif _try_write(write, half, logger):
+                succeeded = True
+            else:
+                failures += 1
+                unwritable.update(bisect(half))
+        return unwritable
+
+    unwritable = bisect(docs)
+    return unwritable if succeeded else None
+
+
+class DocDBDeadLetter:
+    """Local file of documents that could not be written to a DocDB.
+
+    Each record has the DocDB (its DAO class name), the collection, the key, and the curated document.
+    Records are serialized like spilled MQ messages, so documents are replayed with their original types.
+    Only one replay should run at a time, but documents may be appended while it runs.
+    """
+
+    REPLAYING_SUFFIX = ".replaying"
+
+    def __init__(self, path: str):
+        self.logger = FlowceptLogger()
+        self._path = path
+        self._lock = Lock()
+
+    @property
+    def path(self) -> str:
+        """Path of the dead-letter file."""
+        return self._path
+
+    def append(self, dao_name: str, collection: str, docs: Dict) -> bool:
+        """Append curated documents, by their key, returning whether they were saved."""
+        dead_lettered_at = time()
+        try:
+            data = b"".join(
+                dumps_ext({"dao": dao_name, "collection": collection, "key": key, "doc": doc, "at": dead_lettered_at})
+                for key, doc in docs.items()
+            )
+            with self._lock, open(self._path, "ab") as f:
+                f.write(data)
+            return True
+        except Exception as e:
+            self.logger.exception(e)
+            return False
+
+    def replay(self, get_dao: Callable[[str], object]) -> Tuple[int, int]:
+        """
+        Rewrite the dead-lettered documents to their DocDBs, keeping those that fail again in the file.
+
+        Parameters
+        ----------
+        get_dao : Callable
+            Returns the DAO for a DAO class name, or None if that DocDB is not available.
+
+        Returns
+        -------
+        tuple of int
+            The number of documents written, and of documents still in the file.
+        """
+        replaying = self._path + DocDBDeadLetter.REPLAYING_SUFFIX
+        # A leftover file means a replay was interrupted, so its documents are replayed first.
+        with self._lock:
+            if os.path.exists(self._path):
+                if os.path.exists(replaying):
+                    with open(self._path, "rb") as src, open(replaying, "ab") as dst:
+                        dst.write(src.read())
+                    os.remove(self._path)
+                else:
+                    os.replace(self._path, replaying)
+        if not os.path.exists(replaying):
+            return 0, 0
+        # Later records of the same document replace earlier ones.
+        groups: Dict[Tuple[str, str], Dict] = {}
+        with open(replaying, "rb") as f:
+            for entry in msgpack.Unpacker(f, strict_map_key=False, ext_hook=native_ext_hook):
+                groups.setdefault((entry["dao"], entry["collection"]), {})[entry["key"]] = entry["doc"]
+        replayed, remaining = 0, 0
+        for (dao_name, collection), docs in groups.items():
+            dao = get_dao(dao_name)
+            if dao is None:
+                unwritten = docs
+            else:
+                if collection == "tasks":
+                    write = partial(dao.upsert_curated_tasks, indexing_key=TaskObject.task_id_field())
+                else:
+                    write = dao.upsert_curated_workflows
+                unwritten = {} if _try_write(write, docs, self.logger) else find_unwritable(write, docs, self.logger)
+                if unwritten is None:
+                    unwritten = docs
+            if len(unwritten) and not self.append(dao_name, collection, unwritten):
+                self.logger.error(f"Keeping {replaying}, as its documents could not be kept in {self._path}.")
+                return replayed, remaining
+            replayed += len(docs) - len(unwritten)
+            remaining += len(unwritten)
+        os.remove(replaying)
+        return replayed, remaining
@@ -4,25 +4,97 @@ This module provides the `LMDBDAO` class for interacting with an LMDB-backed dat
 """
 
 from time import time
-from typing import List, Dict
+from typing import Callable, Iterable, List, Dict
 
 import lmdb
 import json
+import msgpack
 import pandas as pd
 
 from flowcept import WorkflowObject
 from flowcept.commons.daos.docdb_dao.docdb_dao_base import DocumentDBDAO
+from flowcept.commons.compression import compress, decompress, get_codec_id
 from flowcept.commons.flowcept_logger import FlowceptLogger
-from flowcept.configs import PERF_LOG, LMDB_SETTINGS
-from flowcept.flowceptor.consumers.consumer_utils import curate_dict_task_messages
+from flowcept.configs import PERF_LOG, LMDB_SETTINGS, LMDB_COMPRESSION, LMDB_COMPRESSION_MIN_SIZE
+from flowcept.flowceptor.consumers.consumer_utils import curate_dict_task_messages, curate_dict_workflow_messages
+
+# Values start with this version byte, followed by the msgpack document, possibly compressed (see compression).
+# Values written before the binary encoding are JSON documents, which start with "{".
+_MSGPACK_VERSION = 1
+
+_CODEC_ID = get_codec_id(LMDB_COMPRESSION, "LMDB compression")
+
+
+def _encode(doc: Dict) -> bytes:
+    """Encode a document to be stored."""
+    data = msgpack.packb(doc, default=str)
+    data = compress(data, _CODEC_ID, LMDB_COMPRESSION_MIN_SIZE)
+    return bytes((_MSGPACK_VERSION,)) + data
+
+
+def _decode(value: bytes, keep: Callable[[str], bool] = None) -> Dict:
+    """Decode a stored document. If `keep` is given, only the top-level fields it keeps are decoded."""
+    if value[:1] == b"{":
+        doc = json.loads(value)
+        return doc if keep is None else {k: v for k, v in doc.items() if keep(k)}
+    if value[0] != _MSGPACK_VERSION:
+        raise Exception(f"Unknown LMDB value encoding version: {value[0]}")
+    data = decompress(value[1:])
+    if keep is None:
+        return msgpack.unpackb(data, strict_map_key=False)
+    unpacker = msgpack.Unpacker(strict_map_key=False, max_buffer_size=len(data))
+    unpacker.feed(data)
+    doc = {}
+    for _ in range(unpacker.read_map_header()):
+        key = unpacker.unpack()
+        if keep(key):
+            doc[key] = unpacker.unpack()
+        else:
+            unpacker.skip()
+    return doc
+
+
+def _select_paths(doc: Dict, paths: Iterable[str]) -> Dict:
+    """Select the (possibly dotted) paths of a document, like a MongoDB inclusion projection."""
+    projected = {}
+    for path in paths:
+        src, dst = doc, projected
+        *parents, field = path.split(".")
+        for parent in parents:
+            if not isinstance(src, dict) or parent not in src:
+                break
+            src, dst = src[parent], dst.setdefault(parent, {})
+        else:
+            if isinstance(src, dict) and field in src:
+                dst[field] = src[field]
+    return projected
+
+
+def _drop_paths(doc: Dict, paths: Iterable[str]) -> Dict:
+    """Remove the (possibly dotted) paths of a document, like a MongoDB exclusion projection."""
+    for path in paths:
+        src = doc
+        *parents, field = path.split(".")
+        for parent in parents:
+            src = src.get(parent) if isinstance(src, dict) else None
+        if isinstance(src, dict):
+            src.pop(field, None)
+    return doc
 
 
 class LMDBDAO(DocumentDBDAO):
     """DocumentDBDAO implementation for interacting with LMDB.
 
     Provides methods for storing and retrieving task and workflow data.
+
+    Tasks are indexed by the fields in `TASK_INDEX_FIELDS`, in sub-databases mapping each (string) value
+    to the ids of the tasks with it, kept up to date in the same transactions as the tasks. Queries
+    whose filter has the key of the collection or an indexed field only read the matching documents.
     """
 
+    TASK_INDEX_FIELDS = ("workflow_id", "campaign_id", "parent_task_id", "activity_id", "status")
+    KEY_FIELDS = {"tasks": "task_id", "workflows": "workflow_id"}
+
     def __init__(self):
         # TODO: if we are inheriting from DocumentDBDAO, shouldn't we call super() here?
         self._initialized = True
@@ -32,11 +104,55 @@ class LMDBDAO(DocumentDBDAO):
     def _open(self):
         """Open LMDB environment and databases."""
         _path = LMDB_SETTINGS.get("path", "flowcept_lmdb")
-        self._env = lmdb.open(_path, map_size=10**12, max_dbs=2)
+        self._env = lmdb.open(_path, map_size=10**12, max_dbs=3 + len(LMDBDAO.TASK_INDEX_FIELDS))
         self._tasks_db = self._env.open_db(b"tasks")
         self._workflows_db = self._env.open_db(b"workflows")
+        self._task_indexes = {
+            field: self._env.open_db(f"tasks_by_{field}".encode(), dupsort=True) for field in LMDBDAO.TASK_INDEX_FIELDS
+        }
+        self._meta_db = self._env.open_db(b"meta")
+        self._max_key_size = self._env.max_key_size()
+        self._build_task_indexes()
         self._is_closed = False
 
+    def _build_task_indexes(self):
+        """Index the tasks stored before the indexes existed, or before the indexed fields changed."""
+        fields = json.dumps(LMDBDAO.TASK_INDEX_FIELDS).encode()
+        with self._env.begin(write=True) as txn:
+            if txn.get(b"task_index_fields", db=self._meta_db) == fields:
+                return
+            for index_db in self._task_indexes.values():
+                txn.drop(index_db, delete=False)
+            index_fields = set(LMDBDAO.TASK_INDEX_FIELDS)
+            for key, value in txn.cursor(db=self._tasks_db):
+                doc = _decode(value, index_fields.__contains__)
+                for field, index_db in self._task_indexes.items():
+                    index_key = self._index_key(doc.get(field))
+                    if index_key is not None:
+                        txn.put(index_key, key, db=index_db)
+            txn.put(b"task_index_fields", fields, db=self._meta_db)
+
+    def _index_key(self, value):
+        """Get the index key of a field value, or None if it cannot be indexed (only strings are)."""
+        if not isinstance(value, str) or not value:
+            return None
+        index_key = value.encode()
+        return index_key if len(index_key) <= self._max_key_size else None
+
+    def _put_task(self, txn, key: bytes, doc: Dict):
+        """Put a task, and replace its entries in the indexes whose fields changed, in the given transaction."""
+        old_value = txn.get(key, db=self._tasks_db)
+        old_doc = _decode(old_value, self._task_indexes.__contains__) if old_value is not None else {}
+        txn.put(key, _encode(doc), db=self._tasks_db)
+        for field, index_db in self._task_indexes.items():
+            old_index_key, index_key = self._index_key(old_doc.get(field)), self._index_key(doc.get(field))
+            if old_index_key == index_key:
+                continue
+            if old_index_key is not None:
+                txn.delete(old_index_key, key, db=index_db)
+            if index_key is not None:
+                txn.put(index_key, key, db=index_db)
+
     def insert_and_update_many_tasks(self, docs: List[Dict], indexing_key=None):
         """Insert or update multiple task documents in the LMDB database.
 
@@ -47,6 +163,30 @@ class LMDBDAO(DocumentDBDAO):
         indexing_key : str, optional
             Key used for indexing task messages.
 
+        Returns
+        -------
+        bool
+            True if the operation succeeds, False otherwise.
+        """
+        try:
+            indexed_buffer = curate_dict_task_messages(docs, indexing_key, convert_times=False)
+        except Exception as e:
+            self.logger.exception(e)
+            return False
+        return self.upsert_curated_tasks(indexed_buffer, indexing_key)
+
+    def upsert_curated_tasks(self, indexed_buffer: Dict[str, Dict], indexing_key=None):
+        """Insert or update task documents already merged by `curate_dict_task_messages`, in a single transaction.
+
+        The documents are not changed, so the same ones can be given to other DAOs at the same time.
+
+        Parameters
+        ----------
+        indexed_buffer : dict
+            The curated task documents, by the value of their indexing key.
+        indexing_key : str, optional
+            Key used for indexing task messages.
+
         Returns
         -------
         bool
@@ -56,14 +196,13 @@ class LMDBDAO(DocumentDBDAO):
             t0 = 0
             if PERF_LOG:
                 t0 = time()
-            indexed_buffer = curate_dict_task_messages(
-                docs, indexing_key, t0, convert_times=False, keys_to_drop=["data"]
-            )
-
-            with self._env.begin(write=True, db=self._tasks_db) as txn:
-                for key, value in indexed_buffer.items():
-                    k, v = key.encode(), json.dumps(value).encode()
-                    txn.put(k, v)
+            with self._env.begin(write=True) as txn:
+                for key, curated_doc in indexed_buffer.items():
+                    value = curated_doc.copy()
+                    value.pop("data", None)
+                    if t0 > 0:
+                        value["utc_time_at_insertion"] = t0
+                    self._put_task(txn, key.encode(), value)
             return True
         except Exception as e:
             self.logger.exception(e)
@@ -83,9 +222,8 @@ class LMDBDAO(DocumentDBDAO):
             True if the operation succeeds, False otherwise.
         """
         try:
-            with self._env.begin(write=True, db=self._tasks_db) as txn:
-                k, v = task_dict.get("task_id").encode(), json.dumps(task_dict).encode()
-                txn.put(k, v)
+            with self._env.begin(write=True) as txn:
+                self._put_task(txn, task_dict.get("task_id").encode(), task_dict)
             return True
         except Exception as e:
             self.logger.exception(e)
@@ -108,13 +246,56 @@ class LMDBDAO(DocumentDBDAO):
             _dict = wf_obj.to_dict()
             with self._env.begin(write=True, db=self._workflows_db) as txn:
                 key = _dict.get("workflow_id").encode()
-                value = json.dumps(_dict).encode()
+                value = _encode(_dict)
                 txn.put(key, value)
             return True
         except Exception as e:
             self.logger.exception(e)
             return False
 
+    def insert_or_update_many_workflows(self, workflows: List[Dict]):
+        """Insert or update multiple workflow documents in a single transaction.
+
+        Parameters
+        ----------
+        workflows : list of dict
+            Workflow documents, in the order they were received. Documents with the same
+            workflow_id are merged first.
+
+        Returns
+        -------
+        bool
+            True if the operation succeeds, False otherwise.
+        """
+        try:
+            indexed_buffer = curate_dict_workflow_messages(workflows)
+        except Exception as e:
+            self.logger.exception(e)
+            return False
+        return self.upsert_curated_workflows(indexed_buffer)
+
+    def upsert_curated_workflows(self, indexed_buffer: Dict[str, Dict]):
+        """Insert or update workflow documents merged by `curate_dict_workflow_messages`, in a single transaction.
+
+        Parameters
+        ----------
+        indexed_buffer : dict
+            The curated workflow documents, by workflow_id.
+
+        Returns
+        -------
+        bool
+            True if the operation succeeds, False otherwise.
+        """
+        try:
+            with self._env.begin(write=True, db=self._workflows_db) as txn:
+                for key, value in indexed_buffer.items():
+                    txn.put(key.encode(), _encode(value))
+            return True
+        except Exception as e:
+            self.logger.exception(e)
+            return False
+
     @staticmethod
     def _match_filter(entry, filter):
         """
@@ -171,8 +352,9 @@ class LMDBDAO(DocumentDBDAO):
         ----------
         filter : dict, optional
             Filter criteria.
-        projection : dict, optional
-            Fields to include or exclude.
+        projection : list or dict, optional
+            Fields to include, or a MongoDB-style dict of fields to include or exclude. Fields may be dotted.
+            Only the top-level fields needed by the filter and the projection are decoded.
         limit : int, optional
             Maximum number of results to return.
         sort : list, optional
@@ -202,17 +384,69 @@ class LMDBDAO(DocumentDBDAO):
 
         try:
             data = []
+            included, excluded = LMDBDAO._parse_projection(projection)
+            # Only the top-level fields needed by the filter and the projection are decoded.
+            filter_fields = set(filter or {})
+            keep = None
+            if included is not None:
+                keep = ({path.split(".")[0] for path in included} | filter_fields).__contains__
+            elif excluded:
+                # Fields with excluded subfields are still decoded.
+                excluded_fields = {path for path in excluded if "." not in path}
+
+                def keep(field):
+                    return field not in excluded_fields or field in filter_fields
+
             with self._env.begin(db=_db) as txn:
-                cursor = txn.cursor()
-                for key, value in cursor:
-                    entry = json.loads(value.decode())
+                for value in self._candidate_values(txn, _db, collection, filter):
+                    entry = _decode(value, keep)
                     if LMDBDAO._match_filter(entry, filter):
+                        if included is not None:
+                            entry = _select_paths(entry, included)
+                        elif excluded:
+                            entry = _drop_paths(entry, excluded)
                         data.append(entry)
             return data
         except Exception as e:
             self.logger.exception(e)
             return None
 
+    @staticmethod
+    def _parse_projection(projection):
+        """Get the fields included, or else excluded, by a projection: a list of fields or a MongoDB-style dict."""
+        if not projection:
+            return None, None
+        if isinstance(projection, dict):
+            included = [field for field, value in projection.items() if value]
+            if not len(included):
+                return None, set(projection)
+            return included, None
+        return list(projection), None
+
+    def _candidate_values(self, txn, _db, collection, filter):
+        """Get the stored values that may match the filter, using the collection key or the narrowest index."""
+        if not filter:
+            return txn.cursor(db=_db).iternext(keys=False)
+        key = self._index_key(filter.get(LMDBDAO.KEY_FIELDS[collection]))
+        if key is not None:
+            value = txn.get(key, db=_db)
+            return [] if value is None else [value]
+        best_count, best_cursor = None, None
+        if collection == "tasks":
+            for field, index_db in self._task_indexes.items():
+                index_key = self._index_key(filter.get(field))
+                if index_key is None:
+                    continue
+                cursor = txn.cursor(db=index_db)
+                count = cursor.count() if cursor.set_key(index_key) else 0
+                if best_count is None or count < best_count:
+                    best_count, best_cursor = count, cursor
+        if best_count is None:
+            return txn.cursor(db=_db).iternext(keys=False)
+        if best_count == 0:
+            return []
+        return (txn.get(task_key, db=_db) for task_key in best_cursor.iternext_dup(keys=False))
+
     def task_query(
         self,
         filter=None,
@@ -1,6 +1,7 @@
 """Document DB interaction module."""
 
 import os
+from datetime import datetime
 from typing import List, Dict, Tuple, Any
 import io
 import json
@@ -27,7 +28,9 @@ from flowcept.commons.utils import perf_log, get_utc_now_str
 from flowcept.commons.vocabulary import Status
 from flowcept.configs import PERF_LOG, MONGO_CREATE_INDEX
 from flowcept.flowceptor.consumers.consumer_utils import (
+    UTC_TZ,
     curate_dict_task_messages,
+    curate_dict_workflow_messages,
 )
 from time import time
 
@@ -262,22 +265,58 @@ class MongoDBDAO(DocumentDBDAO):
             t0 = 0
             if PERF_LOG:
                 t0 = time()
-            indexed_buffer = curate_dict_task_messages(doc_list, indexing_key, t0)
-            t1 = perf_log("doc_curate_dict_task_messages", t0)
+            indexed_buffer = curate_dict_task_messages(doc_list, indexing_key, convert_times=False)
+            perf_log("doc_curate_dict_task_messages", t0)
+        except Exception as e:
+            self.logger.exception(e)
+            return False
+        return self.upsert_curated_tasks(indexed_buffer, indexing_key)
+
+    def upsert_curated_tasks(self, indexed_buffer: Dict[str, Dict], indexing_key: str) -> bool:
+        """
+        Upsert task documents already merged by `curate_dict_task_messages`, with a single bulk write.
+
+        The documents are not changed, so the same ones can be given to other DAOs at the same time.
+
+        Parameters
+        ----------
+        indexed_buffer : dict
+            The curated task documents, by the value of their indexing key. Their times are
+            converted to datetimes here.
+        indexing_key : str
+            The key used to index the task documents for upsert operations.
+
+        Returns
+        -------
+        bool
+            True if the operation was successful, False otherwise.
+        """
+        try:
             if len(indexed_buffer) == 0:
                 return False
+            t0 = 0
+            if PERF_LOG:
+                t0 = time()
+            registered_at = datetime.fromtimestamp(time(), UTC_TZ)
             requests = []
-            for indexing_key_value in indexed_buffer:
+            for indexing_key_value, curated_doc in indexed_buffer.items():
+                doc = curated_doc.copy()
+                for time_field in TaskObject.get_time_field_names():
+                    if time_field in doc:
+                        doc[time_field] = datetime.fromtimestamp(doc[time_field], UTC_TZ)
+                doc.setdefault("registered_at", registered_at)
+                if t0 > 0:
+                    doc["utc_time_at_insertion"] = t0
                 requests.append(
                     UpdateOne(
                         filter={indexing_key: indexing_key_value},
-                        update=[{"$set": indexed_buffer[indexing_key_value]}],
+                        update=[{"$set": doc}],
                         upsert=True,
                     )
                 )
-            t2 = perf_log("indexing_buffer", t1)
+            t1 = perf_log("indexing_buffer", t0)
             self._tasks_collection.bulk_write(requests)
-            perf_log("bulk_write", t2)
+            perf_log("bulk_write", t1)
             return True
         except Exception as e:
             self.logger.exception(e)
@@ -451,13 +490,10 @@ class MongoDBDAO(DocumentDBDAO):
             self.logger.exception(e)
             return -1
 
-    def insert_or_update_workflow(self, workflow_obj: WorkflowObject) -> bool:
-        """Insert or update workflow."""
-        _dict = workflow_obj.to_dict().copy()
+    @staticmethod
+    def _get_workflow_update(_dict: Dict) -> Tuple[Dict, Dict]:
+        """Get the filter and the update query that upsert a workflow dict. The dict is changed."""
         workflow_id = _dict.pop(WorkflowObject.workflow_id_field(), None)
-        if workflow_id is None:
-            self.logger.exception("The workflow identifier cannot be none.")
-            return False
         _filter = {WorkflowObject.workflow_id_field(): workflow_id}
         update_query = {}
         interceptor_ids = _dict.pop("interceptor_ids", None)
@@ -483,7 +519,15 @@ class MongoDBDAO(DocumentDBDAO):
                 "$set": _dict,
             }
         )
+        return _filter, update_query
 
+    def insert_or_update_workflow(self, workflow_obj: WorkflowObject) -> bool:
+        """Insert or update workflow."""
+        _dict = workflow_obj.to_dict().copy()
+        if _dict.get(WorkflowObject.workflow_id_field()) is None:
+            self.logger.exception("The workflow identifier cannot be none.")
+            return False
+        _filter, update_query = MongoDBDAO._get_workflow_update(_dict)
         try:
             result = self._wfs_collection.update_one(_filter, update_query, upsert=True)
             return (result.upserted_id is not None) or result.raw_result["updatedExisting"]
@@ -491,6 +535,57 @@ class MongoDBDAO(DocumentDBDAO):
             self.logger.exception(e)
             return False
 
+    def insert_or_update_many_workflows(self, workflows: List[Dict]) -> bool:
+        """
+        Insert or update multiple workflows with a single bulk write.
+
+        Parameters
+        ----------
+        workflows : list of dict
+            Workflow documents, in the order they were received. Documents with the same
+            workflow_id are merged first.
+
+        Returns
+        -------
+        bool
+            True if the operation was successful, False otherwise.
+        """
+        try:
+            indexed_buffer = curate_dict_workflow_messages(workflows)
+        except Exception as e:
+            self.logger.exception(e)
+            return False
+        return self.upsert_curated_workflows(indexed_buffer)
+
+    def upsert_curated_workflows(self, indexed_buffer: Dict[str, Dict]) -> bool:
+        """
+        Upsert workflow documents already merged by `curate_dict_workflow_messages`, with a single bulk write.
+
+        The documents are not changed, so the same ones can be given to other DAOs at the same time.
+
+        Parameters
+        ----------
+        indexed_buffer : dict
+            The curated workflow documents, by workflow_id.
+
+        Returns
+        -------
+        bool
+            True if the operation was successful, False otherwise.
+        """
+        try:
+            if len(indexed_buffer) == 0:
+                return True
+            requests = []
+            for curated_doc in indexed_buffer.values():
+                _filter, update_query = MongoDBDAO._get_workflow_update(curated_doc.copy())
+                requests.append(UpdateOne(filter=_filter, update=update_query, upsert=True))
+            self._wfs_collection.bulk_write(requests)
+            return True
+        except Exception as e:
+            self.logger.exception(e)
+            return False
+
     def to_df(self, collection="tasks", filter=None) -> pd.DataFrame:
         """
         Convert the contents of a MongoDB collection to a pandas DataFrame.
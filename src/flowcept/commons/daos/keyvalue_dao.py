@@ -50,6 +50,10 @@ class KeyValueDAO:
         """Set the key."""
         return self.redis_conn.sismember(set_name, key)
 
+    def set_members(self, set_name: str) -> set:
+        """Get the keys in a set, as strings."""
+        return {k.decode() if isinstance(k, bytes) else k for k in self.redis_conn.smembers(set_name)}
+
     def set_count(self, set_name: str):
         """Set the count."""
         return self.redis_conn.scard(set_name)
@@ -115,6 +119,30 @@ class KeyValueDAO:
         """
         self.redis_conn.delete(key)
 
+    def publish(self, channel: str, message):
+        """Publish a message on a Redis pub/sub channel."""
+        self.redis_conn.publish(channel, message)
+
+    def subscribe(self, channel: str, handler):
+        """
+        Call a handler for every message published on a Redis pub/sub channel.
+
+        Parameters
+        ----------
+        channel : str
+            The channel to subscribe to.
+        handler : Callable
+            Called, from a background thread, with each pub/sub message.
+
+        Returns
+        -------
+        PubSubWorkerThread
+            The background thread. Call its `stop` method to unsubscribe.
+        """
+        pubsub = self.redis_conn.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{channel: handler})
+        return pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+
     def liveness_test(self):
         """Get the livelyness of it."""
         try:
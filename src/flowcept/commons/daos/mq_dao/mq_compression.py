@@ -0,0 +1,32 @@
+"""MQ compression module.
+
+Payloads are compressed with the configured codec, in the format of `flowcept.commons.compression`, so
+consumers, which decompress them with it, can read payloads from mixed producers, regardless of their own
+compression settings.
+"""
+
+from flowcept.commons.compression import CODEC_IDS, compress as _compress, get_codec_id
+from flowcept.configs import MQ_COMPRESSION, MQ_COMPRESSION_MIN_SIZE
+
+_CODEC_ID = get_codec_id(MQ_COMPRESSION, "MQ compression")
+
+
+def compress(data: bytes, codec: str = None, min_size: int = None) -> bytes:
+    """Compress a serialized payload using the configured codec, if it is large enough.
+
+    Parameters
+    ----------
+    data : bytes
+        The serialized payload.
+    codec : str, optional
+        The codec to use instead of the configured one.
+    min_size : int, optional
+        The minimum size to compress instead of the configured one.
+
+    Returns
+    -------
+    bytes
+        The marked compressed payload, or the original payload.
+    """
+    codec_id = _CODEC_ID if codec is None else CODEC_IDS[codec]
+    return _compress(data, codec_id, MQ_COMPRESSION_MIN_SIZE if min_size is None else min_size)
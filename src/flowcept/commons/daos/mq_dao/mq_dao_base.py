@@ -1,12 +1,17 @@
 """MQ base module."""
 
 from abc import abstractmethod
-from typing import Union, List, Callable
-import csv
-import msgpack
-from time import time
+from threading import Lock, local
+from typing import Union, List, Callable, Dict
+import os
+from time import perf_counter
 import flowcept.commons
 from flowcept.commons.autoflush_buffer import AutoflushBuffer
+from flowcept.commons.daos.mq_dao.mq_compression import compress
+from flowcept.commons.daos.mq_dao.mq_serialization import dumps
+from flowcept.commons.daos.mq_dao.mq_string_table import intern_strings, expand_strings
+from flowcept.commons.daos.mq_dao.mq_wire_format import encode_task, decode_task, is_compact_task, get_field
+from flowcept.commons.flowcept_metrics import get_metrics, SIZE_BUCKETS
 from flowcept.commons.utils import chunked
 from flowcept.commons.flowcept_logger import FlowceptLogger
 from flowcept.configs import (
@@ -14,7 +19,17 @@ from flowcept.configs import (
     JSON_SERIALIZER,
     MQ_BUFFER_SIZE,
     MQ_INSERTION_BUFFER_TIME,
+    MQ_MAX_PENDING,
+    MQ_BACKPRESSURE_POLICY,
+    MQ_BLOCK_TIMEOUT,
+    MQ_SPILL_PATH,
+    MQ_SPILL_LOG_ENABLED,
+    MQ_SPILL_LOG_SETTINGS,
+    MQ_SHARD_KEY,
     MQ_CHUNK_SIZE,
+    MQ_ENVELOPE,
+    MQ_WIRE_FORMAT,
+    MQ_INTERN_STRINGS,
     MQ_TYPE,
     MQ_TIMING,
     KVDB_ENABLED,
@@ -30,6 +45,14 @@ class MQDao(object):
     ENCODER = GenericJSONEncoder if JSON_SERIALIZER == "complex" else None
     # TODO we don't have a unit test to cover complex dict!
 
+    ENVELOPE_TYPE = "flowcept_envelope"
+    CAMPAIGN_ID_KEY = "current_campaign_id"
+    # Changes of the current campaign id are published here, so consumers caching it can refresh it.
+    CAMPAIGN_ID_CHANNEL = "flowcept_current_campaign_id"
+    ENVELOPE_VERSION = 1
+    # Set by transports with acknowledgements on the messages whose ack is deferred to the consumer.
+    ACK_ID_FIELD = "_mq_ack_id"
+
     @staticmethod
     def build(*args, **kwargs) -> "MQDao":
         """Build it."""
@@ -40,6 +63,10 @@ class MQDao(object):
             from flowcept.commons.daos.mq_dao.mq_dao_redis import MQDaoRedis
 
             return MQDaoRedis(*args, **kwargs)
+        elif MQ_TYPE == "redis_streams":
+            from flowcept.commons.daos.mq_dao.mq_dao_redis_streams import MQDaoRedisStreams
+
+            return MQDaoRedisStreams(*args, **kwargs)
         elif MQ_TYPE == "kafka":
             from flowcept.commons.daos.mq_dao.mq_dao_kafka import MQDaoKafka
 
@@ -48,6 +75,10 @@ class MQDao(object):
             from flowcept.commons.daos.mq_dao.mq_dao_mofka import MQDaoMofka
 
             return MQDaoMofka(*args, **kwargs)
+        elif MQ_TYPE == "shm":
+            from flowcept.commons.daos.mq_dao.mq_dao_shm import MQDaoShm
+
+            return MQDaoShm(*args, **kwargs)
         else:
             raise NotImplementedError
 
@@ -65,6 +96,59 @@ class MQDao(object):
             set_id += "_" + str(exec_bundle_id)
         return set_id
 
+    @staticmethod
+    def pack_envelope(messages: List[Dict], strings: List[str] = None, interned_fields: List[str] = None) -> Dict:
+        """Pack many messages into a single envelope message, so they travel as one MQ frame.
+
+        :param messages: The messages to be packed, e.g., a flushed buffer or a chunk of it.
+        :param strings: The string table, if the messages were interned with `intern_strings`.
+        :param interned_fields: The fields interned in the messages.
+        :return: The envelope message.
+        """
+        envelope = {
+            "type": MQDao.ENVELOPE_TYPE,
+            "v": MQDao.ENVELOPE_VERSION,
+            "n": len(messages),
+            "msgs": messages,
+        }
+        if strings:
+            envelope["strings"] = strings
+            envelope["interned"] = interned_fields
+        return envelope
+
+    @staticmethod
+    def unpack_envelope(msg_obj) -> List[Dict]:
+        """Get the list of messages carried by a received message.
+
+        Tasks sent in the compact wire format are decoded back into dicts, and interned strings are expanded.
+
+        :param msg_obj: A deserialized MQ message, either an envelope or a regular message.
+        :return: The messages inside the envelope, or a single-element list with the regular message.
+        """
+        if isinstance(msg_obj, dict) and msg_obj.get("type") == MQDao.ENVELOPE_TYPE:
+            messages = [decode_task(m) if is_compact_task(m) else m for m in msg_obj["msgs"]]
+            if "strings" in msg_obj:
+                expand_strings(messages, msg_obj["strings"], msg_obj["interned"])
+            return messages
+        if is_compact_task(msg_obj):
+            return [decode_task(msg_obj)]
+        return [msg_obj]
+
+    @staticmethod
+    def dispatch(msg_obj, message_handler: Callable) -> bool:
+        """Hand the messages carried by a received message to the handler, until it asks to stop.
+
+        Stop messages are sent on their own, so no message of an envelope is expected after one.
+
+        :param msg_obj: A deserialized MQ message, either an envelope or a regular message.
+        :param message_handler: The consumer's message handler.
+        :return: False if the handler asked to break the listener loop, True otherwise.
+        """
+        for message in MQDao.unpack_envelope(msg_obj):
+            if not message_handler(message):
+                return False
+        return True
+
     def __init__(self, adapter_settings=None):
         self.logger = FlowceptLogger()
         self.started = False
@@ -77,29 +161,133 @@ class MQDao(object):
             self._keyvalue_dao = None
         self._time_based_flushing_started = False
         self.buffer: Union[AutoflushBuffer, List] = None
-        if MQ_TIMING:
-            self._flush_events = []
-            self.stop = self._stop_timed
-            self.send_message = self._send_message_timed
-            self._bulk_publish = self._bulk_publish_timed
-        else:
-            self.stop = self._stop
+        # If True, the consumer is responsible for calling `ack` once the messages are persisted.
+        self.ack_after_commit = False
+        # Per MQ entry (e.g., a stream entry or a Kafka message) tagged by `_defer_ack`, the number of its
+        # messages not acknowledged yet. An envelope is only acknowledged once all its messages are.
+        self._unacked_counts = {}
+        self._unacked_counts_lock = Lock()
+        self._spill_log = None
+        self._spill_log_replayer = None
+        # Set by DAOs that spread messages across MQ_INSTANCES.
+        self._shard_ring = None
+        # Bytes serialized by `_encode` so far, per thread, to measure the size of each publish while
+        # other threads (e.g., the spill log replayer) encode messages too.
+        self._encoded = local()
+        metrics = get_metrics()
+        self._published_msgs_metric = metrics.counter(
+            "flowcept_mq_published_messages_total", "Messages published to the MQ.", mq=MQ_TYPE
+        )
+        self._published_bytes_metric = metrics.counter(
+            "flowcept_mq_published_bytes_total", "Bytes published to the MQ, after compression.", mq=MQ_TYPE
+        )
+        self._publish_errors_metric = metrics.counter(
+            "flowcept_mq_publish_errors_total", "Publishes the MQ could not take.", mq=MQ_TYPE
+        )
+        self._dropped_msgs_metric = metrics.counter(
+            "flowcept_mq_dropped_messages_total", "Messages dropped as they could not be routed or encoded.", mq=MQ_TYPE
+        )
+        self._publish_latency_metric = metrics.histogram(
+            "flowcept_mq_publish_seconds", "Duration of each publish to the MQ.", mq=MQ_TYPE
+        )
+        self._publish_size_metric = metrics.histogram(
+            "flowcept_mq_publish_bytes", "Bytes sent by each publish to the MQ.", buckets=SIZE_BUCKETS, mq=MQ_TYPE
+        )
+        self.stop = self._stop_timed if MQ_TIMING else self._stop
 
     @abstractmethod
-    def _bulk_publish(self, buffer, channel=MQ_CHANNEL, serializer=msgpack.dumps):
+    def _bulk_publish(self, buffer, channel=MQ_CHANNEL, serializer=dumps) -> bool:
+        """Publish many messages at once, returning False if the MQ could not take them."""
         raise NotImplementedError()
 
-    def _bulk_publish_timed(self, buffer, channel=MQ_CHANNEL, serializer=msgpack.dumps):
-        raise NotImplementedError()
+    def _encode(self, message, serializer=dumps) -> bytes:
+        """Serialize and compress a message to be sent to the MQ."""
+        data = compress(serializer(message))
+        self._encoded.bytes = self._get_encoded_bytes() + len(data)
+        return data
+
+    def _get_encoded_bytes(self) -> int:
+        """Get the bytes serialized by `_encode` so far in the current thread."""
+        return getattr(self._encoded, "bytes", 0)
+
+    def _get_shard(self, message) -> int:
+        """Get the index of the MQ instance a message should be published to."""
+        if self._shard_ring is None:
+            return 0
+        strings = None
+        if isinstance(message, dict) and message.get("type") == MQDao.ENVELOPE_TYPE and len(message["msgs"]):
+            strings = message.get("strings")
+            message = message["msgs"][0]
+        key = MQDao._get_shard_key(message, strings)
+        return 0 if key is None else self._shard_ring.get_shard(key)
+
+    @staticmethod
+    def _get_shard_key(message, strings: List[str] = None):
+        """Get the value messages are sharded by, reading compact tasks without decoding them.
+
+        :param message: A message, as a dict or in the compact wire format.
+        :param strings: The string table of the message's envelope, to resolve values interned by `intern_strings`.
+        :return: The value of the shard key, or of the task id if the message has no shard key.
+        """
+        for field in (MQ_SHARD_KEY, "task_id"):
+            if is_compact_task(message):
+                value = get_field(message, field)
+            elif isinstance(message, dict):
+                value = message.get(field)
+            else:
+                return None
+            if strings and isinstance(value, int):
+                value = strings[value]
+            if value:
+                return value
+        return None
+
+    def _split_by_shard(self, messages: List) -> List[List]:
+        if self._shard_ring is None:
+            return [messages]
+        shards = {}
+        for message in messages:
+            shards.setdefault(self._get_shard(message), []).append(message)
+        return list(shards.values())
 
     def bulk_publish(self, buffer):
         """Publish it."""
         # self.logger.info(f"Going to flush {len(buffer)} to MQ...")
-        if MQ_CHUNK_SIZE > 1:
-            for chunk in chunked(buffer, MQ_CHUNK_SIZE):
-                self._bulk_publish(chunk)
-        else:
-            self._bulk_publish(buffer)
+        chunks = chunked(buffer, MQ_CHUNK_SIZE) if MQ_CHUNK_SIZE > 1 else [buffer]
+        for chunk in chunks:
+            # Envelopes must not mix messages of different shards.
+            for shard_chunk in self._split_by_shard(chunk):
+                messages, strings, interned_fields = shard_chunk, None, None
+                if MQ_INTERN_STRINGS:
+                    messages, strings, interned_fields = intern_strings(messages)
+                if MQ_WIRE_FORMAT == "compact":
+                    messages = [encode_task(m) for m in messages]
+                if MQ_ENVELOPE or MQ_INTERN_STRINGS:
+                    messages = [MQDao.pack_envelope(messages, strings, interned_fields)]
+                encoded_bytes = self._get_encoded_bytes()
+                t0 = perf_counter()
+                published = self._bulk_publish(messages)
+                self._publish_latency_metric.observe(perf_counter() - t0)
+                if published:
+                    self._published_msgs_metric.inc(len(shard_chunk))
+                    encoded_bytes = self._get_encoded_bytes() - encoded_bytes
+                    self._published_bytes_metric.inc(encoded_bytes)
+                    self._publish_size_metric.observe(encoded_bytes)
+                    continue
+                self._publish_errors_metric.inc()
+                if self._spill_log is not None:
+                    self._spill_log.append(messages)
+                    self.logger.warning(f"Could not publish {len(messages)} msgs to MQ. Spilled them to disk.")
+
+    def _publish_spilled(self, messages: List) -> bool:
+        """Publish spilled messages, spilling again only the messages of the MQ instances that could not take them."""
+        shard_chunks = self._split_by_shard(messages)
+        failed = [shard_chunk for shard_chunk in shard_chunks if not self._bulk_publish(shard_chunk)]
+        if len(failed) == len(shard_chunks):
+            return False
+        for shard_chunk in failed:
+            self._spill_log.append(shard_chunk)
+        return True
 
     def register_time_based_thread_init(self, interceptor_instance_id: str, exec_bundle_id=None):
         """Register the time."""
@@ -116,6 +304,11 @@ class MQDao(object):
         self._keyvalue_dao.remove_key_from_set(set_name, interceptor_instance_id)
         self.logger.info(f"Done registering time_based MQ flush thread {set_name}.{interceptor_instance_id}")
 
+    def get_time_based_threads(self, exec_bundle_id=None) -> set:
+        """Get the ids of the interceptors whose time-based threads started and did not register their end."""
+        set_name = MQDao._get_set_name(exec_bundle_id)
+        return self._keyvalue_dao.set_members(set_name)
+
     def all_time_based_threads_ended(self, exec_bundle_id=None):
         """Get all time."""
         set_name = MQDao._get_set_name(exec_bundle_id)
@@ -137,22 +330,56 @@ class MQDao(object):
         -------
         None
         """
-        self._keyvalue_dao.set_key_value("current_campaign_id", campaign_id)
+        self._keyvalue_dao.set_key_value(MQDao.CAMPAIGN_ID_KEY, campaign_id)
+        self._keyvalue_dao.publish(MQDao.CAMPAIGN_ID_CHANNEL, campaign_id or "")
 
     def delete_current_campaign_id(self):
         """
         Delete current campaign id.
         """
-        self._keyvalue_dao.delete_key("current_campaign_id")
+        self._keyvalue_dao.delete_key(MQDao.CAMPAIGN_ID_KEY)
+        self._keyvalue_dao.publish(MQDao.CAMPAIGN_ID_CHANNEL, "")
+
+    def _start_spill_log(self):
+        from flowcept.commons.daos.mq_dao.mq_spill_log import MQSpillLog, MQSpillLogReplayer
+
+        self._spill_log = MQSpillLog(
+            path=MQ_SPILL_LOG_SETTINGS.get("path", "flowcept_mq_spill_log"),
+            segment_size=int(MQ_SPILL_LOG_SETTINGS.get("segment_size_mb", 64) * 1024**2),
+            max_size=int(MQ_SPILL_LOG_SETTINGS.get("max_size_mb", 1024) * 1024**2),
+        )
+        self._spill_log_replayer = MQSpillLogReplayer(
+            self._spill_log,
+            publish_function=self._publish_spilled,
+            liveness_test=self.liveness_test,
+            interval=MQ_SPILL_LOG_SETTINGS.get("replay_interval_secs", 5),
+            batch_size=int(MQ_SPILL_LOG_SETTINGS.get("replay_batch_size", 1000)),
+        )
+
+    def _stop_spill_log(self):
+        if self._spill_log_replayer is not None:
+            self._spill_log_replayer.stop()
+            if not self._spill_log.is_empty():
+                self.logger.warning("MQ is still not reachable. Spilled messages will be replayed by a later run.")
+            self._spill_log_replayer = None
+            self._spill_log = None
 
     def init_buffer(self, interceptor_instance_id: str, exec_bundle_id=None, check_safe_stops=True):
         """Create the buffer."""
         if not self.started:
             if flowcept.configs.DB_FLUSH_MODE == "online":
+                if MQ_SPILL_LOG_ENABLED:
+                    self._start_spill_log()
+                _spill_dir, _spill_file = os.path.split(MQ_SPILL_PATH)
                 self.buffer = AutoflushBuffer(
                     flush_function=self.bulk_publish,
+                    name="mq",
                     max_size=MQ_BUFFER_SIZE,
                     flush_interval=MQ_INSERTION_BUFFER_TIME,
+                    max_pending=MQ_MAX_PENDING,
+                    backpressure_policy=MQ_BACKPRESSURE_POLICY,
+                    block_timeout=MQ_BLOCK_TIMEOUT,
+                    spill_path=os.path.join(_spill_dir, f"{interceptor_instance_id}_{_spill_file}"),
                 )
                 if check_safe_stops:
                     self.register_time_based_thread_init(interceptor_instance_id, exec_bundle_id)
@@ -172,32 +399,45 @@ class MQDao(object):
             if self._time_based_flushing_started:
                 self.buffer.stop()
                 self._time_based_flushing_started = False
+                if self.buffer.dropped_count or self.buffer.blocked_count or self.buffer.spilled_count:
+                    self.logger.warning(
+                        f"MQ buffer backpressure: dropped={self.buffer.dropped_count}, "
+                        f"blocked={self.buffer.blocked_count}, spilled={self.buffer.spilled_count}."
+                    )
             else:
                 self.logger.error("MQ time-based flushing is not started")
         else:
             self.buffer = list()
 
     def _stop_timed(self, interceptor_instance_id: str, check_safe_stops: bool = True, bundle_exec_id: int = None):
-        t1 = time()
+        """Stop MQ publisher, dumping the process' metrics to a JSON file."""
+        t0 = perf_counter()
         self._stop(interceptor_instance_id, check_safe_stops, bundle_exec_id)
-        t2 = time()
-        self._flush_events.append(["final", t1, t2, t2 - t1, "n/a"])
-
-        with open(f"{MQ_TYPE}_{interceptor_instance_id}_{MQ_TYPE}_flush_events.csv", "w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["type", "start", "end", "duration", "size"])
-            writer.writerows(self._flush_events)
+        get_metrics().histogram(
+            "flowcept_mq_stop_seconds", "Duration of the final flush of MQ publishers.", mq=MQ_TYPE
+        ).observe(perf_counter() - t0)
+        with open(f"{MQ_TYPE}_{interceptor_instance_id}_metrics.json", "w") as file:
+            file.write(get_metrics().to_json())
 
     def _stop(self, interceptor_instance_id: str = None, check_safe_stops: bool = True, bundle_exec_id: int = None):
         """Stop MQ publisher."""
         self.logger.debug(f"MQ pub received stop sign: bundle={bundle_exec_id}, interceptor={interceptor_instance_id}")
         self._close_buffer()
+        self._flush_producer()
+        self._stop_spill_log()
         self.logger.debug("Flushed MQ for the last time!")
         if check_safe_stops:
             self.logger.debug(f"Sending stop msg. Bundle: {bundle_exec_id}; interceptor id: {interceptor_instance_id}")
             self._send_mq_dao_time_thread_stop(interceptor_instance_id, bundle_exec_id)
         self.started = False
 
+    def _flush_producer(self):
+        """Wait for the messages queued by the MQ client to be delivered, before the spill log is closed.
+
+        DAOs whose client delivers messages in the background spill the ones it could not deliver here.
+        """
+        pass
+
     def _send_mq_dao_time_thread_stop(self, interceptor_instance_id, exec_bundle_id=None):
         # These control_messages are handled by the document inserter
         # TODO: these should be constants
@@ -217,12 +457,7 @@ class MQDao(object):
         self.send_message(msg)
 
     @abstractmethod
-    def send_message(self, message: dict, channel=MQ_CHANNEL, serializer=msgpack.dumps):
-        """Send a message."""
-        raise NotImplementedError()
-
-    @abstractmethod
-    def _send_message_timed(self, message: dict, channel=MQ_CHANNEL, serializer=msgpack.dumps):
+    def send_message(self, message: dict, channel=MQ_CHANNEL, serializer=dumps):
         """Send a message."""
         raise NotImplementedError()
 
@@ -241,6 +476,49 @@ class MQDao(object):
         """Subscribe to the interception channel."""
         raise NotImplementedError()
 
+    def ack(self, ack_ids: List):
+        """Acknowledge consumed messages, given their ACK_ID_FIELD values.
+
+        Transports without acknowledgements ignore this.
+        """
+        pass
+
+    def _defer_ack(self, messages: List, ack_id) -> bool:
+        """Tag every message of an MQ entry with the entry's ack id, so each one is acknowledged once persisted.
+
+        :param messages: The messages carried by the entry.
+        :param ack_id: The hashable id that acknowledges the entry.
+        :return: False if the entry has no messages to tag, so it can be acknowledged right away.
+        """
+        messages = [m for m in messages if isinstance(m, dict)]
+        if not len(messages):
+            return False
+        # A redelivered entry replaces the count of its earlier delivery.
+        with self._unacked_counts_lock:
+            self._unacked_counts[ack_id] = len(messages)
+        for message in messages:
+            message[MQDao.ACK_ID_FIELD] = ack_id
+        return True
+
+    def _completed_acks(self, ack_ids: List) -> List:
+        """Count acknowledged messages, returning the ids of the entries whose messages were all acknowledged.
+
+        :param ack_ids: The ACK_ID_FIELD values of the acknowledged messages, one per message.
+        :return: The ack ids of the completed entries.
+        """
+        completed = []
+        with self._unacked_counts_lock:
+            for ack_id in ack_ids:
+                count = self._unacked_counts.get(ack_id)
+                if count is None:
+                    continue
+                if count > 1:
+                    self._unacked_counts[ack_id] = count - 1
+                else:
+                    del self._unacked_counts[ack_id]
+                    completed.append(ack_id)
+        return completed
+
     @abstractmethod
     def liveness_test(self) -> bool:
         """Checks if the MQ system is alive."""
@@ -1,109 +1,248 @@
 """MQ kafka module."""
 
-from typing import Callable
-from time import time
-import msgpack
+from threading import Lock
+from typing import Callable, List
 
-from confluent_kafka import Producer, Consumer, KafkaError
+from confluent_kafka import Producer, Consumer, KafkaError, TopicPartition
 from confluent_kafka.admin import AdminClient
 
 from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.compression import decompress
+from flowcept.commons.daos.mq_dao.mq_serialization import dumps, loads
+from flowcept.commons.daos.mq_dao.mq_wire_format import get_field, is_compact_task
 from flowcept.configs import (
     MQ_CHANNEL,
     MQ_HOST,
     MQ_PORT,
+    MQ_SETTINGS,
 )
 
 
 class MQDaoKafka(MQDao):
     """MQ kafka class."""
 
-    def __init__(self, adapter_settings=None):
+    def __init__(self, adapter_settings=None, mq_host=None, mq_port=None):
         super().__init__(adapter_settings)
 
         self._kafka_conf = {
-            "bootstrap.servers": f"{MQ_HOST}:{MQ_PORT}",
+            "bootstrap.servers": f"{mq_host or MQ_HOST}:{mq_port or MQ_PORT}",
         }
-        self._producer = Producer(self._kafka_conf)
+        # If async, produce calls never wait for the broker: failed deliveries are retried and
+        # the producer is only flushed on stop.
+        self._async_producer = MQ_SETTINGS.get("async_producer", False)
+        # Max time to wait for the broker to take the messages of a flush.
+        self._flush_timeout = float(MQ_SETTINGS.get("flush_timeout_secs", 30))
+        # Any librdkafka producer property, e.g., linger.ms, batch.num.messages, compression.type.
+        producer_conf = dict(MQ_SETTINGS.get("producer_conf", {}))
+        self._producer = Producer({**self._kafka_conf, **producer_conf})
+        self._failed_deliveries = []
+        self._failed_deliveries_lock = Lock()
         self._consumer = None
+        self._consume_batch_size = int(MQ_SETTINGS.get("consume_batch_size", 1000))
+        self._consume_timeout = float(MQ_SETTINGS.get("consume_timeout_secs", 1.0))
+        # Per partition: offsets handed to the consumer but not acknowledged yet, and the last offset handed.
+        self._outstanding_offsets = {}
+        self._last_offsets = {}
+        self._offsets_lock = Lock()
 
     def subscribe(self):
         """Subscribe to the interception channel."""
         self._kafka_conf.update(
             {
-                "group.id": "my_group",
+                "group.id": MQ_SETTINGS.get("group_id", "my_group"),
                 "auto.offset.reset": "earliest",
-                "enable.auto.commit": True,
+                # If the consumer acknowledges messages once persisted, offsets are only committed then.
+                "enable.auto.commit": not self.ack_after_commit,
             }
         )
         self._consumer = Consumer(self._kafka_conf)
         self._consumer.subscribe([MQ_CHANNEL])
 
+    def consume(self, num_messages: int, timeout: float) -> List:
+        """Consume a batch of up to num_messages Kafka messages, waiting at most timeout seconds."""
+        msgs = self._consumer.consume(num_messages=num_messages, timeout=timeout)
+        valid_msgs = []
+        for msg in msgs:
+            if msg.error():
+                if msg.error().code() == KafkaError._PARTITION_EOF:
+                    continue
+                raise Exception(f"Consumer error: {msg.error()}")
+            valid_msgs.append(msg)
+        return valid_msgs
+
+    def _handle_batch(self, msgs: List, message_handler: Callable) -> bool:
+        should_continue = True
+        for msg in msgs:
+            message = loads(decompress(msg.value()))
+            messages = MQDao.unpack_envelope(message)
+            if self.ack_after_commit:
+                # Each message is acknowledged once persisted, and the Kafka message once all its messages are.
+                ack_id = self._track_offset(msg)
+                if not self._defer_ack(messages, ack_id):
+                    self.ack([ack_id])
+            for m in messages:
+                if not message_handler(m):
+                    should_continue = False
+        return should_continue
+
     def message_listener(self, message_handler: Callable):
-        """Get message listener."""
+        """Get message listener.
+
+        The consumer is only closed by `unsubscribe`, so the messages persisted after the
+        listener returns (e.g., by a final flush) can still be acknowledged.
+        """
         try:
             while True:
-                msg = self._consumer.poll(1.0)
-                if msg is None:
-                    continue
-                if msg.error():
-                    if msg.error().code() == KafkaError._PARTITION_EOF:
-                        continue
-                    else:
-                        self.logger.error(f"Consumer error: {msg.error()}")
-                        break
-                message = msgpack.loads(msg.value(), raw=False, strict_map_key=False)
-                self.logger.debug(f"Received message: {message}")
-                if not message_handler(message):
+                msgs = self.consume(self._consume_batch_size, self._consume_timeout)
+                if not self._handle_batch(msgs, message_handler):
+                    self._drain(message_handler)
                     break
         except Exception as e:
             self.logger.exception(e)
-        finally:
-            self._consumer.close()
 
-    def send_message(self, message: dict, channel=MQ_CHANNEL, serializer=msgpack.dumps):
-        """Send the message."""
-        self._producer.produce(channel, key=channel, value=serializer(message))
-        self._producer.flush()
+    def _drain(self, message_handler: Callable):
+        """Handle what is left in the other partitions, as messages are only ordered within a partition."""
+        msgs = self.consume(self._consume_batch_size, self._consume_timeout)
+        while len(msgs):
+            self._handle_batch(msgs, message_handler)
+            msgs = self.consume(self._consume_batch_size, self._consume_timeout)
 
-    def _send_message_timed(self, message: dict, channel=MQ_CHANNEL, serializer=msgpack.dumps):
-        t1 = time()
-        self.send_message(message, channel, serializer)
-        t2 = time()
-        self._flush_events.append(["single", t1, t2, t2 - t1, len(str(message).encode())])
+    def _track_offset(self, msg):
+        partition = (msg.topic(), msg.partition())
+        with self._offsets_lock:
+            self._outstanding_offsets.setdefault(partition, set()).add(msg.offset())
+            self._last_offsets[partition] = msg.offset()
+        return msg.topic(), msg.partition(), msg.offset()
 
-    def _bulk_publish(self, buffer, channel=MQ_CHANNEL, serializer=msgpack.dumps):
-        for message in buffer:
-            try:
-                self._producer.produce(channel, key=channel, value=serializer(message))
-            except Exception as e:
-                self.logger.exception(e)
-                self.logger.error("Some messages couldn't be flushed! Check the messages' contents!")
-                self.logger.error(f"Message that caused error: {message}")
+    def ack(self, ack_ids: List):
+        """Commit the offsets of persisted messages, once all messages of a Kafka message are persisted.
+
+        A partition's offset only moves up to its oldest message not yet persisted, since
+        committing an offset also commits every message before it.
+        """
+        partitions = set()
+        with self._offsets_lock:
+            for topic, partition, offset in self._completed_acks(ack_ids):
+                self._outstanding_offsets.get((topic, partition), set()).discard(offset)
+                partitions.add((topic, partition))
+        self._commit(partitions, asynchronous=True)
+
+    def _commit(self, partitions, asynchronous: bool):
+        if not len(partitions) or self._consumer is None:
+            return
+        with self._offsets_lock:
+            offsets = []
+            for partition in partitions:
+                outstanding = self._outstanding_offsets.get(partition)
+                commit_offset = min(outstanding) if outstanding else self._last_offsets[partition] + 1
+                offsets.append(TopicPartition(partition[0], partition[1], commit_offset))
         try:
-            self._producer.flush()
-            self.logger.info(f"Flushed {len(buffer)} msgs to MQ!")
+            self._consumer.commit(offsets=offsets, asynchronous=asynchronous)
         except Exception as e:
             self.logger.exception(e)
 
-    def _bulk_publish_timed(self, buffer, channel=MQ_CHANNEL, serializer=msgpack.dumps):
-        total = 0
+    @staticmethod
+    def _get_key(message, channel):
+        """Key messages by workflow, so they are ordered per workflow while partitions spread the load."""
+        strings = None
+        if isinstance(message, dict) and message.get("type") == MQDao.ENVELOPE_TYPE and len(message["msgs"]):
+            strings = message.get("strings")
+            message = message["msgs"][0]
+        if is_compact_task(message):
+            workflow_id = get_field(message, "workflow_id")
+        elif isinstance(message, dict):
+            workflow_id = message.get("workflow_id")
+        else:
+            workflow_id = None
+        if workflow_id is None or workflow_id == "":
+            return channel
+        if strings is not None and isinstance(workflow_id, int):
+            # Interned by intern_strings.
+            workflow_id = strings[workflow_id]
+        return str(workflow_id)
+
+    def _on_delivery(self, err, msg):
+        if err is not None:
+            with self._failed_deliveries_lock:
+                self._failed_deliveries.append((msg.topic(), msg.key(), msg.value()))
+
+    def _produce(self, topic, key, value):
+        try:
+            self._producer.produce(topic, key=key, value=value, on_delivery=self._on_delivery)
+        except BufferError:
+            # The local queue is full: serving delivery reports to make room, then trying again.
+            self._producer.poll(1)
+            self._producer.produce(topic, key=key, value=value, on_delivery=self._on_delivery)
+
+    def _retry_failed_deliveries(self):
+        with self._failed_deliveries_lock:
+            failed, self._failed_deliveries = self._failed_deliveries, []
+        if len(failed):
+            self.logger.warning(f"Retrying {len(failed)} msgs that failed to be delivered to Kafka.")
+        for topic, key, value in failed:
+            self._produce(topic, key, value)
+
+    def send_message(self, message: dict, channel=MQ_CHANNEL, serializer=dumps):
+        """Send the message."""
+        self._produce(channel, self._get_key(message, channel), self._encode(message, serializer))
+        if self._async_producer:
+            self._producer.poll(0)
+        else:
+            self._producer.flush(self._flush_timeout)
+
+    def send_document_inserter_stop(self, exec_bundle_id=None):
+        """Send the stop message, making sure it reaches the broker."""
+        super().send_document_inserter_stop(exec_bundle_id)
+        self._producer.flush(self._flush_timeout)
+
+    def _flush_producer(self):
+        """Flush the producer, spilling the messages it could not deliver."""
+        self._producer.flush(self._flush_timeout)
+        self._retry_failed_deliveries()
+        undelivered = self._producer.flush(self._flush_timeout)
+        if undelivered:
+            self.logger.error(f"{undelivered} msgs were still not delivered to Kafka after {self._flush_timeout}s.")
+        with self._failed_deliveries_lock:
+            failed, self._failed_deliveries = self._failed_deliveries, []
+        if len(failed):
+            messages = [loads(decompress(value), native=True) for _, _, value in failed]
+            if self._spill_log is not None:
+                self._spill_log.append(messages)
+                self.logger.warning(f"Could not deliver {len(failed)} msgs to Kafka. Spilled them to disk.")
+            else:
+                self.logger.error(f"Could not deliver {len(failed)} msgs to Kafka.")
+
+    def _bulk_publish(self, buffer, channel=MQ_CHANNEL, serializer=dumps):
+        self._retry_failed_deliveries()
         for message in buffer:
             try:
-                self._producer.produce(channel, key=channel, value=serializer(message))
-                total += len(str(message).encode())
+                self._produce(channel, self._get_key(message, channel), self._encode(message, serializer))
             except Exception as e:
                 self.logger.exception(e)
                 self.logger.error("Some messages couldn't be flushed! Check the messages' contents!")
                 self.logger.error(f"Message that caused error: {message}")
+                self._dropped_msgs_metric.inc()
+        if self._async_producer:
+            self._producer.poll(0)
+            return True
         try:
-            t1 = time()
-            self._producer.flush()
-            t2 = time()
-            self._flush_events.append(["bulk", t1, t2, t2 - t1, total])
-            self.logger.info(f"Flushed {len(buffer)} msgs to MQ!")
+            # Messages still queued after the timeout are not lost yet, but may not be delivered.
+            undelivered = self._producer.flush(self._flush_timeout)
         except Exception as e:
             self.logger.exception(e)
+            return False
+        # The batch is reported as failed, to be spilled or republished as a whole, so its failed
+        # deliveries are not retried again here.
+        with self._failed_deliveries_lock:
+            failed, self._failed_deliveries = self._failed_deliveries, []
+        if undelivered or len(failed):
+            self.logger.error(
+                f"Could not deliver {undelivered + len(failed)} of {len(buffer)} msgs to Kafka: "
+                f"{len(failed)} failed, {undelivered} timed out."
+            )
+            return False
+        self.logger.info(f"Flushed {len(buffer)} msgs to MQ!")
+        return True
 
     def liveness_test(self):
         """Get the livelyness of it."""
@@ -121,6 +260,9 @@ class MQDaoKafka(MQDao):
             self.logger.warning("No Kafka consumer to unsubscribe.")
             return
 
+        if self.ack_after_commit:
+            # Making sure the latest acknowledgements are committed before the consumer goes away.
+            self._commit(list(self._last_offsets), asynchronous=False)
         try:
             self._consumer.unsubscribe()
             self.logger.info("Unsubscribed from Kafka topics.")
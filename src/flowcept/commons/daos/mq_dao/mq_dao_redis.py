@@ -1,14 +1,26 @@
 """MQ redis module."""
 
-from typing import Callable
+from typing import Callable, List
 import redis
 
-import msgpack
-from time import time, sleep
+from time import sleep
 
 from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.compression import decompress
+from flowcept.commons.daos.mq_dao.mq_serialization import dumps, loads
+from flowcept.commons.daos.mq_dao.mq_sharding import ConsistentHashRing
 from flowcept.commons.daos.redis_conn import RedisConn
-from flowcept.configs import MQ_CHANNEL, MQ_HOST, MQ_PORT, MQ_PASSWORD, MQ_URI, MQ_SETTINGS, KVDB_ENABLED
+from flowcept.configs import (
+    MQ_CHANNEL,
+    MQ_HOST,
+    MQ_PORT,
+    MQ_PASSWORD,
+    MQ_URI,
+    MQ_SETTINGS,
+    KVDB_ENABLED,
+    MQ_INSTANCES,
+    MQ_SHARDING,
+)
 
 
 class MQDaoRedis(MQDao):
@@ -16,12 +28,15 @@ class MQDaoRedis(MQDao):
 
     MESSAGE_TYPES_IGNORE = {"psubscribe"}
 
-    def __init__(self, adapter_settings=None):
+    def __init__(self, adapter_settings=None, mq_host=None, mq_port=None):
         super().__init__(adapter_settings)
 
         self._consumer = None
         use_same_as_kv = MQ_SETTINGS.get("same_as_kvdb", False)
-        if use_same_as_kv:
+        if mq_host is not None:
+            # A specific MQ instance, e.g., one of MQ_INSTANCES.
+            self._producer = RedisConn.build_redis_conn_pool(host=mq_host, port=mq_port, password=MQ_PASSWORD)
+        elif use_same_as_kv:
             if KVDB_ENABLED:
                 self._producer = self._keyvalue_dao.redis_conn
             else:
@@ -30,6 +45,27 @@ class MQDaoRedis(MQDao):
             self._producer = RedisConn.build_redis_conn_pool(
                 host=MQ_HOST, port=MQ_PORT, password=MQ_PASSWORD, uri=MQ_URI
             )
+        # Connections messages are published to. If sharding, one per MQ instance, indexed by shard.
+        self._producers = [self._producer]
+        if MQ_SHARDING and MQ_INSTANCES is not None and len(MQ_INSTANCES) > 1:
+            self._producers = []
+            for mq_host_port in MQ_INSTANCES:
+                host, port = mq_host_port.split(":")
+                self._producers.append(RedisConn.build_redis_conn_pool(host=host, port=int(port), password=MQ_PASSWORD))
+            self._shard_ring = ConsistentHashRing(list(MQ_INSTANCES))
+
+    def _get_producers(self, message) -> List:
+        """Get the connections a message should be published to. Control messages go to every MQ instance."""
+        if len(self._producers) > 1 and isinstance(message, dict) and message.get("type") == "flowcept_control":
+            return self._producers
+        return [self._producers[self._get_shard(message)]]
+
+    def _get_pipeline(self, pipes, message):
+        """Get the pipeline of the MQ instance a message should be published to, creating it if needed."""
+        shard = self._get_shard(message)
+        if shard not in pipes:
+            pipes[shard] = self._producers[shard].pipeline()
+        return pipes[shard]
 
     def subscribe(self):
         """
@@ -62,9 +98,9 @@ class MQDaoRedis(MQDao):
                         continue
 
                     try:
-                        msg_obj = msgpack.loads(message["data"], strict_map_key=False)
+                        msg_obj = loads(decompress(message["data"]))
                         # self.logger.debug(f"In mq dao redis, received msg!  {msg_obj}")
-                        if not message_handler(msg_obj):
+                        if not MQDao.dispatch(msg_obj, message_handler):
                             should_continue = False  # Break While loop
                             break  # Break For loop
                     except Exception as e:
@@ -81,56 +117,36 @@ class MQDaoRedis(MQDao):
                 self.logger.exception(e)
                 continue
 
-    def send_message(self, message: dict, channel=MQ_CHANNEL, serializer=msgpack.dumps):
+    def send_message(self, message: dict, channel=MQ_CHANNEL, serializer=dumps):
         """Send the message."""
-        self._producer.publish(channel, serializer(message))
+        data = self._encode(message, serializer)
+        for producer in self._get_producers(message):
+            producer.publish(channel, data)
 
-    def _send_message_timed(self, message: dict, channel=MQ_CHANNEL, serializer=msgpack.dumps):
-        """Send the message using timing for performance evaluation."""
-        t1 = time()
-        self.send_message(message, channel, serializer)
-        t2 = time()
-        self._flush_events.append(["single", t1, t2, t2 - t1, len(str(message).encode())])
-
-    def _bulk_publish(self, buffer, channel=MQ_CHANNEL, serializer=msgpack.dumps):
-        pipe = self._producer.pipeline()
+    def _bulk_publish(self, buffer, channel=MQ_CHANNEL, serializer=dumps):
+        pipes = {}
         for message in buffer:
             try:
-                pipe.publish(channel, serializer(message))
+                self._get_pipeline(pipes, message).publish(channel, self._encode(message, serializer))
             except Exception as e:
                 self.logger.exception(e)
                 self.logger.error("Some messages couldn't be flushed! Check the messages' contents!")
                 self.logger.error(f"Message that caused error: {message}")
+                self._dropped_msgs_metric.inc()
         try:
-            pipe.execute()
-            self.logger.debug(f"Flushed {len(buffer)} msgs to MQ!")
-        except Exception as e:
-            self.logger.exception(e)
-
-    def _bulk_publish_timed(self, buffer, channel=MQ_CHANNEL, serializer=msgpack.dumps):
-        total = 0
-        pipe = self._producer.pipeline()
-        for message in buffer:
-            try:
-                total += len(str(message).encode())
-                pipe.publish(channel, serializer(message))
-            except Exception as e:
-                self.logger.exception(e)
-                self.logger.error("Some messages couldn't be flushed! Check the messages' contents!")
-                self.logger.error(f"Message that caused error: {message}")
-        try:
-            t1 = time()
-            pipe.execute()
-            t2 = time()
-            self._flush_events.append(["bulk", t1, t2, t2 - t1, total])
+            for pipe in pipes.values():
+                pipe.execute()
             self.logger.debug(f"Flushed {len(buffer)} msgs to MQ!")
+            return True
         except Exception as e:
             self.logger.exception(e)
+            return False
 
     def liveness_test(self):
         """Get the livelyness of it."""
         try:
-            response = self._producer.ping()
+            # Alive only if every MQ instance messages may be routed to is.
+            response = all(producer.ping() for producer in self._producers)
             if response:
                 return True
             else:
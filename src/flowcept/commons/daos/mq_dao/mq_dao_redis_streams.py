@@ -0,0 +1,188 @@
+"""MQ redis streams module."""
+
+import os
+from typing import Callable, List
+import redis
+
+from time import sleep
+
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.compression import decompress
+from flowcept.commons.daos.mq_dao.mq_serialization import dumps, loads
+from flowcept.commons.daos.mq_dao.mq_dao_redis import MQDaoRedis
+from flowcept.configs import MQ_CHANNEL, MQ_SETTINGS, HOSTNAME
+
+
+class MQDaoRedisStreams(MQDaoRedis):
+    """MQ redis class based on Redis Streams and consumer groups.
+
+    Unlike pub/sub, entries stay in the stream until they are acknowledged, so a slow or
+    restarting consumer does not lose messages, and several consumers in the same group
+    share the load of one channel.
+    """
+
+    def __init__(self, adapter_settings=None, mq_host=None, mq_port=None):
+        super().__init__(adapter_settings, mq_host=mq_host, mq_port=mq_port)
+        self._stream = MQ_CHANNEL
+        # Control messages that every consumer in the group needs to see (e.g., stop_document_inserter).
+        self._control_stream = f"{MQ_CHANNEL}_control"
+        self._max_len = int(MQ_SETTINGS.get("stream_max_len", 1_000_000))
+        self._group = MQ_SETTINGS.get("stream_group", "flowcept_inserters")
+        self._claim_idle_ms = int(MQ_SETTINGS.get("stream_claim_idle_ms", 60_000))
+        self._read_count = int(MQ_SETTINGS.get("stream_read_count", 1000))
+        self._block_ms = int(MQ_SETTINGS.get("stream_block_ms", 100))
+        self._consumer_name = f"{HOSTNAME}_{os.getpid()}_{id(self)}"
+        self._control_last_id = "$"
+
+    def subscribe(self):
+        """
+        Join the consumer group, creating it and the stream if needed.
+        """
+        try:
+            self._producer.xgroup_create(self._stream, self._group, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise e
+        # Taking over entries that were delivered to consumers that died before acknowledging them.
+        try:
+            self._producer.xautoclaim(
+                self._stream,
+                self._group,
+                self._consumer_name,
+                min_idle_time=self._claim_idle_ms,
+                count=self._read_count,
+            )
+        except redis.exceptions.ResponseError as e:
+            self.logger.warning(f"Could not claim pending stream entries: {e}")
+        last_control_entry = self._producer.xrevrange(self._control_stream, count=1)
+        self._control_last_id = last_control_entry[0][0] if last_control_entry else "0"
+
+    def unsubscribe(self):
+        """
+        Leave the stream. The consumer group is kept, so pending entries can be claimed by other consumers.
+        """
+        self.logger.debug(f"Consumer {self._consumer_name} left the stream {self._stream}.")
+
+    def _process_entries(self, entries, message_handler: Callable) -> bool:
+        should_continue = True
+        for entry_id, fields in entries:
+            entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+            data = fields.get(b"data") if fields else None
+            if not data:
+                # The entry was trimmed from the stream before we could read it.
+                self._xack([entry_id])
+                continue
+            try:
+                msg_obj = loads(decompress(data))
+                messages = MQDao.unpack_envelope(msg_obj)
+                # Each message is acknowledged once persisted, and the entry once all its messages are.
+                if not self.ack_after_commit or not self._defer_ack(messages, entry_id):
+                    self._xack([entry_id])
+                for message in messages:
+                    if not message_handler(message):
+                        should_continue = False
+            except Exception as e:
+                # The entry is not acknowledged, so it can be claimed again.
+                self.logger.error(f"Failed to process stream entry {entry_id}")
+                self.logger.exception(e)
+        return should_continue
+
+    def _read_group(self, stream_id, block=None):
+        response = self._producer.xreadgroup(
+            self._group, self._consumer_name, {self._stream: stream_id}, count=self._read_count, block=block
+        )
+        return response[0][1] if response else []
+
+    def _drain(self, message_handler: Callable) -> bool:
+        should_continue = True
+        entries = self._read_group(">")
+        while len(entries):
+            should_continue = self._process_entries(entries, message_handler) and should_continue
+            entries = self._read_group(">")
+        return should_continue
+
+    def _process_control_entries(self, message_handler: Callable) -> bool:
+        response = self._producer.xread({self._control_stream: self._control_last_id}, count=self._read_count)
+        if not response:
+            return True
+        # Control messages may ask us to stop, so we first handle everything already published to the stream.
+        should_continue = self._drain(message_handler)
+        for entry_id, fields in response[0][1]:
+            self._control_last_id = entry_id
+            msg_obj = loads(decompress(fields[b"data"]))
+            if not MQDao.dispatch(msg_obj, message_handler):
+                should_continue = False
+        return should_continue
+
+    def message_listener(self, message_handler: Callable):
+        """Get message listener with automatic reconnection."""
+        max_retrials = 10
+        current_trials = 0
+        should_continue = True
+        # Entries delivered to this consumer but not acknowledged are read once, from the oldest, then only new ones.
+        stream_id = "0"
+        while should_continue and current_trials < max_retrials:
+            try:
+                entries = self._read_group(stream_id, block=None if stream_id != ">" else self._block_ms)
+                if stream_id != ">":
+                    if not len(entries):
+                        stream_id = ">"
+                        continue
+                    # The pending entries after the last one read, as the ones read stay pending until acked.
+                    last_id = entries[-1][0]
+                    stream_id = last_id.decode() if isinstance(last_id, bytes) else last_id
+                should_continue = self._process_entries(entries, message_handler)
+                if should_continue:
+                    should_continue = self._process_control_entries(message_handler)
+                current_trials = 0
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+                current_trials += 1
+                self.logger.critical(f"Redis connection lost: {e}. Reconnecting in 3 seconds...")
+                sleep(3)
+            except Exception as e:
+                # E.g., NOGROUP if the consumer group was deleted. Retrying a few times, without flooding the log.
+                current_trials += 1
+                self.logger.exception(e)
+                sleep(3)
+        if current_trials >= max_retrials:
+            self.logger.critical(f"Giving up reading the stream {self._stream} after {max_retrials} failed trials.")
+
+    def ack(self, ack_ids: List):
+        """Acknowledge persisted messages. Stream entries are acknowledged once all their messages are."""
+        self._xack(self._completed_acks(ack_ids))
+
+    def _xack(self, entry_ids: List):
+        """Acknowledge stream entries, so they are not redelivered."""
+        if len(entry_ids):
+            self._producer.xack(self._stream, self._group, *entry_ids)
+
+    def send_message(self, message: dict, channel=MQ_CHANNEL, serializer=dumps):
+        """Send the message."""
+        data = self._encode(message, serializer)
+        for producer in self._get_producers(message):
+            producer.xadd(channel, {"data": data}, maxlen=self._max_len, approximate=True)
+
+    def send_document_inserter_stop(self, exec_bundle_id=None):
+        """Send the stop message to every document inserter in the group."""
+        msg = {"type": "flowcept_control", "info": "stop_document_inserter", "exec_bundle_id": exec_bundle_id}
+        self.send_message(msg, channel=self._control_stream)
+
+    def _bulk_publish(self, buffer, channel=MQ_CHANNEL, serializer=dumps):
+        pipes = {}
+        for message in buffer:
+            try:
+                pipe = self._get_pipeline(pipes, message)
+                pipe.xadd(channel, {"data": self._encode(message, serializer)}, maxlen=self._max_len, approximate=True)
+            except Exception as e:
+                self.logger.exception(e)
+                self.logger.error("Some messages couldn't be flushed! Check the messages' contents!")
+                self.logger.error(f"Message that caused error: {message}")
+                self._dropped_msgs_metric.inc()
+        try:
+            for pipe in pipes.values():
+                pipe.execute()
+            self.logger.debug(f"Flushed {len(buffer)} msgs to MQ!")
+            return True
+        except Exception as e:
+            self.logger.exception(e)
+            return False
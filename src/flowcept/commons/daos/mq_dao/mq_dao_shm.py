@@ -0,0 +1,230 @@
+"""MQ shared memory module."""
+
+import fcntl
+import os
+import struct
+import tempfile
+from contextlib import contextmanager
+from multiprocessing import shared_memory, resource_tracker
+from threading import Lock
+from typing import Callable, List
+
+from time import time, sleep
+
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.compression import decompress
+from flowcept.commons.daos.mq_dao.mq_serialization import dumps, loads
+from flowcept.configs import MQ_CHANNEL, MQ_SETTINGS
+
+
+class MQDaoShm(MQDao):
+    """MQ class over a shared-memory ring buffer, for producers and a consumer on the same node.
+
+    The segment starts with a header holding the total number of bytes ever written and read, followed
+    by a circular area of length-prefixed msgpack frames. Producers in any local process append frames
+    while holding a lock file; one consumer process reads them. No network or external service is used.
+    """
+
+    _HEADER_SIZE = 64
+    _WRITE_POS = 0
+    _READ_POS = 8
+    _CAPACITY = 16
+    # Set by the consumer before unlinking an empty segment, so producers attach to a new one.
+    _CLOSED = 24
+    _CONSUMER_PID = 32
+    _U64 = struct.Struct("=Q")
+    _FRAME_HEADER = struct.Struct("=I")
+
+    def __init__(self, adapter_settings=None):
+        super().__init__(adapter_settings)
+        self._name = MQ_SETTINGS.get("shm_name", f"flowcept_{MQ_CHANNEL}")
+        self._size = int(MQ_SETTINGS.get("shm_size", 64 * 1024 * 1024))
+        self._publish_timeout = float(MQ_SETTINGS.get("shm_publish_timeout", 10))
+        self._poll_interval = float(MQ_SETTINGS.get("shm_poll_interval", 0.001))
+        self._thread_lock = Lock()
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f"{self._name}.lock"), "a+b")
+        self._shm = None
+        self._data = None
+        self._capacity = 0
+        with self._locked():
+            self._attach()
+
+    @staticmethod
+    def _open_segment(name, create=False, size=0) -> shared_memory.SharedMemory:
+        """Open the segment without letting the resource tracker unlink it when this process exits."""
+        try:
+            return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+        except TypeError:  # Python < 3.13
+            shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+            resource_tracker.unregister(shm._name, "shared_memory")
+            return shm
+
+    @contextmanager
+    def _locked(self):
+        # The lock file serializes processes; the thread lock, threads sharing this instance's file.
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _get(self, field) -> int:
+        return MQDaoShm._U64.unpack_from(self._shm.buf, field)[0]
+
+    def _set(self, field, value: int):
+        MQDaoShm._U64.pack_into(self._shm.buf, field, value)
+
+    def _attach(self):
+        """Attach to the segment, creating it if needed. Must be called holding the lock."""
+        try:
+            self._shm = MQDaoShm._open_segment(self._name)
+        except FileNotFoundError:
+            self._shm = MQDaoShm._open_segment(self._name, create=True, size=MQDaoShm._HEADER_SIZE + self._size)
+            self._shm.buf[: MQDaoShm._HEADER_SIZE] = bytes(MQDaoShm._HEADER_SIZE)
+            self._set(MQDaoShm._CAPACITY, self._size)
+        self._capacity = self._get(MQDaoShm._CAPACITY)
+        self._data = self._shm.buf[MQDaoShm._HEADER_SIZE : MQDaoShm._HEADER_SIZE + self._capacity]
+
+    def _ensure_attached(self):
+        """Attach again if the segment was unlinked by its consumer. Must be called holding the lock."""
+        if self._shm is None or self._get(MQDaoShm._CLOSED):
+            self._detach()
+            self._attach()
+
+    def _detach(self):
+        if self._shm is not None:
+            self._data.release()
+            self._data = None
+            self._shm.close()
+            self._shm = None
+
+    def __del__(self):
+        # The views into the segment must be released before it is closed.
+        try:
+            self._detach()
+        except Exception:
+            pass
+
+    def _write(self, pos: int, data):
+        offset = pos % self._capacity
+        first = min(len(data), self._capacity - offset)
+        self._data[offset : offset + first] = data[:first]
+        if first < len(data):
+            self._data[: len(data) - first] = data[first:]
+
+    def _read(self, pos: int, size: int) -> bytes:
+        offset = pos % self._capacity
+        first = min(size, self._capacity - offset)
+        if first == size:
+            return bytes(self._data[offset : offset + size])
+        return bytes(self._data[offset:]) + bytes(self._data[: size - first])
+
+    def _publish(self, payloads: List[bytes]) -> bool:
+        """Append the payloads as one batch, waiting up to shm_publish_timeout for the consumer to make room."""
+        size = sum(MQDaoShm._FRAME_HEADER.size + len(p) for p in payloads)
+        if size > self._capacity:
+            if len(payloads) == 1:
+                self.logger.error(f"Message of {size} bytes does not fit in the shm MQ. Increase shm_size.")
+                return False
+            half = len(payloads) // 2
+            return self._publish(payloads[:half]) and self._publish(payloads[half:])
+        deadline = time() + self._publish_timeout
+        while True:
+            with self._locked():
+                self._ensure_attached()
+                write_pos = self._get(MQDaoShm._WRITE_POS)
+                if self._capacity - (write_pos - self._get(MQDaoShm._READ_POS)) >= size:
+                    for payload in payloads:
+                        self._write(write_pos, MQDaoShm._FRAME_HEADER.pack(len(payload)))
+                        self._write(write_pos + MQDaoShm._FRAME_HEADER.size, memoryview(payload))
+                        write_pos += MQDaoShm._FRAME_HEADER.size + len(payload)
+                    self._set(MQDaoShm._WRITE_POS, write_pos)
+                    return True
+            if time() > deadline:
+                self.logger.error(f"The shm MQ has been full for {self._publish_timeout} s. Is the consumer running?")
+                return False
+            sleep(self._poll_interval)
+
+    def subscribe(self):
+        """Register as the consumer of the segment. Only one consumer is supported."""
+        with self._locked():
+            self._ensure_attached()
+            consumer_pid = self._get(MQDaoShm._CONSUMER_PID)
+            if consumer_pid and consumer_pid != os.getpid():
+                try:
+                    os.kill(consumer_pid, 0)
+                    raise Exception(f"Process {consumer_pid} is already consuming from the shm MQ {self._name}.")
+                except ProcessLookupError:
+                    pass  # It died without unsubscribing.
+            self._set(MQDaoShm._CONSUMER_PID, os.getpid())
+
+    def unsubscribe(self):
+        """Stop consuming. If nothing is left to read, the segment is unlinked."""
+        with self._locked():
+            if self._shm is None:
+                return
+            self._set(MQDaoShm._CONSUMER_PID, 0)
+            if self._get(MQDaoShm._WRITE_POS) == self._get(MQDaoShm._READ_POS):
+                self._set(MQDaoShm._CLOSED, 1)
+                if not hasattr(self._shm, "_track"):
+                    # Python < 3.13 unregisters the segment from the resource tracker on unlink.
+                    resource_tracker.register(self._shm._name, "shared_memory")
+                self._shm.unlink()
+                self._detach()
+
+    def message_listener(self, message_handler: Callable):
+        """Read frames until the handler asks to stop."""
+        should_continue = True
+        while should_continue:
+            with self._locked():
+                write_pos = self._get(MQDaoShm._WRITE_POS)
+                read_pos = self._get(MQDaoShm._READ_POS)
+            if write_pos == read_pos:
+                sleep(self._poll_interval)
+                continue
+            # Producers never write over unread bytes, so the frames can be read without the lock.
+            while read_pos < write_pos and should_continue:
+                size = MQDaoShm._FRAME_HEADER.unpack(self._read(read_pos, MQDaoShm._FRAME_HEADER.size))[0]
+                payload = self._read(read_pos + MQDaoShm._FRAME_HEADER.size, size)
+                read_pos += MQDaoShm._FRAME_HEADER.size + size
+                try:
+                    msg_obj = loads(decompress(payload))
+                    should_continue = MQDao.dispatch(msg_obj, message_handler)
+                except Exception as e:
+                    self.logger.error("Failed to process message from the shm MQ")
+                    self.logger.exception(e)
+            with self._locked():
+                self._set(MQDaoShm._READ_POS, read_pos)
+
+    def send_message(self, message: dict, channel=MQ_CHANNEL, serializer=dumps):
+        """Send the message."""
+        if not self._publish([self._encode(message, serializer)]):
+            raise Exception("Could not publish message to the shm MQ.")
+
+    def _serialize(self, buffer, serializer) -> List[bytes]:
+        payloads = []
+        for message in buffer:
+            try:
+                payloads.append(self._encode(message, serializer))
+            except Exception as e:
+                self.logger.exception(e)
+                self.logger.error("Some messages couldn't be flushed! Check the messages' contents!")
+                self.logger.error(f"Message that caused error: {message}")
+        return payloads
+
+    def _bulk_publish(self, buffer, channel=MQ_CHANNEL, serializer=dumps):
+        if not self._publish(self._serialize(buffer, serializer)):
+            return False
+        self.logger.debug(f"Flushed {len(buffer)} msgs to MQ!")
+        return True
+
+    def liveness_test(self):
+        """Check that the segment can be attached."""
+        try:
+            with self._locked():
+                self._ensure_attached()
+            return True
+        except Exception as e:
+            self.logger.exception(e)
+            return False
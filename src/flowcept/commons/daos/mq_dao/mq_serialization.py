@@ -0,0 +1,237 @@
+"""MQ serialization module.
+
+With ``mq.serializer: msgpack_ext``, messages are serialized with msgpack extension types for numpy
+arrays, datetimes, UUIDs, and pandas objects, so producers do not need to walk and stringify their
+payloads beforehand. Any other object is replaced at serialization time, as `replace_non_serializable`
+would do. Objects serialized beforehand with `pack_ext` are embedded as they are, without being serialized
+again. Consumers decode the extension types whatever their own setting is.
+"""
+
+import argparse
+import struct
+import sys
+from datetime import date, datetime
+from hashlib import blake2b
+from typing import Any, Callable, Dict
+from uuid import UUID
+
+import msgpack
+import numpy as np
+
+from flowcept.configs import MQ_SERIALIZER, MQ_ARRAY_SUMMARY_THRESHOLD
+
+EXT_NDARRAY = 1
+EXT_DATETIME = 2
+EXT_UUID = 3
+EXT_PANDAS = 4
+EXT_PACKED = 5
+
+_U8 = struct.Struct("=B")
+
+# Maps a type to the function that turns its objects into something msgpack can pack.
+_encoders: Dict[type, Callable[[Any], Any]] = {}
+# Encoders found for each type seen, including subclasses of the registered types.
+_resolved: Dict[type, Callable[[Any], Any]] = {}
+_pandas_registered = False
+
+
+def register_encoder(cls: type, encoder: Callable[[Any], Any]):
+    """Register how objects of a type, or of its subclasses, are serialized.
+
+    Parameters
+    ----------
+    cls : type
+        The type of the objects.
+    encoder : Callable
+        Turns an object into something msgpack can pack, e.g., a dict or a `msgpack.ExtType`.
+    """
+    _encoders[cls] = encoder
+    _resolved.clear()
+
+
+def summarize_array(array: np.ndarray) -> Dict:
+    """Summarize an array too large to be sent: its shape, dtype, stats, and a hash of its content."""
+    summary = {"summary_of": "ndarray", "shape": list(array.shape), "dtype": str(array.dtype)}
+    if array.dtype.kind in "biuf" and array.size:
+        summary.update(min=array.min().item(), max=array.max().item(), mean=array.mean().item(), std=array.std().item())
+    if array.dtype.kind != "O":
+        summary["hash"] = blake2b(np.ascontiguousarray(array).tobytes(), digest_size=16).hexdigest()
+    return summary
+
+
+def _encode_ndarray(array: np.ndarray):
+    if 0 < MQ_ARRAY_SUMMARY_THRESHOLD < array.size:
+        return summarize_array(array)
+    if array.dtype.kind == "O" or array.dtype.fields is not None:
+        return array.tolist()
+    header = f"{array.dtype.str}|{','.join(str(d) for d in array.shape)}".encode()
+    return msgpack.ExtType(EXT_NDARRAY, _U8.pack(len(header)) + header + np.ascontiguousarray(array).tobytes())
+
+
+def _encode_numpy_scalar(value: np.generic):
+    if isinstance(value, (np.datetime64, np.timedelta64)):
+        return str(value)
+    return value.item()
+
+
+def _encode_datetime(value: date):
+    return msgpack.ExtType(EXT_DATETIME, value.isoformat().encode())
+
+
+def _encode_uuid(value: UUID):
+    return msgpack.ExtType(EXT_UUID, value.bytes)
+
+
+def _encode_pandas(obj):
+    import pandas as pd
+
+    size = obj.size if isinstance(obj, (pd.Series, pd.DataFrame)) else len(obj)
+    if 0 < MQ_ARRAY_SUMMARY_THRESHOLD < size:
+        summary = {"summary_of": obj.__class__.__name__, "shape": list(obj.shape)}
+        if isinstance(obj, pd.DataFrame):
+            summary["columns"] = {str(c): str(t) for c, t in obj.dtypes.items()}
+        return summary
+    if isinstance(obj, pd.DataFrame):
+        data = {
+            "kind": "frame",
+            "index": obj.index.to_numpy(),
+            "columns": [[c, obj[c].to_numpy()] for c in obj.columns],
+        }
+    elif isinstance(obj, pd.Series):
+        data = {"kind": "series", "name": obj.name, "index": obj.index.to_numpy(), "values": obj.to_numpy()}
+    else:  # Index
+        return obj.to_numpy()
+    return msgpack.ExtType(EXT_PANDAS, msgpack.packb(data, default=_default))
+
+
+def _register_pandas():
+    global _pandas_registered
+    _pandas_registered = True
+    import pandas as pd
+
+    _encoders[pd.DataFrame] = _encode_pandas
+    _encoders[pd.Series] = _encode_pandas
+    _encoders[pd.Index] = _encode_pandas
+    _encoders[pd.Timestamp] = lambda value: _encode_datetime(value.to_pydatetime())
+
+
+def _fallback(obj):
+    """Same replacements as `replace_non_serializable`."""
+    if hasattr(obj, "to_flowcept_dict"):
+        return obj.to_flowcept_dict()
+    elif hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    elif isinstance(obj, argparse.Namespace):
+        return obj.__dict__
+    elif isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return f"{obj.__class__.__name__}_instance_id_{id(obj)}"
+
+
+def _default(obj):
+    cls = obj.__class__
+    encoder = _resolved.get(cls)
+    if encoder is None:
+        if not _pandas_registered and "pandas" in sys.modules:
+            _register_pandas()
+        encoder = next((_encoders[base] for base in cls.__mro__ if base in _encoders), _fallback)
+        _resolved[cls] = encoder
+    return encoder(obj)
+
+
+_encoders[np.ndarray] = _encode_ndarray
+_encoders[np.generic] = _encode_numpy_scalar
+_encoders[datetime] = _encode_datetime
+_encoders[date] = _encode_datetime
+_encoders[UUID] = _encode_uuid
+
+
+def _decode_ndarray(data: bytes) -> np.ndarray:
+    header_len = data[0]
+    dtype, shape = data[1 : 1 + header_len].decode().rsplit("|", 1)
+    shape = tuple(int(d) for d in shape.split(",")) if shape else ()
+    # Copying, so the array does not hold the whole message and is writable.
+    return np.frombuffer(data[1 + header_len :], dtype=np.dtype(dtype)).reshape(shape).copy()
+
+
+def native_ext_hook(code: int, data: bytes):
+    """Decode extension types into numpy arrays, datetimes, UUIDs, and pandas objects."""
+    if code == EXT_NDARRAY:
+        return _decode_ndarray(data)
+    elif code == EXT_DATETIME:
+        iso = data.decode()
+        return datetime.fromisoformat(iso) if "T" in iso else date.fromisoformat(iso)
+    elif code == EXT_UUID:
+        return UUID(bytes=data)
+    elif code == EXT_PANDAS:
+        import pandas as pd
+
+        obj = msgpack.unpackb(data, ext_hook=native_ext_hook, strict_map_key=False)
+        if obj["kind"] == "series":
+            return pd.Series(obj["values"], index=obj["index"], name=obj["name"])
+        return pd.DataFrame({c: v for c, v in obj["columns"]}, index=obj["index"])
+    elif code == EXT_PACKED:
+        return msgpack.unpackb(data, ext_hook=native_ext_hook, strict_map_key=False)
+    return msgpack.ExtType(code, data)
+
+
+def plain_ext_hook(code: int, data: bytes):
+    """Decode into plain types that any DocDB can store."""
+    if code == EXT_NDARRAY:
+        return _decode_ndarray(data).tolist()
+    elif code == EXT_DATETIME:
+        return data.decode()
+    elif code == EXT_UUID:
+        return str(UUID(bytes=data))
+    elif code == EXT_PANDAS:
+        obj = msgpack.unpackb(data, ext_hook=plain_ext_hook, strict_map_key=False)
+        if obj["kind"] == "series":
+            plain = {"index": obj["index"], "values": obj["values"]}
+            if obj["name"] is not None:
+                plain["name"] = obj["name"]
+            return plain
+        return {"index": obj["index"], "columns": {str(c): v for c, v in obj["columns"]}}
+    elif code == EXT_PACKED:
+        return msgpack.unpackb(data, ext_hook=plain_ext_hook, strict_map_key=False)
+    return msgpack.ExtType(code, data)
+
+
+def dumps_ext(obj) -> bytes:
+    """Serialize with the extension types."""
+    return msgpack.packb(obj, default=_default)
+
+
+def pack_ext(obj) -> msgpack.ExtType:
+    """Serialize an object now, to be embedded as is in the messages it is sent in later.
+
+    E.g., a task captured with the user's arrays keeps them as they were, even if the user changes them
+    before the task is sent, and they are not serialized again when it is.
+    """
+    return msgpack.ExtType(EXT_PACKED, dumps_ext(obj))
+
+
+if MQ_SERIALIZER == "msgpack_ext":
+    dumps = dumps_ext
+elif MQ_SERIALIZER == "msgpack":
+    dumps = msgpack.dumps
+else:
+    raise Exception(f"Unknown MQ serializer: {MQ_SERIALIZER}. Use msgpack or msgpack_ext.")
+
+
+def loads(data: bytes, native: bool = False):
+    """Deserialize a message.
+
+    Parameters
+    ----------
+    data : bytes
+        The serialized message.
+    native : bool, optional
+        If True, extension types are decoded into numpy arrays, datetimes, UUIDs, and pandas objects.
+        Otherwise, into lists, ISO strings, strings, and dicts, which any DocDB can store.
+
+    Returns
+    -------
+    Any
+        The message.
+    """
+    return msgpack.unpackb(data, ext_hook=native_ext_hook if native else plain_ext_hook, strict_map_key=False)
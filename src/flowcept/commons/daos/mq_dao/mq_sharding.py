@@ -0,0 +1,39 @@
+"""MQ sharding module."""
+
+from bisect import bisect
+from hashlib import md5
+from typing import Dict, List
+
+
+class ConsistentHashRing:
+    """Consistent hash ring mapping keys to shard indices.
+
+    Each shard is placed at many points (virtual nodes) of the ring, so keys spread evenly and
+    adding or removing a shard only remaps the keys of that shard. Hashes are stable across
+    processes, so all producers route a key to the same shard.
+    """
+
+    def __init__(self, shard_names: List[str], virtual_nodes: int = 64):
+        ring = []
+        for index, name in enumerate(shard_names):
+            for v in range(virtual_nodes):
+                ring.append((ConsistentHashRing._hash(f"{name}#{v}"), index))
+        ring.sort()
+        self._hashes = [h for h, _ in ring]
+        self._indices = [i for _, i in ring]
+        self._cache: Dict[str, int] = {}
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(md5(key.encode()).digest()[:8], "big")
+
+    def get_shard(self, key) -> int:
+        """Get the shard index for a key."""
+        key = str(key)
+        shard = self._cache.get(key)
+        if shard is None:
+            position = bisect(self._hashes, ConsistentHashRing._hash(key)) % len(self._hashes)
+            shard = self._cache[key] = self._indices[position]
+            if len(self._cache) > 100_000:
+                self._cache.clear()
+        return shard
@@ -0,0 +1,212 @@
+"""MQ spill log module.
+
+Messages that could not be published to the MQ are appended to a local, segmented, size-capped
+log, so they can be replayed once the MQ is reachable again.
+"""
+
+import os
+from glob import glob
+from threading import Lock, Thread, Event
+from typing import Callable, Dict, List
+from uuid import uuid4
+
+import msgpack
+
+from flowcept.commons.daos.mq_dao.mq_serialization import dumps_ext, native_ext_hook
+from flowcept.commons.flowcept_logger import FlowceptLogger
+from flowcept.commons.flowcept_metrics import get_metrics
+
+
+class MQSpillLog:
+    """Append-only spill log for messages that failed to be published.
+
+    Each writer appends to its own open segment (``*.open``). Segments are sealed (``*.seg``) when they
+    reach `segment_size` bytes or before a replay. Any process sharing the directory can replay sealed
+    segments, which are claimed with an atomic rename, so no segment is replayed twice concurrently.
+    Segments left open or claimed by processes that are gone are recovered when a log is opened.
+    When the log exceeds `max_size` bytes, the oldest sealed segments are discarded. Its size is tracked
+    as messages are appended and replayed, and the directory is only listed once it seems over `max_size`.
+    """
+
+    OPEN_SUFFIX = ".open"
+    SEALED_SUFFIX = ".seg"
+    REPLAYING_SUFFIX = ".replaying_"
+
+    def __init__(self, path: str, segment_size: int, max_size: int):
+        self.logger = FlowceptLogger()
+        self._path = path
+        self._segment_size = segment_size
+        self._max_size = max_size
+        self._writer_id = f"{os.getpid()}_{uuid4().hex[:8]}"
+        self._seq = 0
+        self._segment = None
+        self._segment_bytes = 0
+        self._lock = Lock()
+        self.spilled_count = 0
+        self.replayed_count = 0
+        self.discarded_bytes = 0
+        metrics = get_metrics()
+        self._spilled_metric = metrics.counter("flowcept_mq_spill_log_messages_total", "Messages spilled to the log.")
+        self._replayed_metric = metrics.counter(
+            "flowcept_mq_spill_log_replayed_total", "Spilled messages replayed to the MQ."
+        )
+        self._discarded_metric = metrics.counter(
+            "flowcept_mq_spill_log_discarded_bytes_total", "Bytes of spilled messages discarded over max_size."
+        )
+        os.makedirs(self._path, exist_ok=True)
+        self._seal_orphan_segments()
+        # Bytes in the log, as far as this writer knows: other processes may append to or replay it too.
+        self._log_bytes = sum(os.path.getsize(s) for s in self._sealed_segments())
+
+    def _seal_orphan_segments(self):
+        """Seal segments left open or claimed by processes that are gone (e.g., killed), so they get replayed."""
+        for segment in glob(os.path.join(self._path, f"*{MQSpillLog.OPEN_SUFFIX}")):
+            if not MQSpillLog._is_alive(os.path.basename(segment)):
+                os.rename(segment, segment[: -len(MQSpillLog.OPEN_SUFFIX)] + MQSpillLog.SEALED_SUFFIX)
+        for claimed in glob(os.path.join(self._path, f"*{MQSpillLog.SEALED_SUFFIX}{MQSpillLog.REPLAYING_SUFFIX}*")):
+            segment, writer_id = claimed.rsplit(MQSpillLog.REPLAYING_SUFFIX, 1)
+            if not MQSpillLog._is_alive(writer_id):
+                os.rename(claimed, segment)
+
+    @staticmethod
+    def _is_alive(writer_id: str) -> bool:
+        """Check if the process of a writer id, or of a segment named after it, still exists."""
+        try:
+            os.kill(int(writer_id.split("_")[0]), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass  # The process exists, but belongs to another user.
+        return True
+
+    def append(self, messages: List[Dict]):
+        """Append messages to the current segment."""
+        data = b"".join(dumps_ext(m) for m in messages)
+        with self._lock:
+            if self._segment is None:
+                self._seq += 1
+                self._segment = os.path.join(self._path, f"{self._writer_id}_{self._seq:08d}{MQSpillLog.OPEN_SUFFIX}")
+                self._segment_bytes = 0
+            with open(self._segment, "ab") as f:
+                f.write(data)
+            self._segment_bytes += len(data)
+            self._log_bytes += len(data)
+            self.spilled_count += len(messages)
+            self._spilled_metric.inc(len(messages))
+            if self._segment_bytes >= self._segment_size:
+                self._seal()
+            if self._log_bytes > self._max_size:
+                self._enforce_cap()
+
+    def _seal(self):
+        """Seal the current segment. Must be called holding the lock."""
+        if self._segment is not None:
+            os.rename(self._segment, self._segment[: -len(MQSpillLog.OPEN_SUFFIX)] + MQSpillLog.SEALED_SUFFIX)
+            self._segment = None
+
+    def seal(self):
+        """Seal the current segment, so it can be replayed."""
+        with self._lock:
+            self._seal()
+
+    def _sealed_segments(self) -> List[str]:
+        return sorted(glob(os.path.join(self._path, f"*{MQSpillLog.SEALED_SUFFIX}")), key=os.path.getmtime)
+
+    def _enforce_cap(self):
+        """Discard the oldest sealed segments while the log is over max_size. Must be called holding the lock."""
+        segments = self._sealed_segments()
+        sizes = {s: os.path.getsize(s) for s in segments}
+        total = sum(sizes.values()) + self._segment_bytes
+        while total > self._max_size and len(segments):
+            oldest = segments.pop(0)
+            try:
+                os.remove(oldest)
+            except FileNotFoundError:
+                continue
+            total -= sizes[oldest]
+            self.discarded_bytes += sizes[oldest]
+            self._discarded_metric.inc(sizes[oldest])
+            self.logger.warning(f"MQ spill log is over {self._max_size} bytes. Discarded segment {oldest}.")
+        self._log_bytes = total
+
+    def is_empty(self) -> bool:
+        """Check if there is anything to replay."""
+        return self._segment is None and not len(self._sealed_segments())
+
+    def replay(self, publish_function: Callable[[List[Dict]], bool], batch_size: int) -> bool:
+        """Publish the spilled messages, oldest segments first.
+
+        Parameters
+        ----------
+        publish_function : Callable
+            Publishes a list of messages, returning False if it failed.
+        batch_size : int
+            Number of messages to publish at once.
+
+        Returns
+        -------
+        bool
+            True if the whole log was replayed, False if publishing failed.
+        """
+        self.seal()
+        for segment in self._sealed_segments():
+            claimed = f"{segment}{MQSpillLog.REPLAYING_SUFFIX}{self._writer_id}"
+            try:
+                os.rename(segment, claimed)
+            except FileNotFoundError:
+                continue  # Another replayer claimed it.
+            with open(claimed, "rb") as f:
+                messages = list(msgpack.Unpacker(f, strict_map_key=False, ext_hook=native_ext_hook))
+            for i in range(0, len(messages), batch_size):
+                if not publish_function(messages[i : i + batch_size]):
+                    # Replaying the whole segment next time, as the MQ may have taken part of it.
+                    os.rename(claimed, segment)
+                    return False
+                self.replayed_count += len(messages[i : i + batch_size])
+                self._replayed_metric.inc(len(messages[i : i + batch_size]))
+            size = os.path.getsize(claimed)
+            os.remove(claimed)
+            with self._lock:
+                self._log_bytes = max(self._log_bytes - size, 0)
+            self.logger.info(f"Replayed {len(messages)} spilled messages from {segment}.")
+        return True
+
+
+class MQSpillLogReplayer:
+    """Background thread that replays a spill log whenever the MQ passes its liveness test."""
+
+    def __init__(
+        self,
+        spill_log: MQSpillLog,
+        publish_function: Callable[[List[Dict]], bool],
+        liveness_test: Callable[[], bool],
+        interval: float,
+        batch_size: int,
+    ):
+        self._spill_log = spill_log
+        self._publish_function = publish_function
+        self._liveness_test = liveness_test
+        self._interval = interval
+        self._batch_size = batch_size
+        self._stop_event = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def replay_if_alive(self) -> bool:
+        """Replay the spill log if there is anything in it and the MQ is alive."""
+        if self._spill_log.is_empty() or not self._liveness_test():
+            return False
+        return self._spill_log.replay(self._publish_function, self._batch_size)
+
+    def _run(self):
+        while not self._stop_event.wait(self._interval):
+            try:
+                self.replay_if_alive()
+            except Exception as e:
+                self._spill_log.logger.exception(e)
+
+    def stop(self):
+        """Stop the replayer, trying one last replay."""
+        self._stop_event.set()
+        self._thread.join()
+        self.replay_if_alive()
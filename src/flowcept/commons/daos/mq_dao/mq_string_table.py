@@ -0,0 +1,97 @@
+"""MQ string table module.
+
+With ``mq.intern_strings: true``, each published batch travels in an envelope carrying a string table:
+values of identifier fields repeated across the batch (workflow ids, hostnames, IPs...) are sent once
+in the table and replaced, in the messages, by their index in it. Consumers expand them when unpacking
+the envelope.
+"""
+
+from typing import Dict, List, Tuple
+
+# Fields whose values are usually the same for most messages of a batch.
+INTERNED_FIELDS = (
+    "workflow_id",
+    "campaign_id",
+    "activity_id",
+    "group_id",
+    "parent_task_id",
+    "subtype",
+    "hostname",
+    "node_name",
+    "login_name",
+    "private_ip",
+    "public_ip",
+    "user",
+    "adapter_id",
+    "workflow_name",
+    "environment_id",
+)
+
+
+def intern_strings(messages: List, fields: Tuple[str] = INTERNED_FIELDS) -> Tuple[List, List[str], List[str]]:
+    """Replace repeated string values of the given fields by their index in a string table.
+
+    A field is interned only if all its values in the batch are strings (or None), so that consumers can
+    tell that any integer they find in it is an index. The messages passed are not modified.
+
+    Parameters
+    ----------
+    messages : list
+        The batch. Only dict messages are interned.
+    fields : tuple of str, optional
+        The fields to be interned.
+
+    Returns
+    -------
+    tuple
+        The messages, the string table, and the interned fields.
+    """
+    counts: Dict[str, Dict[str, int]] = {field: {} for field in fields}
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+        for field in list(counts):
+            value = message.get(field)
+            if isinstance(value, str):
+                field_counts = counts[field]
+                field_counts[value] = field_counts.get(value, 0) + 1
+            elif value is not None:
+                del counts[field]
+
+    strings: List[str] = []
+    ids: Dict[str, int] = {}
+    interned_fields = []
+    for field, field_counts in counts.items():
+        repeated = [value for value, count in field_counts.items() if count > 1]
+        if not repeated:
+            continue
+        interned_fields.append(field)
+        for value in repeated:
+            if value not in ids:
+                ids[value] = len(strings)
+                strings.append(value)
+    if not strings:
+        return messages, strings, interned_fields
+
+    interned = []
+    for message in messages:
+        if isinstance(message, dict):
+            message = dict(message)
+            for field in interned_fields:
+                string_id = ids.get(message.get(field))
+                if string_id is not None:
+                    message[field] = string_id
+        interned.append(message)
+    return interned, strings, interned_fields
+
+
+def expand_strings(messages: List, strings: List[str], fields: List[str]) -> List:
+    """Put back, in place, the strings replaced by `intern_strings`."""
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+        for field in fields:
+            value = message.get(field)
+            if isinstance(value, int):
+                message[field] = strings[value]
+    return messages
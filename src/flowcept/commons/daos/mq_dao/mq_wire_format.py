@@ -0,0 +1,174 @@
+"""MQ wire format module.
+
+With ``mq.wire_format: compact``, task messages are sent as msgpack arrays instead of maps:
+
+``[COMPACT_MARKER, version, presence_mask, value, value, ..., {unknown fields}]``
+
+Bit ``i`` of the presence mask tells whether the i-th field of the version's field table is present,
+and the values of the present fields follow in table order. Telemetry dicts are encoded the same way,
+without the marker and version. Fields not in the table go in a trailing dict, so any task dict
+round-trips. Field tables are append-only: a new field goes at the end of a new version's table, so
+consumers keep decoding messages from older producers.
+"""
+
+from typing import Dict, List, Tuple, Union
+
+from flowcept.commons.vocabulary import Status
+
+COMPACT_MARKER = "\x00t"
+WIRE_FORMAT_VERSION = 1
+
+_TASK_FIELDS = {
+    1: (
+        "task_id",
+        "workflow_id",
+        "campaign_id",
+        "activity_id",
+        "subtype",
+        "parent_task_id",
+        "group_id",
+        "status",
+        "started_at",
+        "ended_at",
+        "submitted_at",
+        "registered_at",
+        "utc_timestamp",
+        "used",
+        "generated",
+        "telemetry_at_start",
+        "telemetry_at_end",
+        "custom_metadata",
+        "tags",
+        "hostname",
+        "node_name",
+        "login_name",
+        "private_ip",
+        "public_ip",
+        "user",
+        "adapter_id",
+        "workflow_name",
+        "environment_id",
+        "mq_host",
+        "address",
+        "dependencies",
+        "dependents",
+        "stdout",
+        "stderr",
+        "data",
+        "agent_id",
+    )
+}
+_TELEMETRY_FIELDS = {1: ("cpu", "process", "memory", "disk", "network", "gpu")}
+_TELEMETRY_TASK_FIELDS = {"telemetry_at_start", "telemetry_at_end"}
+_STATUSES = {1: ("SUBMITTED", "WAITING", "RUNNING", "FINISHED", "ERROR", "UNKNOWN")}
+
+
+def _build_ids(fields):
+    return {field: i for i, field in enumerate(fields)}
+
+
+_TASK_FIELD_IDS = _build_ids(_TASK_FIELDS[WIRE_FORMAT_VERSION])
+_TELEMETRY_FIELD_IDS = _build_ids(_TELEMETRY_FIELDS[WIRE_FORMAT_VERSION])
+_STATUS_IDS = _build_ids(_STATUSES[WIRE_FORMAT_VERSION])
+
+
+def _encode_fields(d: Dict, field_ids: Dict[str, int], encoders: Dict = None) -> List:
+    """Encode a dict as ``[presence_mask, value, ..., {unknown fields}]``."""
+    present = []
+    extras = None
+    for key, value in d.items():
+        field_id = field_ids.get(key)
+        if field_id is None:
+            if extras is None:
+                extras = {}
+            extras[key] = value
+        else:
+            if encoders is not None and key in encoders:
+                value = encoders[key](value)
+            present.append((field_id, value))
+    present.sort(key=lambda p: p[0])
+    mask = 0
+    for field_id, _ in present:
+        mask |= 1 << field_id
+    encoded = [mask]
+    encoded.extend(v for _, v in present)
+    if extras is not None:
+        encoded.append(extras)
+    return encoded
+
+
+def _decode_fields(encoded: List, start: int, fields: Tuple) -> Dict:
+    """Decode what `_encode_fields` encoded, starting at ``encoded[start]``."""
+    mask = encoded[start]
+    d = {}
+    i = start + 1
+    while mask:
+        low_bit = mask & -mask
+        d[fields[low_bit.bit_length() - 1]] = encoded[i]
+        i += 1
+        mask ^= low_bit
+    if i < len(encoded):
+        d.update(encoded[i])
+    return d
+
+
+def _encode_status(status):
+    status_id = _STATUS_IDS.get(status.value if isinstance(status, Status) else status)
+    # Unknown statuses are sent as they are; decoders only map integers.
+    return status if status_id is None else status_id
+
+
+def _encode_telemetry(telemetry):
+    if isinstance(telemetry, dict):
+        return _encode_fields(telemetry, _TELEMETRY_FIELD_IDS)
+    return telemetry
+
+
+_TASK_ENCODERS = {
+    "status": _encode_status,
+    "telemetry_at_start": _encode_telemetry,
+    "telemetry_at_end": _encode_telemetry,
+}
+
+
+def encode_task(msg: Dict) -> Union[List, Dict]:
+    """Encode a task message in the compact wire format. Other messages are returned as they are."""
+    if msg.get("type") != "task":
+        return msg
+    task = dict(msg)
+    del task["type"]
+    return [COMPACT_MARKER, WIRE_FORMAT_VERSION, *_encode_fields(task, _TASK_FIELD_IDS, _TASK_ENCODERS)]
+
+
+def is_compact_task(obj) -> bool:
+    """Check if a received message is a task in the compact wire format."""
+    return isinstance(obj, list) and len(obj) > 2 and obj[0] == COMPACT_MARKER
+
+
+def decode_task(obj: List) -> Dict:
+    """Decode a task message from the compact wire format into the usual task dict."""
+    version = obj[1]
+    if version not in _TASK_FIELDS:
+        raise Exception(f"Unknown task wire format version {version}. Please upgrade flowcept in this consumer.")
+    msg = _decode_fields(obj, 2, _TASK_FIELDS[version])
+    msg["type"] = "task"
+    status = msg.get("status")
+    if isinstance(status, int):
+        msg["status"] = _STATUSES[version][status]
+    for field in _TELEMETRY_TASK_FIELDS:
+        telemetry = msg.get(field)
+        if isinstance(telemetry, list):
+            msg[field] = _decode_fields(telemetry, 0, _TELEMETRY_FIELDS[version])
+    return msg
+
+
+def get_field(obj: List, field: str):
+    """Get a field of a compact task message without decoding it."""
+    fields = _TASK_FIELDS.get(obj[1], ())
+    if field not in fields:
+        return None
+    field_id = fields.index(field)
+    mask = obj[2]
+    if not mask >> field_id & 1:
+        return None
+    return obj[3 + bin(mask & ((1 << field_id) - 1)).count("1")]
@@ -92,6 +92,16 @@ class WorkflowObject:
         """Get workflow id."""
         return "workflow_id"
 
+    @staticmethod
+    def get_dict_field_names():
+        """Get the names of the fields that are updated, instead of replaced, when a workflow is updated."""
+        return [
+            "used",
+            "generated",
+            "custom_metadata",
+            "machine_info",
+        ]
+
     @staticmethod
     def from_dict(dict_obj: Dict) -> "WorkflowObject":
         """Convert from dictionary."""
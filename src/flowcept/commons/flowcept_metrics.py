@@ -0,0 +1,259 @@
+"""Metrics module.
+
+A small, process-wide registry of counters, gauges, and histograms, fed by Flowcept's buffers, MQ DAOs,
+and document inserters. It can be read in-process or dumped as JSON or in the Prometheus text format.
+"""
+
+import json
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable, Dict, List, Tuple
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds, in seconds, of the histogram buckets of delays that may be long, e.g., consumer lag.
+LAG_BUCKETS = LATENCY_BUCKETS + (30, 60, 300, 900, 3600)
+# Upper bounds of the histogram buckets of sizes (number of messages or bytes).
+SIZE_BUCKETS = tuple(4**i for i in range(1, 14))
+
+
+class Counter:
+    """Monotonically increasing value."""
+
+    TYPE = "counter"
+
+    def __init__(self):
+        self._value = 0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        """Increase the counter."""
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        """Current value."""
+        return self._value
+
+    def _snapshot(self):
+        return self._value
+
+    def _reset(self):
+        with self._lock:
+            self._value = 0
+
+
+class Gauge:
+    """Value that goes up and down.
+
+    Besides being set, a gauge can track functions (e.g., the depth of each buffer), which are only
+    called, and summed up, when the gauge is read.
+    """
+
+    TYPE = "gauge"
+
+    def __init__(self):
+        self._value = 0
+        self._functions: List[Callable[[], float]] = []
+        self._lock = Lock()
+
+    def set(self, value):
+        """Set the gauge."""
+        self._value = value
+
+    def inc(self, amount=1):
+        """Increase the gauge."""
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        """Decrease the gauge."""
+        self.inc(-amount)
+
+    def track(self, function: Callable[[], float]):
+        """Add the value returned by `function` to the gauge."""
+        with self._lock:
+            self._functions.append(function)
+
+    def untrack(self, function: Callable[[], float]):
+        """Stop tracking `function`."""
+        with self._lock:
+            if function in self._functions:
+                self._functions.remove(function)
+
+    @property
+    def value(self):
+        """Current value."""
+        with self._lock:
+            functions = list(self._functions)
+        return self._value + sum(f() for f in functions)
+
+    def _snapshot(self):
+        return self.value
+
+    def _reset(self):
+        with self._lock:
+            self._value = 0
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets."""
+
+    TYPE = "histogram"
+
+    def __init__(self, buckets: Tuple = LATENCY_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        # The last count is for values above the largest bucket.
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0
+        self._count = 0
+        self._lock = Lock()
+
+    def observe(self, value):
+        """Record a value."""
+        i = bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    @property
+    def count(self):
+        """Number of observed values."""
+        return self._count
+
+    @property
+    def sum(self):
+        """Sum of the observed values."""
+        return self._sum
+
+    def _snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            return {
+                "count": self._count,
+                "sum": self._sum,
+                "buckets": {str(b): c for b, c in zip(self._buckets + ("+Inf",), counts)},
+            }
+
+    def _reset(self):
+        with self._lock:
+            self._counts = [0] * len(self._counts)
+            self._sum = 0
+            self._count = 0
+
+    def _cumulative_counts(self):
+        with self._lock:
+            counts = list(self._counts)
+        total = 0
+        cumulative = []
+        for c in counts:
+            total += c
+            cumulative.append(total)
+        return cumulative
+
+
+class MetricsRegistry:
+    """Registry of metrics, identified by name and labels.
+
+    Getting a metric creates it on first use. Callers are expected to keep the metric they get, so
+    updating it costs no lookup.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[Tuple[str, Tuple], object] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _sort_key(item):
+        (name, labels), _ = item
+        return name, str(labels)
+
+    def _get(self, metric_class, name: str, help: str, labels: Dict, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = metric_class(**kwargs)
+                    self._help.setdefault(name, help)
+        if not isinstance(metric, metric_class):
+            raise Exception(f"Metric {name} is a {metric.TYPE}, not a {metric_class.TYPE}.")
+        return metric
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        """Get or create a counter."""
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str = "", **labels) -> Gauge:
+        """Get or create a gauge."""
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str = "", buckets: Tuple = LATENCY_BUCKETS, **labels) -> Histogram:
+        """Get or create a histogram."""
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def snapshot(self) -> Dict:
+        """Get the current values of all metrics.
+
+        Returns
+        -------
+        dict
+            Maps each metric name to a list of ``{"labels": ..., "value": ...}``. Histogram values are
+            dicts with their count, sum, and non-cumulative bucket counts.
+        """
+        with self._lock:
+            items = sorted(self._metrics.items(), key=MetricsRegistry._sort_key)
+        snapshot = {}
+        for (name, labels), metric in items:
+            snapshot.setdefault(name, []).append({"labels": dict(labels), "value": metric._snapshot()})
+        return snapshot
+
+    def to_json(self) -> str:
+        """Dump all metrics as JSON."""
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self) -> str:
+        """Dump all metrics in the Prometheus text exposition format."""
+
+        def _labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        with self._lock:
+            items = sorted(self._metrics.items(), key=MetricsRegistry._sort_key)
+        lines = []
+        last_name = None
+        for (name, labels), metric in items:
+            if name != last_name:
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} {metric.TYPE}")
+                last_name = name
+            if isinstance(metric, Histogram):
+                for bound, count in zip(metric._buckets + ("+Inf",), metric._cumulative_counts()):
+                    lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {metric.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {metric.count}")
+            else:
+                lines.append(f"{name}{_labels(labels)} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Zero all metrics. Gauges keep tracking their functions."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric._reset()
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Get the process-wide metrics registry."""
+    return _registry
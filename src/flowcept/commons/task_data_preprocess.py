@@ -6,6 +6,64 @@ from typing import Any
 
 import pytz
 
+DEFAULT_CRITICAL_TASK_THRESHOLDS = {
+    "high_cpu": 80,
+    "high_mem": 1e9,
+    "high_disk": 1e8,
+    "long_duration": 0.8,
+    "low_output": 0.1,
+    "high_output": 0.9,
+}
+
+
+def _cpu_diffs(start: Dict, end: Dict) -> Dict:
+    start_times = start["times_avg"]
+    end_times = end["times_avg"]
+    return {
+        "percent_all_diff": end["percent_all"] - start["percent_all"],
+        "user_time_diff": end_times["user"] - start_times["user"],
+        "system_time_diff": end_times["system"] - start_times["system"],
+        "idle_time_diff": end_times["idle"] - start_times["idle"],
+    }
+
+
+def _disk_diffs(start: Dict, end: Dict) -> Dict:
+    io_start = start["io_sum"]
+    io_end = end["io_sum"]
+    return {
+        "read_bytes_diff": io_end["read_bytes"] - io_start["read_bytes"],
+        "write_bytes_diff": io_end["write_bytes"] - io_start["write_bytes"],
+        "read_count_diff": io_end["read_count"] - io_start["read_count"],
+        "write_count_diff": io_end["write_count"] - io_start["write_count"],
+    }
+
+
+def _mem_diffs(start: Dict, end: Dict) -> Dict:
+    return {
+        "used_mem_diff": end["virtual"]["used"] - start["virtual"]["used"],
+        "percent_diff": end["virtual"]["percent"] - start["virtual"]["percent"],
+        "swap_used_diff": end["swap"]["used"] - start["swap"]["used"],
+    }
+
+
+def _network_diffs(start: Dict, end: Dict) -> Dict:
+    net_start = start["netio_sum"]
+    net_end = end["netio_sum"]
+    return {
+        "bytes_sent_diff": net_end["bytes_sent"] - net_start["bytes_sent"],
+        "bytes_recv_diff": net_end["bytes_recv"] - net_start["bytes_recv"],
+        "packets_sent_diff": net_end["packets_sent"] - net_start["packets_sent"],
+        "packets_recv_diff": net_end["packets_recv"] - net_start["packets_recv"],
+    }
+
+
+_TELEMETRY_SUMMARY_FUNCS = {
+    "cpu": _cpu_diffs,
+    "disk": _disk_diffs,
+    "memory": _mem_diffs,
+    "network": _network_diffs,
+}
+
 
 def summarize_telemetry(task: Dict, logger) -> Dict:
     """
@@ -21,48 +79,7 @@ def summarize_telemetry(task: Dict, logger) -> Dict:
     dict
         A summary of telemetry differences including CPU, disk, memory, and network metrics, and task duration.
     """
-
-    def extract_cpu_info(start: Dict, end: Dict) -> Dict:
-        return {
-            "percent_all_diff": end["percent_all"] - start["percent_all"],
-            "user_time_diff": end["times_avg"]["user"] - start["times_avg"]["user"],
-            "system_time_diff": end["times_avg"]["system"] - start["times_avg"]["system"],
-            "idle_time_diff": end["times_avg"]["idle"] - start["times_avg"]["idle"],
-        }
-
-    def extract_disk_info(start: Dict, end: Dict) -> Dict:
-        io_start = start["io_sum"]
-        io_end = end["io_sum"]
-        return {
-            "read_bytes_diff": io_end["read_bytes"] - io_start["read_bytes"],
-            "write_bytes_diff": io_end["write_bytes"] - io_start["write_bytes"],
-            "read_count_diff": io_end["read_count"] - io_start["read_count"],
-            "write_count_diff": io_end["write_count"] - io_start["write_count"],
-        }
-
-    def extract_mem_info(start: Dict, end: Dict) -> Dict:
-        return {
-            "used_mem_diff": end["virtual"]["used"] - start["virtual"]["used"],
-            "percent_diff": end["virtual"]["percent"] - start["virtual"]["percent"],
-            "swap_used_diff": end["swap"]["used"] - start["swap"]["used"],
-        }
-
-    def extract_network_info(start: Dict, end: Dict) -> Dict:
-        net_start = start["netio_sum"]
-        net_end = end["netio_sum"]
-        return {
-            "bytes_sent_diff": net_end["bytes_sent"] - net_start["bytes_sent"],
-            "bytes_recv_diff": net_end["bytes_recv"] - net_start["bytes_recv"],
-            "packets_sent_diff": net_end["packets_sent"] - net_start["packets_sent"],
-            "packets_recv_diff": net_end["packets_recv"] - net_start["packets_recv"],
-        }
-
-    tel_funcs = {
-        "cpu": extract_cpu_info,
-        "disk": extract_disk_info,
-        "memory": extract_mem_info,
-        "network": extract_network_info,
-    }
+    tel_funcs = _TELEMETRY_SUMMARY_FUNCS
 
     start_tele = task.get("telemetry_at_start", {})
     end_tele = task.get("telemetry_at_end", {})
@@ -207,17 +224,10 @@ def tag_critical_task(
         Tags indicating abnormal patterns (e.g., "high_cpu", "low_output").
     """
     if thresholds is None:
-        thresholds = {
-            "high_cpu": 80,
-            "high_mem": 1e9,
-            "high_disk": 1e8,
-            "long_duration": 0.8,
-            "low_output": 0.1,
-            "high_output": 0.9,
-        }
+        thresholds = DEFAULT_CRITICAL_TASK_THRESHOLDS
 
     cpu = abs(telemetry_summary.get("cpu", {}).get("percent_all_diff", 0))
-    mem = telemetry_summary.get("mem", {}).get("used_mem_diff", 0)
+    mem = telemetry_summary.get("memory", {}).get("used_mem_diff", 0)
     disk = telemetry_summary.get("disk", {}).get("read_bytes_diff", 0) + telemetry_summary.get("disk", {}).get(
         "write_bytes_diff", 0
     )
@@ -245,6 +255,141 @@ def tag_critical_task(
     return tags
 
 
+def summarize_telemetry_batch(tasks: List[Dict]) -> List[Dict]:
+    """
+    Compute the telemetry summaries of a batch of tasks.
+
+    This gives the same summaries as `summarize_telemetry`, in a single pass over the tasks. A group (e.g.,
+    cpu) is left out of a task's summary if any of its values is missing from either snapshot.
+
+    Parameters
+    ----------
+    tasks : list of dict
+        Tasks with telemetry_at_start and telemetry_at_end.
+
+    Returns
+    -------
+    list of dict
+        The telemetry summary of each task, in the same order.
+    """
+    groups = list(_TELEMETRY_SUMMARY_FUNCS.items())
+    summaries = []
+    for task in tasks:
+        summary = {}
+        started_at = task.get("started_at")
+        ended_at = task.get("ended_at")
+        if started_at is not None and ended_at is not None:
+            try:
+                summary["duration_sec"] = ended_at - started_at
+            except TypeError:
+                pass
+        start = task.get("telemetry_at_start") or {}
+        end = task.get("telemetry_at_end") or {}
+        for group, func in groups:
+            if group in start and group in end:
+                try:
+                    summary[group] = func(start[group], end[group])
+                except (KeyError, TypeError, IndexError):
+                    pass
+        summaries.append(summary)
+    return summaries
+
+
+def get_activity_thresholds(activity_id: str, activity_thresholds: Dict = None) -> Dict:
+    """
+    Get the thresholds used to tag the tasks of an activity.
+
+    Parameters
+    ----------
+    activity_id : str
+        The activity of the tasks.
+    activity_thresholds : dict, optional
+        Thresholds by activity_id. Those under "default" apply to all activities. Any threshold not given
+        keeps its value in `DEFAULT_CRITICAL_TASK_THRESHOLDS`.
+
+    Returns
+    -------
+    dict
+        All thresholds for the activity.
+    """
+    thresholds = dict(DEFAULT_CRITICAL_TASK_THRESHOLDS)
+    if activity_thresholds:
+        thresholds.update(activity_thresholds.get("default") or {})
+        if activity_id is not None:
+            thresholds.update(activity_thresholds.get(activity_id) or {})
+    return thresholds
+
+
+def tag_critical_tasks(
+    tasks: List[Dict],
+    telemetry_summaries: List[Dict],
+    generated_keywords: List[str] = ["result"],
+    activity_thresholds: Dict = None,
+) -> List[List[str]]:
+    """
+    Tag a batch of tasks with `tag_critical_task`, using the thresholds of each task's activity.
+
+    Parameters
+    ----------
+    tasks : list of dict
+        The tasks, with their activity_id and generated values.
+    telemetry_summaries : list of dict
+        The telemetry summary of each task, e.g., from `summarize_telemetry_batch`.
+    generated_keywords : list of str, optional
+        List of keys in the generated output to check for anomalies.
+    activity_thresholds : dict, optional
+        Thresholds by activity_id, as in `get_activity_thresholds`.
+
+    Returns
+    -------
+    list of list of str
+        The tags of each task, in the same order. Tasks whose generated values are not numbers get none.
+    """
+    thresholds_by_activity = {}
+    all_tags = []
+    for task, telemetry_summary in zip(tasks, telemetry_summaries):
+        activity_id = task.get("activity_id")
+        thresholds = thresholds_by_activity.get(activity_id)
+        if thresholds is None:
+            thresholds = get_activity_thresholds(activity_id, activity_thresholds)
+            thresholds_by_activity[activity_id] = thresholds
+        generated = task.get("generated")
+        try:
+            tags = tag_critical_task(
+                generated if isinstance(generated, dict) else {}, telemetry_summary, generated_keywords, thresholds
+            )
+        except TypeError:
+            tags = []
+        all_tags.append(tags)
+    return all_tags
+
+
+def add_telemetry_summaries(tasks: List[Dict], activity_thresholds: Dict = None) -> int:
+    """
+    Add the telemetry summary and critical tags to the tasks that have both telemetry snapshots.
+
+    Parameters
+    ----------
+    tasks : list of dict
+        The tasks to update in place, e.g., a buffer about to be flushed.
+    activity_thresholds : dict, optional
+        Thresholds by activity_id, as in `get_activity_thresholds`.
+
+    Returns
+    -------
+    int
+        The number of tasks summarized.
+    """
+    tasks = [task for task in tasks if task.get("telemetry_at_start") and task.get("telemetry_at_end")]
+    summaries = summarize_telemetry_batch(tasks)
+    all_tags = tag_critical_tasks(tasks, summaries, activity_thresholds=activity_thresholds)
+    for task, summary, tags in zip(tasks, summaries, all_tags):
+        task["telemetry_summary"] = summary
+        if tags:
+            task["tags"] = tags
+    return len(tasks)
+
+
 sample_tasks = [
     {
         "task_id": "t1",
@@ -80,6 +80,8 @@ FLOWCEPT_USER = settings["experiment"].get("user", "blank_user")
 ######################
 
 MQ_INSTANCES = settings["mq"].get("instances", None)
+MQ_SHARDING = settings["mq"].get("sharding", False)
+MQ_SHARD_KEY = settings["mq"].get("shard_key", "workflow_id")
 MQ_SETTINGS = settings["mq"]
 MQ_ENABLED = os.getenv("MQ_ENABLED", settings["mq"].get("enabled", True))
 MQ_TYPE = os.getenv("MQ_TYPE", settings["mq"].get("type", "redis"))
@@ -91,7 +93,20 @@ MQ_URI = os.getenv("MQ_URI", settings["mq"].get("uri", None))
 MQ_BUFFER_SIZE = settings["mq"].get("buffer_size", 1)
 MQ_INSERTION_BUFFER_TIME = settings["mq"].get("insertion_buffer_time_secs", 1)
 MQ_TIMING = settings["mq"].get("timing", False)
+MQ_SERIALIZER = settings["mq"].get("serializer", "msgpack")
+MQ_ARRAY_SUMMARY_THRESHOLD = int(settings["mq"].get("array_summary_threshold", 10_000))
 MQ_CHUNK_SIZE = int(settings["mq"].get("chunk_size", -1))
+MQ_ENVELOPE = settings["mq"].get("envelope", False)
+MQ_WIRE_FORMAT = settings["mq"].get("wire_format", "dict")
+MQ_INTERN_STRINGS = settings["mq"].get("intern_strings", False)
+MQ_MAX_PENDING = settings["mq"].get("max_pending", None)
+MQ_BACKPRESSURE_POLICY = settings["mq"].get("backpressure_policy", "block")
+MQ_BLOCK_TIMEOUT = settings["mq"].get("block_timeout_secs", 10)
+MQ_SPILL_PATH = settings["mq"].get("spill_path", "flowcept_mq_spill.jsonl")
+MQ_SPILL_LOG_SETTINGS = settings["mq"].get("spill_log", {})
+MQ_SPILL_LOG_ENABLED = MQ_SPILL_LOG_SETTINGS.get("enabled", False)
+MQ_COMPRESSION = settings["mq"].get("compression", "none")
+MQ_COMPRESSION_MIN_SIZE = int(settings["mq"].get("compression_min_size", 1024))
 
 #####################
 # KV SETTINGS       #
@@ -133,6 +148,8 @@ if LMDB_SETTINGS:
         LMDB_ENABLED = os.environ.get("LMDB_ENABLED").lower() == "true"
     else:
         LMDB_ENABLED = LMDB_SETTINGS.get("enabled", False)
+LMDB_COMPRESSION = LMDB_SETTINGS.get("compression", "none")
+LMDB_COMPRESSION_MIN_SIZE = int(LMDB_SETTINGS.get("compression_min_size", 256))
 
 # if not LMDB_ENABLED and not MONGO_ENABLED:
 #     # At least one of these variables need to be enabled.
@@ -148,6 +165,25 @@ DB_BUFFER_SIZE = int(db_buffer_settings.get("buffer_size", 50))
 REMOVE_EMPTY_FIELDS = db_buffer_settings.get("remove_empty_fields", False)
 DB_INSERTER_MAX_TRIALS_STOP = db_buffer_settings.get("stop_max_trials", 240)
 DB_INSERTER_SLEEP_TRIALS_STOP = db_buffer_settings.get("stop_trials_sleep", 0.01)
+DB_INSERTER_STOP_KV_CHECK_INTERVAL = float(db_buffer_settings.get("stop_kv_check_interval_secs", 1))
+DB_INSERTER_WORKERS = int(db_buffer_settings.get("inserter_workers", 1))
+DB_PIPELINE_WORKERS = int(db_buffer_settings.get("pipeline_workers", 0))
+DB_PIPELINE_QUEUE_SIZE = int(db_buffer_settings.get("pipeline_queue_size", 10_000))
+DB_ADAPTIVE_BUFFER = db_buffer_settings.get("adaptive", False)
+DB_MIN_BUFFER_SIZE = int(db_buffer_settings.get("min_buffer_size", 10))
+DB_MAX_BUFFER_SIZE = int(db_buffer_settings.get("max_buffer_size", 10_000))
+DB_MIN_INSERTION_BUFFER_TIME = float(db_buffer_settings.get("min_insertion_buffer_time_secs", 0.1))
+DB_MAX_INSERTION_BUFFER_TIME = float(db_buffer_settings.get("max_insertion_buffer_time_secs", 10))
+DB_TARGET_FLUSH_LATENCY = db_buffer_settings.get("target_flush_latency_secs", None)
+CAMPAIGN_ID_TTL = float(db_buffer_settings.get("campaign_id_ttl_secs", 5))
+DB_INFLIGHT_WINDOW = float(db_buffer_settings.get("inflight_window_secs", 0))
+DB_INFLIGHT_MAX_TASKS = int(db_buffer_settings.get("inflight_max_tasks", 10000))
+DB_INSERT_RETRIES = int(db_buffer_settings.get("insert_retries", 3))
+DB_INSERT_RETRY_BACKOFF = float(db_buffer_settings.get("insert_retry_backoff_secs", 0.5))
+DB_DEAD_LETTER_SETTINGS = db_buffer_settings.get("dead_letter", {})
+DB_DEAD_LETTER_ENABLED = DB_DEAD_LETTER_SETTINGS.get("enabled", False)
+DB_DEAD_LETTER_PATH = DB_DEAD_LETTER_SETTINGS.get("path", "flowcept_docdb_dead_letter.msgpack")
+DB_DEAD_LETTER_MAX_BISECT_SECS = float(DB_DEAD_LETTER_SETTINGS.get("max_bisect_secs", 30))
 
 
 ###########################
@@ -160,6 +196,7 @@ PERF_LOG = settings["project"].get("performance_logging", False)
 JSON_SERIALIZER = settings["project"].get("json_serializer", "default")
 REPLACE_NON_JSON_SERIALIZABLE = settings["project"].get("replace_non_json_serializable", True)
 ENRICH_MESSAGES = settings["project"].get("enrich_messages", True)
+CRITICAL_TASK_THRESHOLDS = settings["project"].get("critical_task_thresholds", None)
 
 _DEFAULT_DUMP_BUFFER_ENABLED = DB_FLUSH_MODE == "offline"
 DUMP_BUFFER_ENABLED = (
@@ -20,6 +20,7 @@ from flowcept.configs import (
     KVDB_ENABLED,
     MQ_ENABLED,
     DUMP_BUFFER_PATH,
+    DB_INSERTER_WORKERS,
 )
 from flowcept.flowceptor.adapters.base_interceptor import BaseInterceptor
 
@@ -432,7 +433,12 @@ class Flowcept(object):
 
         from flowcept.flowceptor.consumers.document_inserter import DocumentInserter
 
-        doc_inserter = DocumentInserter(check_safe_stops=self._check_safe_stops, bundle_exec_id=self.bundle_exec_id)
+        doc_inserter = DocumentInserter(
+            check_safe_stops=self._check_safe_stops,
+            bundle_exec_id=self.bundle_exec_id,
+            mq_host=mq_host,
+            mq_port=mq_port,
+        )
         doc_inserter.start()
         self._db_inserters.append(doc_inserter)
 
@@ -538,6 +544,8 @@ class Flowcept(object):
         - The method initializes the `DocumentInserter` service, which processes documents
           based on the provided parameters.
         - The `threaded` parameter for `DocumentInserter.start` is set to `False`.
+        - If `inserter_workers` is greater than 1 in the `db_buffer` settings, a
+          `PartitionedDocumentInserter` spreads the messages over that many worker processes.
 
         Examples
         --------
@@ -545,9 +553,16 @@ class Flowcept(object):
         """
         if consumers is not None:
             raise NotImplementedError("We currently only have one type of consumer.")
-        from flowcept.flowceptor.consumers.document_inserter import DocumentInserter
-
         logger = FlowceptLogger()
-        doc_inserter = DocumentInserter(check_safe_stops=check_safe_stops, bundle_exec_id=bundle_exec_id)
+        if DB_INSERTER_WORKERS > 1:
+            from flowcept.flowceptor.consumers.partitioned_document_inserter import PartitionedDocumentInserter
+
+            doc_inserter = PartitionedDocumentInserter(
+                DB_INSERTER_WORKERS, check_safe_stops=check_safe_stops, bundle_exec_id=bundle_exec_id
+            )
+        else:
+            from flowcept.flowceptor.consumers.document_inserter import DocumentInserter
+
+            doc_inserter = DocumentInserter(check_safe_stops=check_safe_stops, bundle_exec_id=bundle_exec_id)
         logger.debug("Starting doc inserter service.")
         doc_inserter.start(threaded=False)
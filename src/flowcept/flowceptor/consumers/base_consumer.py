@@ -4,7 +4,7 @@ from typing import Callable, Dict, Tuple, Optional
 
 from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
 from flowcept.commons.flowcept_logger import FlowceptLogger
-from flowcept.configs import MQ_ENABLED
+from flowcept.configs import MQ_ENABLED, MQ_TYPE
 
 
 class BaseConsumer(object):
@@ -15,12 +15,28 @@ class BaseConsumer(object):
     message queues and dispatching messages to a handler.
     """
 
-    def __init__(self):
-        """Initialize the message queue DAO and logger."""
-        if not MQ_ENABLED:
-            raise Exception("MQ is disabled in the settings. You cannot consume messages.")
+    def __init__(self, mq_host=None, mq_port=None, mq_dao: MQDao = None):
+        """Initialize the message queue DAO and logger.
 
-        self._mq_dao = MQDao.build()
+        Parameters
+        ----------
+        mq_host : str, optional
+            Host of the MQ instance to consume from, if not the configured one.
+        mq_port : int, optional
+            Port of the MQ instance to consume from. Not supported by the mofka and shm MQs.
+        mq_dao : MQDao, optional
+            The MQ DAO to consume from. If not given, one is built from the settings.
+        """
+        if mq_dao is not None:
+            self._mq_dao = mq_dao
+        elif not MQ_ENABLED:
+            raise Exception("MQ is disabled in the settings. You cannot consume messages.")
+        elif mq_host is not None:
+            if MQ_TYPE in {"mofka", "shm"}:
+                raise Exception(f"The {MQ_TYPE} MQ cannot consume from a given host. Remove mq.instances.")
+            self._mq_dao = MQDao.build(mq_host=mq_host, mq_port=mq_port)
+        else:
+            self._mq_dao = MQDao.build()
 
         self.logger = FlowceptLogger()
         self._main_thread: Optional[Thread] = None
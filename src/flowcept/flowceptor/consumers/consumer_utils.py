@@ -1,16 +1,34 @@
 """Consumer utilities module."""
 
+from collections import OrderedDict, deque
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from time import time
-from typing import List, Dict
+from threading import Lock
+from time import time, monotonic
+from typing import List, Dict, Tuple
+
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.flowcept_logger import FlowceptLogger
 
 from flowcept.commons.flowcept_dataclasses.task_object import TaskObject
+from flowcept.commons.flowcept_dataclasses.workflow_object import WorkflowObject
 from flowcept.commons.vocabulary import Status
 
 UTC_TZ = ZoneInfo("UTC")
 
 
+def message_kind(msg_obj: Dict) -> str:
+    """Tell whether a message is a task, a workflow, a control message, or something else."""
+    msg_type = msg_obj.get("type")
+    if msg_type == "task" or (msg_type is None and ("task_id" in msg_obj or "activity_id" in msg_obj)):
+        return "task"
+    if msg_type == "workflow" or (msg_type is None and ("name" in msg_obj or "environment_id" in msg_obj)):
+        return "workflow"
+    if msg_type == "flowcept_control":
+        return "control"
+    return "other"
+
+
 def curate_task_msg(task_msg_dict: dict, convert_times=True, keys_to_drop: List = None):
     """Curate a task message."""
     # Converting any arg to kwarg in the form {"arg1": val1, "arg2: val2}
@@ -161,3 +179,200 @@ def curate_dict_task_messages(
 
         indexed_buffer[indexing_key_value].update(**doc)
     return indexed_buffer
+
+
+def curate_dict_workflow_messages(doc_list: List[Dict]) -> Dict[str, Dict]:
+    """Merge workflow messages by workflow_id.
+
+    As in `curate_dict_task_messages`, later messages update the fields of earlier messages of the
+    same workflow, and the dict fields (e.g., used, custom_metadata) are updated instead of replaced.
+    Interceptor ids are appended.
+
+    :param doc_list: workflow messages, in the order they were received.
+    :return: the merged workflow documents, by workflow_id.
+    """
+    workflow_id_field = WorkflowObject.workflow_id_field()
+    indexed_buffer = {}
+    for doc_ref in doc_list:
+        workflow_id = doc_ref.get(workflow_id_field)
+        if workflow_id is None:
+            FlowceptLogger().error(f"Ignoring a workflow message without {workflow_id_field}: {doc_ref}")
+            continue
+        if workflow_id not in indexed_buffer:
+            # Copies of the fields that are updated in place.
+            indexed_buffer[workflow_id] = {
+                k: v.copy() if isinstance(v, (dict, list)) else v for k, v in doc_ref.items()
+            }
+            continue
+        merged = indexed_buffer[workflow_id]
+        doc = doc_ref.copy()
+        for field in WorkflowObject.get_dict_field_names():
+            if field in doc:
+                if isinstance(doc[field], dict) and isinstance(merged.get(field), dict):
+                    merged[field].update(doc.pop(field))
+                elif not doc[field]:
+                    doc.pop(field)
+        interceptor_ids = doc.pop("interceptor_ids", None)
+        if interceptor_ids:
+            merged["interceptor_ids"] = list(merged.get("interceptor_ids") or []) + list(interceptor_ids)
+        merged.update(doc)
+    return indexed_buffer
+
+
+class CampaignIdCache:
+    """
+    Local copy of the current campaign id stored in the key-value DB.
+
+    The value is read again once it is older than `ttl` seconds, and updated as soon as
+    `MQDao.set_campaign_id` or `MQDao.delete_current_campaign_id` publish a change, so
+    consumers do not query the key-value DB for every message.
+    """
+
+    def __init__(self, keyvalue_dao, ttl: float):
+        self._keyvalue_dao = keyvalue_dao
+        self._ttl = ttl
+        self._value = None
+        self._expires_at = 0
+        self._lock = Lock()
+        self._subscription = None
+        if keyvalue_dao is not None:
+            try:
+                self._subscription = keyvalue_dao.subscribe(MQDao.CAMPAIGN_ID_CHANNEL, self._on_change)
+            except Exception as e:
+                FlowceptLogger().error(f"Could not subscribe to campaign id changes. Relying on the TTL only: {e}")
+
+    def _on_change(self, message):
+        data = message["data"]
+        with self._lock:
+            self._value = (data.decode() if isinstance(data, bytes) else data) or None
+            self._expires_at = monotonic() + self._ttl
+
+    def get(self):
+        """Get the current campaign id, or None if there is none."""
+        if self._keyvalue_dao is None:
+            return None
+        if monotonic() >= self._expires_at:
+            with self._lock:
+                if monotonic() >= self._expires_at:
+                    self._value = self._keyvalue_dao.get_key(MQDao.CAMPAIGN_ID_KEY)
+                    self._expires_at = monotonic() + self._ttl
+        return self._value
+
+    def close(self):
+        """Stop listening to campaign id changes."""
+        if self._subscription is not None:
+            self._subscription.stop()
+            self._subscription = None
+
+
+class InFlightTaskCache:
+    """
+    Holds the messages of tasks that did not finish yet across DB flushes.
+
+    Task updates (e.g., RUNNING, then FINISHED) often land in different flushes, each one becoming
+    its own upsert. Instead, the messages of a task are held until it reaches a terminal status, or
+    until `window` seconds after its first held message, and then written together, so the DAOs
+    merge them into a single upsert. At most `max_tasks` tasks are held: beyond it, the least
+    recently updated ones are written.
+
+    Flushes are numbered, so the MQ acknowledgments and commit counts of a flush are only released
+    once no task held since that flush remains unwritten.
+
+    It is meant to be used only by the flush thread, except for `close` and `has_expired`.
+    """
+
+    def __init__(self, window: float, max_tasks: int):
+        self._window = window
+        self._max_tasks = max_tasks
+        # task_id -> [messages, number of the flush of the first message]. Ordered by last update.
+        self._tasks: OrderedDict = OrderedDict()
+        # (expiration time, task_id, flush number), in the order tasks are first held.
+        self._expirations = deque()
+        # Number of held tasks by the flush of their first message.
+        self._held_by_flush: Dict[int, int] = {}
+        # [flush number, ack ids, number of messages, whether committed] of the flushes not released yet.
+        self._pending = deque()
+        self._flush_number = 0
+        self._closed = False
+
+    def __len__(self):
+        return len(self._tasks)
+
+    @staticmethod
+    def _is_terminal(msg: Dict) -> bool:
+        return msg.get("status") in Status.get_finished_statuses() or bool(msg.get("finished"))
+
+    def _release_task(self, task_id) -> List[Dict]:
+        msgs, flush_number = self._tasks.pop(task_id)
+        self._held_by_flush[flush_number] -= 1
+        if not self._held_by_flush[flush_number]:
+            del self._held_by_flush[flush_number]
+        return msgs
+
+    def merge(self, tasks: List[Dict]) -> List[Dict]:
+        """
+        Hold the messages of unfinished tasks, and get the messages to write now.
+
+        The messages to write are those of tasks that reached a terminal status, with their held
+        messages, and those of tasks held for too long or evicted.
+        """
+        self._flush_number += 1
+        task_id_field = TaskObject.task_id_field()
+        to_write = []
+        for msg in tasks:
+            task_id = msg.get(task_id_field)
+            if task_id is None:
+                to_write.append(msg)
+                continue
+            if task_id in self._tasks:
+                self._tasks[task_id][0].append(msg)
+                self._tasks.move_to_end(task_id)
+                if self._closed or InFlightTaskCache._is_terminal(msg):
+                    to_write.extend(self._release_task(task_id))
+            elif self._closed or InFlightTaskCache._is_terminal(msg):
+                to_write.append(msg)
+            else:
+                self._tasks[task_id] = [[msg], self._flush_number]
+                self._held_by_flush[self._flush_number] = self._held_by_flush.get(self._flush_number, 0) + 1
+                self._expirations.append((monotonic() + self._window, task_id, self._flush_number))
+
+        now = monotonic()
+        while len(self._expirations) and (self._closed or self._expirations[0][0] <= now):
+            _, task_id, flush_number = self._expirations.popleft()
+            # The task may have been written, and held again since.
+            if task_id in self._tasks and self._tasks[task_id][1] == flush_number:
+                to_write.extend(self._release_task(task_id))
+        while len(self._tasks) > self._max_tasks:
+            to_write.extend(self._release_task(next(iter(self._tasks))))
+        return to_write
+
+    def release(self, ack_ids: List, n_msgs: int, committed: bool = True) -> List[Tuple[bool, List, int]]:
+        """
+        Register the acknowledgments and message count of the current flush, and whether it committed.
+
+        A failed flush may have written held messages of any flush not released yet, so those fail too.
+
+        Returns whether each flush committed, its acknowledgments, and its message count, for the
+        flushes up to the current one none of whose messages are held anymore, in order.
+        """
+        if not committed:
+            for pending in self._pending:
+                pending[3] = False
+        self._pending.append([self._flush_number, ack_ids, n_msgs, committed])
+        oldest_held = min(self._held_by_flush) if len(self._held_by_flush) else self._flush_number + 1
+        released = []
+        while len(self._pending) and self._pending[0][0] < oldest_held:
+            _, flush_ack_ids, flush_msgs, flush_committed = self._pending.popleft()
+            released.append((flush_committed, flush_ack_ids, flush_msgs))
+        return released
+
+    def has_expired(self) -> bool:
+        """Check if a held task should be written already."""
+        try:
+            return self._expirations[0][0] <= monotonic()
+        except IndexError:
+            return False
+
+    def close(self):
+        """Write all held tasks on the next flush, and hold no more tasks."""
+        self._closed = True
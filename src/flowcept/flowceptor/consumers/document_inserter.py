@@ -1,18 +1,25 @@
 """Document Inserter module."""
 
-from threading import Thread
-from time import time, sleep
-from typing import Dict, Callable, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from queue import Queue
+from threading import Condition, Event, Thread
+from time import time, monotonic, perf_counter
+from typing import Dict, Callable, List, Tuple
 from uuid import uuid4
+from zlib import crc32
 
-from flowcept.commons.task_data_preprocess import summarize_telemetry, tag_critical_task
+from flowcept.commons.task_data_preprocess import add_telemetry_summaries
 from flowcept.flowceptor.consumers.base_consumer import BaseConsumer
 from flowcept.commons.autoflush_buffer import AutoflushBuffer
+from flowcept.commons.daos.docdb_dao.docdb_dead_letter import DocDBDeadLetter, find_unwritable, write_with_retries
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
 from flowcept.commons.flowcept_dataclasses.task_object import TaskObject
 from flowcept.commons.flowcept_dataclasses.workflow_object import (
     WorkflowObject,
 )
 from flowcept.commons.flowcept_logger import FlowceptLogger
+from flowcept.commons.flowcept_metrics import get_metrics, LAG_BUCKETS
 from flowcept.commons.utils import GenericJSONDecoder
 from flowcept.commons.vocabulary import Status
 from flowcept.configs import (
@@ -20,13 +27,36 @@ from flowcept.configs import (
     DB_BUFFER_SIZE,
     DB_INSERTER_MAX_TRIALS_STOP,
     DB_INSERTER_SLEEP_TRIALS_STOP,
+    DB_INSERTER_STOP_KV_CHECK_INTERVAL,
+    DB_PIPELINE_WORKERS,
+    DB_PIPELINE_QUEUE_SIZE,
+    DB_ADAPTIVE_BUFFER,
+    DB_MIN_BUFFER_SIZE,
+    DB_MAX_BUFFER_SIZE,
+    DB_MIN_INSERTION_BUFFER_TIME,
+    DB_MAX_INSERTION_BUFFER_TIME,
+    DB_TARGET_FLUSH_LATENCY,
+    CAMPAIGN_ID_TTL,
+    DB_INFLIGHT_WINDOW,
+    DB_INFLIGHT_MAX_TASKS,
     REMOVE_EMPTY_FIELDS,
     JSON_SERIALIZER,
     ENRICH_MESSAGES,
+    CRITICAL_TASK_THRESHOLDS,
     MONGO_ENABLED,
     LMDB_ENABLED,
+    DB_INSERT_RETRIES,
+    DB_INSERT_RETRY_BACKOFF,
+    DB_DEAD_LETTER_ENABLED,
+    DB_DEAD_LETTER_PATH,
+    DB_DEAD_LETTER_MAX_BISECT_SECS,
 )
 from flowcept.flowceptor.consumers.consumer_utils import (
+    CampaignIdCache,
+    InFlightTaskCache,
+    curate_dict_task_messages,
+    curate_dict_workflow_messages,
+    message_kind,
     remove_empty_fields_from_dict,
 )
 
@@ -42,6 +72,11 @@ class DocumentInserter(BaseConsumer):
 
     The inserter is intended to run in a thread or process alongside other Flowcept consumers,
     ensuring provenance data is persisted reliably and in a structured format.
+
+    With `pipeline_workers` > 0, handling is split into stages connected by bounded queues: the MQ
+    listener thread only receives messages and routes them, by `task_id`, to one of the enrichment
+    threads, which enrich and append them to the DB buffer, whose flush thread writes them to the
+    DocDBs. A slow DocDB write then no longer stalls the draining of the MQ connection.
     """
 
     DECODER = GenericJSONDecoder if JSON_SERIALIZER == "complex" else None
@@ -62,14 +97,21 @@ class DocumentInserter(BaseConsumer):
         self,
         check_safe_stops=True,
         bundle_exec_id=None,
+        mq_host=None,
+        mq_port=None,
+        on_commit: Callable = None,
+        pipeline_workers: int = DB_PIPELINE_WORKERS,
+        doc_daos: List = None,
+        mq_dao: MQDao = None,
     ):
-        self._doc_daos = []
+        # The DocDB and MQ DAOs are built from the settings, unless given.
+        self._doc_daos = doc_daos if doc_daos is not None else []
         self.logger = FlowceptLogger()
-        if MONGO_ENABLED:
+        if doc_daos is None and MONGO_ENABLED:
             from flowcept.commons.daos.docdb_dao.mongodb_dao import MongoDBDAO
 
             self._doc_daos.append(MongoDBDAO())
-        if LMDB_ENABLED:
+        if doc_daos is None and LMDB_ENABLED:
             from flowcept.commons.daos.docdb_dao.lmdb_dao import LMDBDAO
 
             self._doc_daos.append(LMDBDAO())
@@ -78,24 +120,108 @@ class DocumentInserter(BaseConsumer):
             self._should_start = False
             return
 
-        super().__init__()
+        super().__init__(mq_host=mq_host, mq_port=mq_port, mq_dao=mq_dao)
         self._previous_time = time()
         self._main_thread: Thread = None
         self._curr_db_buffer_size = DB_BUFFER_SIZE
-        self._bundle_exec_id = bundle_exec_id
-        self.check_safe_stops = check_safe_stops
+        self._init_safe_stops(check_safe_stops, bundle_exec_id)
+        # Messages are acknowledged to the MQ only after they are flushed to the DocDBs.
+        self._mq_dao.ack_after_commit = True
+        self._campaign_id_cache = CampaignIdCache(self._mq_dao._keyvalue_dao, CAMPAIGN_ID_TTL)
+        self._inflight_cache = (
+            InFlightTaskCache(DB_INFLIGHT_WINDOW, DB_INFLIGHT_MAX_TASKS) if DB_INFLIGHT_WINDOW else None
+        )
+        self._inflight_stop_event = Event()
+        # With more than one DocDB, each one is written by its own thread, so flushes take as long as the slowest.
+        self._dao_executor = (
+            ThreadPoolExecutor(max_workers=len(self._doc_daos), thread_name_prefix="docdb_writer")
+            if len(self._doc_daos) > 1
+            else None
+        )
+        self._dead_letter = DocDBDeadLetter(DB_DEAD_LETTER_PATH) if DB_DEAD_LETTER_ENABLED else None
         self.buffer: AutoflushBuffer = AutoflushBuffer(
             flush_function=DocumentInserter.flush_function,
-            flush_function_kwargs={"logger": self.logger, "doc_daos": self._doc_daos},
+            flush_function_kwargs={
+                "logger": self.logger,
+                "doc_daos": self._doc_daos,
+                "mq_dao": self._mq_dao,
+                "on_commit": on_commit,
+                "campaign_id_cache": self._campaign_id_cache,
+                "inflight_cache": self._inflight_cache,
+                "dao_executor": self._dao_executor,
+                "dead_letter": self._dead_letter,
+            },
             max_size=self._curr_db_buffer_size,
             flush_interval=INSERTION_BUFFER_TIME,
+            name="db",
+            on_flush=self._init_adaptive_flush(),
         )
+        metrics = get_metrics()
+        self._consumed_metrics = {
+            msg_type: metrics.counter(
+                "flowcept_consumer_messages_total", "Messages handled by document inserters.", type=msg_type
+            )
+            for msg_type in ("task", "workflow", "flowcept_control", "other")
+        }
+        self._lag_metric = metrics.histogram(
+            "flowcept_consumer_lag_seconds",
+            "Delay between the last timestamp of a task and its handling by a document inserter.",
+            buckets=LAG_BUCKETS,
+        )
+        self._pipeline_queues: List[Queue] = [Queue(maxsize=DB_PIPELINE_QUEUE_SIZE) for _ in range(pipeline_workers)]
+        self._pipeline_threads: List[Thread] = []
+        if pipeline_workers:
+            self._received_metric = metrics.counter(
+                "flowcept_inserter_stage_messages_total", "Messages through each inserter stage.", stage="receive"
+            )
+            self._enriched_metric = metrics.counter(
+                "flowcept_inserter_stage_messages_total", "Messages through each inserter stage.", stage="enrich"
+            )
+            self._pipeline_depth_metric = metrics.gauge(
+                "flowcept_inserter_stage_queue_depth", "Messages waiting for each inserter stage.", stage="enrich"
+            )
+            self._pipeline_depth_metric.track(self._get_pipeline_depth)
+
+    def _init_safe_stops(self, check_safe_stops: bool, bundle_exec_id):
+        """Initialize the bookkeeping of the stop messages of interceptors, used by `stop` to wait for them."""
+        self._bundle_exec_id = bundle_exec_id
+        self.check_safe_stops = check_safe_stops
+        # Ids of the interceptors whose stop messages were received, by exec bundle id, until a wait for it ends.
+        self._stopped_interceptors: Dict[str, set] = {}
+        self._stopped_interceptors_cond = Condition()
 
     @staticmethod
-    def flush_function(buffer, doc_daos, logger):
+    def _init_adaptive_flush():
+        if not DB_ADAPTIVE_BUFFER:
+            return None
+        from flowcept.commons.adaptive_flush import AdaptiveFlushController
+
+        return AdaptiveFlushController(
+            min_size=DB_MIN_BUFFER_SIZE,
+            max_size=DB_MAX_BUFFER_SIZE,
+            min_interval=DB_MIN_INSERTION_BUFFER_TIME,
+            max_interval=DB_MAX_INSERTION_BUFFER_TIME,
+            target_latency=DB_TARGET_FLUSH_LATENCY,
+            name="db",
+        )
+
+    @staticmethod
+    def flush_function(
+        buffer,
+        doc_daos,
+        logger,
+        mq_dao: MQDao = None,
+        on_commit: Callable = None,
+        campaign_id_cache: CampaignIdCache = None,
+        inflight_cache: InFlightTaskCache = None,
+        dao_executor: ThreadPoolExecutor = None,
+        dead_letter: DocDBDeadLetter = None,
+    ):
         """
         Flush the buffer contents to all configured document databases.
 
+        The buffer is curated once, and the same curated documents are given to every DocDB.
+
         Parameters
         ----------
         buffer : list
@@ -104,14 +230,162 @@ class DocumentInserter(BaseConsumer):
             List of DAO instances to insert data into (e.g., MongoDBDAO, LMDBDAO).
         logger : FlowceptLogger
             Logger instance for debug and info logging.
+        mq_dao : MQDao, optional
+            If given, the flushed messages are acknowledged to the MQ once all DocDBs committed them.
+        on_commit : Callable, optional
+            If given, called with whether all DocDBs committed a flush and its number of messages, for
+            each flush, in order.
+        campaign_id_cache : CampaignIdCache, optional
+            If given, messages without a campaign_id get the current one.
+        inflight_cache : InFlightTaskCache, optional
+            If given, messages of unfinished tasks are held there, and the acknowledgments and commit
+            counts of a flush are only given once none of its messages is held.
+        dao_executor : ThreadPoolExecutor, optional
+            If given, the DocDBs are written concurrently by its threads. Otherwise, one after the other.
+        dead_letter : DocDBDeadLetter, optional
+            If given, documents that a DocDB cannot write, even after retries, while it writes the rest of the
+            batch, are saved there, and the flush still counts as committed.
+
+        Returns
+        -------
+        tuple
+            The number of documents written, and the time the DocDBs took to write them, which the buffer
+            reports to its `on_flush` callback.
         """
         logger.info(f"Current Doc buffer size: {len(buffer)}, Gonna flush {len(buffer)} msgs to DocDBs!")
-        for dao in doc_daos:
-            dao.insert_and_update_many_tasks(buffer, TaskObject.task_id_field())
-            logger.debug(
-                f"DocDao={id(dao)},DocDaoClass={dao.__class__.__name__};\
-                Flushed {len(buffer)} msgs to this DocDB!"
-            )  # TODO: add name
+        ack_ids = [msg.pop(MQDao.ACK_ID_FIELD) for msg in buffer if MQDao.ACK_ID_FIELD in msg]
+        # Flush triggers appended for the in-flight cache are empty.
+        buffer = [msg for msg in buffer if len(msg)]
+        tasks = [msg for msg in buffer if msg.get("type") != "workflow"]
+        workflows = [msg for msg in buffer if msg.get("type") == "workflow"] if len(tasks) < len(buffer) else []
+        if campaign_id_cache is not None:
+            DocumentInserter._set_campaign_id(tasks, campaign_id_cache, logger)
+        if ENRICH_MESSAGES:
+            try:
+                # Summarizing the whole buffer at once is much cheaper than summarizing each message.
+                add_telemetry_summaries(tasks, CRITICAL_TASK_THRESHOLDS)
+            except Exception as e:
+                logger.error(f"Could not summarize the telemetry of the flushed tasks: {e}")
+        n_msgs = len(buffer)
+        if inflight_cache is not None:
+            tasks = inflight_cache.merge(tasks)
+        try:
+            curated_tasks = curate_dict_task_messages(tasks, TaskObject.task_id_field(), convert_times=False)
+            curated_workflows = curate_dict_workflow_messages(workflows)
+        except Exception as e:
+            logger.exception(e)
+            curated_tasks = curated_workflows = None
+        n_docs, write_seconds = 0, 0.0
+        if curated_tasks is None:
+            committed = False
+        elif dao_executor is not None:
+            futures = [
+                dao_executor.submit(
+                    DocumentInserter._write_to_dao, dao, curated_tasks, curated_workflows, logger, dead_letter
+                )
+                for dao in doc_daos
+            ]
+            writes = [future.result() for future in futures]
+            committed = all(dao_committed for dao_committed, _ in writes)
+            n_docs = len(curated_tasks) + len(curated_workflows)
+            write_seconds = max(seconds for _, seconds in writes)
+        else:
+            writes = [
+                DocumentInserter._write_to_dao(dao, curated_tasks, curated_workflows, logger, dead_letter)
+                for dao in doc_daos
+            ]
+            committed = all(dao_committed for dao_committed, _ in writes)
+            n_docs = len(curated_tasks) + len(curated_workflows)
+            write_seconds = sum(seconds for _, seconds in writes)
+        released = [(committed, ack_ids, n_msgs)]
+        if inflight_cache is not None:
+            released = inflight_cache.release(ack_ids, n_msgs, committed)
+        committed_ack_ids = []
+        for flush_committed, flush_ack_ids, flush_msgs in released:
+            if flush_committed:
+                committed_ack_ids.extend(flush_ack_ids)
+            elif flush_msgs:
+                logger.error(f"Not acknowledging {flush_msgs} messages, as not all DocDBs committed them.")
+        if mq_dao is not None and len(committed_ack_ids):
+            mq_dao.ack(committed_ack_ids)
+        if on_commit is not None:
+            for flush_committed, _, flush_msgs in released:
+                on_commit(flush_committed, flush_msgs)
+        return n_docs, write_seconds
+
+    @staticmethod
+    def _write_to_dao(
+        dao, curated_tasks: Dict, curated_workflows: Dict, logger, dead_letter: DocDBDeadLetter = None
+    ) -> Tuple[bool, float]:
+        """Write the curated documents of a flush to one DocDB.
+
+        Returns whether it committed or dead-lettered them, and how long it took.
+
+        Failed writes are retried with backoff. If a write still fails, the documents that cannot be written are
+        found by bisecting the batch, so only those are dead-lettered. If no part of the batch can be written, the
+        DocDB is likely down, so nothing is dead-lettered, and the flush is not committed, for the MQ to redeliver it.
+        """
+        dao_name = dao.__class__.__name__
+        metrics = get_metrics()
+        committed = True
+        t0 = perf_counter()
+        writes = (
+            ("tasks", curated_tasks, partial(dao.upsert_curated_tasks, indexing_key=TaskObject.task_id_field())),
+            ("workflows", curated_workflows, dao.upsert_curated_workflows),
+        )
+        for collection, docs, write in writes:
+            if not len(docs):
+                continue
+            # A failing DocDB does not keep the others from being written, as failures are caught here.
+            if write_with_retries(write, docs, DB_INSERT_RETRIES, DB_INSERT_RETRY_BACKOFF, logger):
+                continue
+            metrics.counter("flowcept_docdb_insert_errors_total", "Failed DocDB bulk inserts.", dao=dao_name).inc()
+            unwritable = None
+            if dead_letter is not None:
+                unwritable = find_unwritable(write, docs, logger, DB_DEAD_LETTER_MAX_BISECT_SECS)
+            if unwritable is None:
+                logger.error(f"{dao_name} could not write {len(docs)} {collection}.")
+                committed = False
+            elif dead_letter.append(dao_name, collection, unwritable):
+                logger.error(
+                    f"{dao_name} could not write {len(unwritable)} of {len(docs)} {collection}. "
+                    f"They were saved in {dead_letter.path}."
+                )
+                metrics.counter(
+                    "flowcept_docdb_dead_letter_documents_total",
+                    "Documents saved in the dead-letter file.",
+                    dao=dao_name,
+                ).inc(len(unwritable))
+            else:
+                logger.error(f"{dao_name} could not write {len(unwritable)} of {len(docs)} {collection}.")
+                committed = False
+        seconds = perf_counter() - t0
+        metrics.histogram("flowcept_docdb_insert_seconds", "Duration of DocDB bulk inserts.", dao=dao_name).observe(
+            seconds
+        )
+        logger.debug(
+            f"DocDao={id(dao)},DocDaoClass={dao_name};\
+            Flushed {len(curated_tasks) + len(curated_workflows)} msgs to this DocDB!"
+        )
+        return committed, seconds
+
+    @staticmethod
+    def _set_campaign_id(buffer, campaign_id_cache: CampaignIdCache, logger):
+        """Set the current campaign id, looked up once per flush, in the messages without one."""
+        campaign_id = None
+        looked_up = False
+        for message in buffer:
+            if "campaign_id" in message:
+                continue
+            if not looked_up:
+                looked_up = True
+                try:
+                    campaign_id = campaign_id_cache.get()
+                except Exception as e:
+                    logger.error(e)
+                if not campaign_id:
+                    return
+            message["campaign_id"] = campaign_id
 
     def _handle_task_message(self, message: Dict):
         if "workflow_id" not in message and len(message.get("used", {})):
@@ -119,14 +393,6 @@ class DocumentInserter(BaseConsumer):
             if wf_id:
                 message["workflow_id"] = wf_id
 
-        if "campaign_id" not in message:
-            try:
-                campaign_id = self._mq_dao._keyvalue_dao.get_key("current_campaign_id")
-                if campaign_id:
-                    message["campaign_id"] = campaign_id
-            except Exception as e:
-                self.logger.error(e)
-
         if "subtype" not in message and "group_id" in message:
             message["subtype"] = "iteration"
 
@@ -143,38 +409,23 @@ class DocumentInserter(BaseConsumer):
 
         if ENRICH_MESSAGES:
             TaskObject.enrich_task_dict(message)
-            if (
-                "telemetry_at_start" in message
-                and message["telemetry_at_start"]
-                and "telemetry_at_end" in message
-                and message["telemetry_at_end"]
-            ):
-                try:
-                    telemetry_summary = summarize_telemetry(message, self.logger)
-                    message["telemetry_summary"] = telemetry_summary
-                    # TODO: make this configurable
-                    tags = tag_critical_task(
-                        generated=message.get("generated", {}), telemetry_summary=telemetry_summary, thresholds=None
-                    )
-                    if tags:
-                        message["tags"] = tags
-                except Exception as e:
-                    self.logger.error(e)  # TODO: check if cpu, etc is in the fields in for the telemetry_summary
 
         if REMOVE_EMPTY_FIELDS:
             remove_empty_fields_from_dict(message)
 
+        timestamp = message.get("ended_at") or message.get("started_at")
+        if isinstance(timestamp, (int, float)):
+            self._lag_metric.observe(time() - timestamp)
+
         self.logger.debug(f"Received following Task msg in DocInserter:\n\t[BEGIN_MSG]{message}\n[END_MSG]\t")
         self.buffer.append(message)
 
     def _handle_workflow_message(self, message: Dict):
-        message.pop("type")
         self.logger.debug(f"Received following Workflow msg in DocInserter:\n\t[BEGIN_MSG]{message}\n[END_MSG]\t")
         if REMOVE_EMPTY_FIELDS:
             remove_empty_fields_from_dict(message)
-        wf_obj = WorkflowObject.from_dict(message)
-        for dao in self._doc_daos:
-            dao.insert_or_update_workflow(wf_obj)
+        # Workflows are buffered with the tasks. Their dicts keep type=workflow, so the flush can tell them apart.
+        self.buffer.append(WorkflowObject.from_dict(message).to_dict())
 
     def _handle_control_message(self, message):
         self.logger.info(f"I'm doc inserter {id(self)}. I received this control msg received: {message}")
@@ -187,6 +438,9 @@ class DocumentInserter(BaseConsumer):
                 f"{'' if exec_bundle_id is None else exec_bundle_id}_{interceptor_instance_id}!"
             )
             if self.check_safe_stops:
+                with self._stopped_interceptors_cond:
+                    self._stopped_interceptors.setdefault(exec_bundle_id, set()).add(interceptor_instance_id)
+                    self._stopped_interceptors_cond.notify_all()
                 self.logger.info(
                     f"Begin register_time_based_thread_end "
                     f"{'' if exec_bundle_id is None else exec_bundle_id}_{interceptor_instance_id}!"
@@ -231,10 +485,47 @@ class DocumentInserter(BaseConsumer):
         super().start(target=self.thread_target, threaded=threaded, daemon=daemon)
         return self
 
+    def _expire_inflight_tasks(self):
+        """Trigger flushes when held tasks expire, as the buffer only flushes when it has messages."""
+        interval = max(DB_INFLIGHT_WINDOW / 2, 0.1)
+        while not self._inflight_stop_event.wait(interval):
+            if self._inflight_cache.has_expired():
+                self.buffer.append({})
+
+    def start_buffer(self):
+        """Start the threads that feed the DB buffer, other than the MQ listener."""
+        for queue in self._pipeline_queues:
+            thread = Thread(target=self._enrichment_stage, args=(queue,), daemon=True)
+            thread.start()
+            self._pipeline_threads.append(thread)
+        if self._inflight_cache is not None:
+            Thread(target=self._expire_inflight_tasks, daemon=True).start()
+
+    def stop_buffer(self):
+        """Flush everything received, including the held tasks, and stop the DB buffer."""
+        for queue in self._pipeline_queues:
+            queue.put(None)
+        for thread in self._pipeline_threads:
+            thread.join()
+        if len(self._pipeline_queues):
+            self._pipeline_depth_metric.untrack(self._get_pipeline_depth)
+        if self._inflight_cache is not None:
+            self._inflight_stop_event.set()
+            self._inflight_cache.close()
+            self.buffer.append({})
+        self.buffer.stop()
+        if self._dao_executor is not None:
+            self._dao_executor.shutdown()
+        self._campaign_id_cache.close()
+
     def thread_target(self):
         """Function to be used in the self.start method."""
-        super().default_thread_target()
-        self.buffer.stop()
+        self.start_buffer()
+        self.logger.debug("Going to wait for new messages!")
+        self._mq_dao.message_listener(self.message_handler)
+        # The final flush acknowledges the messages it persists, so we only unsubscribe after it.
+        self.stop_buffer()
+        self.stop_consumption()
         self.logger.info("Ok, we broke the doc inserter message listen loop!")
 
     def message_handler(self, msg_obj: Dict):
@@ -252,6 +543,52 @@ class DocumentInserter(BaseConsumer):
             False if a stop control message is received, True otherwise.
         """
         msg_type = msg_obj.get("type")
+        kind = message_kind(msg_obj)
+        is_task = kind == "task"
+        self._consumed_metrics.get("task" if is_task else msg_type, self._consumed_metrics["other"]).inc()
+        if len(self._pipeline_queues) and msg_type != "flowcept_control":
+            self._route_to_pipeline(msg_obj, kind)
+            return True
+        return self._handle_and_ack(msg_obj, msg_type, kind)
+
+    def _handle_and_ack(self, msg_obj: Dict, msg_type: str, kind: str) -> bool:
+        """Handle the message, acknowledging it once handled, unless the buffer acknowledges it on flush."""
+        if kind in ("task", "workflow") or MQDao.ACK_ID_FIELD not in msg_obj:
+            return self._handle_message(msg_obj, msg_type)
+        ack_id = msg_obj.pop(MQDao.ACK_ID_FIELD)
+        should_continue = self._handle_message(msg_obj, msg_type)
+        # Not acknowledged if handling raised, so the MQ delivers the message again.
+        self._mq_dao.ack([ack_id])
+        return should_continue
+
+    def _route_to_pipeline(self, msg_obj: Dict, kind: str):
+        """Hand the message to an enrichment thread. Updates to a task go to the same thread, so they stay ordered.
+
+        The message keeps its ack id, so it is acknowledged by the enrichment thread, or by the flush that
+        persists it, and never if its enrichment fails.
+        """
+        key = (msg_obj.get("task_id") or msg_obj.get("group_id")) if kind == "task" else None
+        i = 0 if key is None else crc32(str(key).encode()) % len(self._pipeline_queues)
+        self._pipeline_queues[i].put((msg_obj, kind))
+        self._received_metric.inc()
+
+    def _enrichment_stage(self, queue: Queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            msg_obj, kind = item
+            try:
+                self._handle_and_ack(msg_obj, msg_obj.get("type"), kind)
+            except Exception as e:
+                self.logger.error(f"Could not handle a message, which will not be acknowledged: {e}")
+                self.logger.exception(e)
+            self._enriched_metric.inc()
+
+    def _get_pipeline_depth(self):
+        return sum(queue.qsize() for queue in self._pipeline_queues)
+
+    def _handle_message(self, msg_obj: Dict, msg_type: str) -> bool:
         if msg_type == "flowcept_control":
             r = self._handle_control_message(msg_obj)
             if r == "stop":
@@ -278,6 +615,50 @@ class DocumentInserter(BaseConsumer):
             self.logger.error("Unexpected message type")
             return True
 
+    def _wait_for_interceptors(self, bundle_exec_id=None):
+        """
+        Wait until all interceptors of the bundle have stopped, i.e., it is safe to stop.
+
+        The interceptors still running are read from the KV DB, where they register when they start.
+        Then, the wait ends as soon as this inserter receives the last of their stop messages. The
+        KV DB is only read again every `DB_INSERTER_STOP_KV_CHECK_INTERVAL` seconds, in case a stop
+        message was handled by another inserter. It gives up after `DB_INSERTER_MAX_TRIALS_STOP *
+        DB_INSERTER_SLEEP_TRIALS_STOP` seconds, e.g., if an interceptor crashed.
+
+        Once the wait ends, the stop messages received for the bundle are forgotten, since interceptor
+        ids (e.g., object ids) may be reused by later bundles.
+        """
+        try:
+            self._wait_for_stop_messages(bundle_exec_id)
+        finally:
+            with self._stopped_interceptors_cond:
+                self._stopped_interceptors.pop(bundle_exec_id, None)
+
+    def _wait_for_stop_messages(self, bundle_exec_id):
+        deadline = monotonic() + DB_INSERTER_MAX_TRIALS_STOP * DB_INSERTER_SLEEP_TRIALS_STOP
+        running = self._mq_dao.get_time_based_threads(bundle_exec_id)
+        next_kv_check = monotonic() + DB_INSERTER_STOP_KV_CHECK_INTERVAL
+        while True:
+            with self._stopped_interceptors_cond:
+                running -= self._stopped_interceptors.get(bundle_exec_id, set())
+                if not len(running):
+                    return
+                now = monotonic()
+                if now >= deadline:
+                    self.logger.critical(
+                        f"DocInserter {id(self)} gave up waiting for interceptors {running} to stop. Safe to stop now."
+                    )
+                    return
+                if now < next_kv_check:
+                    self.logger.info(
+                        f"Doc Inserter {id(self)}: It's still not safe to stop DocInserter. "
+                        f"Waiting for {len(running)} interceptors of bundle_exec_id {bundle_exec_id}."
+                    )
+                    self._stopped_interceptors_cond.wait(min(deadline, next_kv_check) - now)
+                    continue
+            running = self._mq_dao.get_time_based_threads(bundle_exec_id)
+            next_kv_check = monotonic() + DB_INSERTER_STOP_KV_CHECK_INTERVAL
+
     def stop(self, bundle_exec_id=None):
         """
         Stop the DocumentInserter safely, waiting for all time-based threads to end.
@@ -296,23 +677,7 @@ class DocumentInserter(BaseConsumer):
             self.logger.info("Doc Inserter has not been started, so it can't stop.")
             return self
         if self.check_safe_stops:
-            trial = 0
-            while not self._mq_dao.all_time_based_threads_ended(bundle_exec_id):
-                self.logger.debug(
-                    f"# time_based_threads for bundle_exec_id {bundle_exec_id} is"
-                    f"{self._mq_dao._keyvalue_dao.set_count(bundle_exec_id)}"
-                )
-                trial += 1
-                self.logger.info(
-                    f"Doc Inserter {id(self)}: It's still not safe to stop DocInserter. "
-                    f"Checking again in {DB_INSERTER_SLEEP_TRIALS_STOP} secs. Trial={trial}."
-                )
-                sleep(DB_INSERTER_SLEEP_TRIALS_STOP)
-                if trial >= DB_INSERTER_MAX_TRIALS_STOP:
-                    # if len(self._mq_dao._buffer) == 0:
-                    msg = f"DocInserter {id(self)} gave up waiting for signal. "
-                    self.logger.critical(msg + "Safe to stop now.")
-                    break
+            self._wait_for_interceptors(bundle_exec_id)
             self._mq_dao.delete_current_campaign_id()
 
         self.logger.info("Sending message to stop document inserter.")
@@ -0,0 +1,257 @@
+"""Partitioned Document Inserter module."""
+
+from collections import deque
+from multiprocessing import get_context
+from threading import Thread, Lock
+from typing import Callable, Dict, List, Tuple
+from zlib import crc32
+
+from flowcept.commons.autoflush_buffer import AutoflushBuffer
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.flowcept_logger import FlowceptLogger
+from flowcept.configs import LMDB_ENABLED, MONGO_ENABLED
+from flowcept.flowceptor.consumers.base_consumer import BaseConsumer
+from flowcept.flowceptor.consumers.consumer_utils import message_kind
+from flowcept.flowceptor.consumers.document_inserter import DocumentInserter
+
+
+# Kinds of messages that go through the workers' buffers, so they are committed on flush.
+_BUFFERED_KINDS = ("task", "workflow")
+
+
+def _run_worker(worker_index: int, queue, report_queue, bundle_exec_id):
+    """Run a worker process: handle the batches routed to it until it gets None.
+
+    Reports, in the order of the messages they cover, ``(worker_index, "buffered", committed, n_msgs)``
+    for each flush, ``(worker_index, "other", committed, 1)`` for each message of another kind, and
+    ``(worker_index, "dropped", False, seq)`` for each task or workflow message that raised before being
+    buffered, `seq` being its number among the task and workflow messages routed to this worker.
+    """
+    logger = FlowceptLogger()
+
+    def on_commit(committed, n_msgs):
+        report_queue.put((worker_index, "buffered", committed, n_msgs))
+
+    # Workers report commits as they handle messages, so they must not hand them to a pipeline.
+    inserter = DocumentInserter(
+        check_safe_stops=False, bundle_exec_id=bundle_exec_id, on_commit=on_commit, pipeline_workers=0
+    )
+    inserter.start_buffer()
+    logger.info(f"Document inserter worker {worker_index} started.")
+    n_buffered = 0
+    while True:
+        batch = queue.get()
+        if batch is None:
+            break
+        for msg_obj in batch:
+            is_buffered = message_kind(msg_obj) in _BUFFERED_KINDS
+            n_buffered += is_buffered
+            try:
+                inserter.message_handler(msg_obj)
+            except Exception as e:
+                logger.exception(e)
+                if is_buffered:
+                    report_queue.put((worker_index, "dropped", False, n_buffered))
+                else:
+                    report_queue.put((worker_index, "other", False, 1))
+                continue
+            if not is_buffered:
+                report_queue.put((worker_index, "other", True, 1))
+    inserter.stop_buffer()
+    for dao in inserter._doc_daos:
+        dao.close()
+    logger.info(f"Document inserter worker {worker_index} stopped.")
+
+
+class PartitionedDocumentInserter(DocumentInserter):
+    """
+    Document inserter that spreads message handling over worker processes.
+
+    This process only receives messages from the MQ and routes them, in small batches, to
+    `n_workers` worker processes, each running its own `DocumentInserter` with its own DocDB
+    connections. Task messages are partitioned by a stable hash of their `task_id` (or `group_id`,
+    for loop iterations), and workflow messages by their `workflow_id`, so all updates to one task
+    or workflow go to the same worker's buffer. Other messages go to the first worker. Control
+    messages, and thus safe stops, are handled here.
+
+    When the MQ expects acknowledgments, a message is acknowledged once its worker committed it, and
+    never if its worker failed to handle or write it.
+    """
+
+    ROUTING_BATCH_SIZE = 100
+    ROUTING_FLUSH_INTERVAL = 0.1
+    # Max number of batches waiting in each worker's queue.
+    MAX_QUEUED_BATCHES = 100
+
+    def __init__(
+        self,
+        n_workers: int,
+        check_safe_stops=True,
+        bundle_exec_id=None,
+        mq_host=None,
+        mq_port=None,
+        mq_dao: MQDao = None,
+    ):
+        self.logger = FlowceptLogger()
+        # The DocDBs are written by the workers, not by this process.
+        self._doc_daos = []
+        self._should_start = MONGO_ENABLED or LMDB_ENABLED
+        if not self._should_start:
+            return
+        BaseConsumer.__init__(self, mq_host=mq_host, mq_port=mq_port, mq_dao=mq_dao)
+        self._init_safe_stops(check_safe_stops, bundle_exec_id)
+        self._mq_dao.ack_after_commit = True
+        self._n_workers = n_workers
+
+        context = get_context("spawn")
+        self._queues = [context.Queue(maxsize=PartitionedDocumentInserter.MAX_QUEUED_BATCHES) for _ in range(n_workers)]
+        self._report_queue = context.Queue()
+        self._workers = [
+            context.Process(
+                target=_run_worker, args=(i, self._queues[i], self._report_queue, bundle_exec_id), daemon=True
+            )
+            for i in range(n_workers)
+        ]
+        self._routing_buffers = [
+            AutoflushBuffer(
+                flush_function=queue.put,
+                max_size=PartitionedDocumentInserter.ROUTING_BATCH_SIZE,
+                flush_interval=PartitionedDocumentInserter.ROUTING_FLUSH_INTERVAL,
+                name=f"db_router_{i}",
+            )
+            for i, queue in enumerate(self._queues)
+        ]
+        # Per worker, counts of buffered (task and workflow) and other messages routed, and of those
+        # resolved (committed or failed) so far, in routing order.
+        self._routed = [[0, 0] for _ in range(n_workers)]
+        self._resolved = [[0, 0] for _ in range(n_workers)]
+        # Per worker, the numbers of the buffered messages that were dropped before being buffered.
+        self._dropped = [set() for _ in range(n_workers)]
+        # Per worker, buffered and other (message number, ack id) waiting for the worker.
+        self._pending_acks = [[deque(), deque()] for _ in range(n_workers)]
+        self._acks_lock = Lock()
+        self._report_thread = Thread(target=self._handle_reports, daemon=True)
+
+    def _get_worker(self, msg_obj: Dict, kind: str) -> int:
+        if kind == "task":
+            key = msg_obj.get("task_id") or msg_obj.get("group_id")
+        elif kind == "workflow":
+            key = msg_obj.get("workflow_id")
+        else:
+            return 0
+        if key is None:
+            return 0
+        return crc32(str(key).encode()) % self._n_workers
+
+    def message_handler(self, msg_obj: Dict) -> bool:
+        """Route the message to its worker, or handle it if it is a control message."""
+        kind = message_kind(msg_obj)
+        ack_id = msg_obj.pop(MQDao.ACK_ID_FIELD, None)
+        if kind == "control":
+            should_continue = self._handle_message(msg_obj, "flowcept_control")
+            if ack_id is not None:
+                self._mq_dao.ack([ack_id])
+            return should_continue
+        worker = self._get_worker(msg_obj, kind)
+        counter = 0 if kind in _BUFFERED_KINDS else 1
+        # Registered before routing, so the worker cannot report the message first.
+        with self._acks_lock:
+            self._routed[worker][counter] += 1
+            if ack_id is not None:
+                self._pending_acks[worker][counter].append((self._routed[worker][counter], ack_id))
+        self._routing_buffers[worker].append(msg_obj)
+        return True
+
+    def _resolve(self, worker: int, counter: int, n_msgs: int, committed: bool) -> List:
+        """
+        Resolve the next `n_msgs` messages routed to a worker, skipping dropped ones, returning the ack ids to send.
+
+        Must be called holding the lock.
+        """
+        dropped = self._dropped[worker] if counter == 0 else ()
+        pending = self._pending_acks[worker][counter]
+        resolved = self._resolved[worker][counter]
+        ack_ids = []
+        while n_msgs or resolved + 1 in dropped:
+            resolved += 1
+            if resolved in dropped:
+                dropped.discard(resolved)
+                is_committed = False
+            else:
+                n_msgs -= 1
+                is_committed = committed
+            if len(pending) and pending[0][0] == resolved:
+                ack_id = pending.popleft()[1]
+                if is_committed:
+                    ack_ids.append(ack_id)
+        self._resolved[worker][counter] = resolved
+        return ack_ids
+
+    def _handle_reports(self):
+        while True:
+            report = self._report_queue.get()
+            if report is None:
+                break
+            worker, kind, committed, n = report
+            if not committed:
+                self.logger.error(
+                    f"Document inserter worker {worker} failed to commit {1 if kind == 'dropped' else n} messages. "
+                    f"They will not be acknowledged."
+                )
+            with self._acks_lock:
+                if kind == "dropped":
+                    # n is the number of the dropped message, which is resolved once the messages before it are.
+                    self._dropped[worker].add(n)
+                    ack_ids = self._resolve(worker, 0, 0, False)
+                else:
+                    ack_ids = self._resolve(worker, 0 if kind == "buffered" else 1, n, committed)
+            if len(ack_ids):
+                self._mq_dao.ack(ack_ids)
+
+    def start(self, target: Callable = None, args: Tuple = (), threaded: bool = True, daemon=True):
+        """
+        Start the worker processes and the routing of messages.
+
+        Parameters
+        ----------
+        target : Callable, optional
+            Ignored. Messages are always routed by `self.thread_target`.
+        args : tuple, optional
+            Ignored.
+        threaded : bool, optional
+            Whether to route messages in a separate thread. Defaults to True.
+        daemon : bool, optional
+            Whether the thread should be a daemon. Defaults to True.
+
+        Returns
+        -------
+        PartitionedDocumentInserter
+            The current instance.
+        """
+        if not self._should_start:
+            self.logger.info("Doc Inserter cannot start as all DocDBs are disabled.")
+            return self
+        for worker in self._workers:
+            worker.start()
+        self._report_thread.start()
+        self.logger.info(f"Started {self._n_workers} document inserter workers.")
+        return super().start(threaded=threaded, daemon=daemon)
+
+    def thread_target(self):
+        """Route messages until stopped, then stop the workers once they handled all routed messages."""
+        self.logger.debug("Going to wait for new messages!")
+        self._mq_dao.message_listener(self.message_handler)
+        for buffer in self._routing_buffers:
+            buffer.stop()
+        for queue in self._queues:
+            queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._report_queue.put(None)
+        self._report_thread.join()
+        # The workers' reports acknowledge the messages they persisted, so we only unsubscribe after them.
+        self.stop_consumption()
+        n_unacked = sum(len(pending) for worker_acks in self._pending_acks for pending in worker_acks)
+        if n_unacked:
+            self.logger.warning(f"{n_unacked} MQ messages were not acknowledged.")
+        self.logger.info("Ok, we broke the partitioned doc inserter message listen loop!")
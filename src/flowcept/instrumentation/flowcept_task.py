@@ -12,7 +12,16 @@ from flowcept.commons.vocabulary import Status
 from flowcept.commons.flowcept_logger import FlowceptLogger
 
 from flowcept.commons.utils import replace_non_serializable
-from flowcept.configs import REPLACE_NON_JSON_SERIALIZABLE, INSTRUMENTATION_ENABLED, HOSTNAME, TELEMETRY_ENABLED
+from flowcept.commons.daos.mq_dao.mq_serialization import pack_ext
+import flowcept.configs
+from flowcept.configs import (
+    REPLACE_NON_JSON_SERIALIZABLE,
+    INSTRUMENTATION_ENABLED,
+    HOSTNAME,
+    TELEMETRY_ENABLED,
+    MQ_ENABLED,
+    MQ_SERIALIZER,
+)
 from flowcept.flowcept_api.flowcept_controller import Flowcept
 from flowcept.flowceptor.adapters.instrumentation_interceptor import InstrumentationInterceptor
 
@@ -31,11 +40,24 @@ def default_args_handler(*args, **kwargs):
             args_handled[f"arg_{i}"] = args[i]
     if kwargs is not None and len(kwargs):
         args_handled.update(kwargs)
-    if REPLACE_NON_JSON_SERIALIZABLE:
+    if REPLACE_NON_JSON_SERIALIZABLE and not _serialized_by_mq():
         args_handled = replace_non_serializable(args_handled)
     return args_handled
 
 
+def _serialized_by_mq() -> bool:
+    """Check if tasks are sent to an MQ whose serializer already replaces non-serializable objects."""
+    return MQ_ENABLED and MQ_SERIALIZER == "msgpack_ext" and flowcept.configs.DB_FLUSH_MODE == "online"
+
+
+def _capture(obj):
+    """Serialize captured arguments or results now, if the MQ would, as the task is only sent later.
+
+    The user may change these objects meanwhile, and the task is sent with them as they are serialized here.
+    """
+    return pack_ext(obj) if _serialized_by_mq() else obj
+
+
 def telemetry_flowcept_task(func=None):
     """Get telemetry task."""
     if INSTRUMENTATION_ENABLED:
@@ -141,7 +163,7 @@ def flowcept_task(func=None, **decorator_kwargs):
             task_obj.activity_id = func.__name__
             task_obj.workflow_id = handled_args.pop("workflow_id", Flowcept.current_workflow_id)
             task_obj.campaign_id = handled_args.pop("campaign_id", Flowcept.campaign_id)
-            task_obj.used = handled_args
+            task_obj.used = _capture(handled_args)
             task_obj.tags = tags
             task_obj.started_at = time()
             task_obj.custom_metadata = custom_metadata
@@ -198,6 +220,8 @@ def flowcept_task(func=None, **decorator_kwargs):
                         task_obj.generated = args_handler(result)
             except Exception as e:
                 logger.exception(e)
+            if task_obj.generated is not None:
+                task_obj.generated = _capture(task_obj.generated)
 
             interceptor.intercept(task_obj.to_dict())
             return result
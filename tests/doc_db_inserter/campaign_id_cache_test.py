@@ -0,0 +1,46 @@
+import unittest
+from time import sleep
+
+from flowcept.flowceptor.consumers.consumer_utils import CampaignIdCache
+
+
+class _KeyValueDAO:
+    def __init__(self):
+        self.value = "c1"
+        self.gets = 0
+        self.handler = None
+
+    def get_key(self, key):
+        self.gets += 1
+        return self.value
+
+    def subscribe(self, channel, handler):
+        self.handler = handler
+
+
+class TestCampaignIdCache(unittest.TestCase):
+    def test_ttl(self):
+        kv = _KeyValueDAO()
+        cache = CampaignIdCache(kv, ttl=0.05)
+        assert [cache.get() for _ in range(100)] == ["c1"] * 100
+        assert kv.gets == 1
+        kv.value = "c2"
+        sleep(0.06)
+        assert cache.get() == "c2" and kv.gets == 2
+
+    def test_change_notification(self):
+        kv = _KeyValueDAO()
+        cache = CampaignIdCache(kv, ttl=60)
+        assert cache.get() == "c1"
+        kv.handler({"data": b"c2"})
+        assert cache.get() == "c2"
+        kv.handler({"data": b""})
+        assert cache.get() is None
+        assert kv.gets == 1
+
+    def test_no_keyvalue_db(self):
+        assert CampaignIdCache(None, ttl=1).get() is None
+
+
+if __name__ == "__main__":
+    unittest.main()
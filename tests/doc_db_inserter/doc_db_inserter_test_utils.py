@@ -0,0 +1,63 @@
+class FakeDocDAO:
+    """In-memory DocDB DAO, recording the curated documents that document inserters write to it.
+
+    A task write fails while the DocDB is `down`, for the first `failures` writes, and for any batch
+    with one of the `poison` keys. With a `barrier`, writes only return once all DAOs sharing it are
+    being written at the same time.
+    """
+
+    def __init__(self, poison=(), failures=0, down=False, barrier=None):
+        self.poison = set(poison)
+        self.failures = failures
+        self.down = down
+        self.barrier = barrier
+        self.tasks = {}
+        self.task_writes = []
+        self.workflows = {}
+        self.workflow_writes = []
+        self.writes = 0
+        self.closed = False
+
+    def upsert_curated_tasks(self, indexed_buffer, indexing_key="task_id"):
+        self.writes += 1
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+        if self.down:
+            raise ConnectionError("DocDB is down")
+        if self.failures:
+            self.failures -= 1
+            return False
+        if self.poison & set(indexed_buffer):
+            raise ValueError("Bad key")
+        self.task_writes.append(list(indexed_buffer.values()))
+        self.tasks.update(indexed_buffer)
+        return True
+
+    def upsert_curated_workflows(self, indexed_buffer):
+        self.workflow_writes.append(indexed_buffer)
+        self.workflows.update(indexed_buffer)
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+class FakeMQDao:
+    """MQ DAO recording acknowledgments, and keeping the running interceptors like the KV DB set does."""
+
+    def __init__(self, running=()):
+        self.ack_after_commit = False
+        self._keyvalue_dao = None
+        self.acked = []
+        self.running = set(running)
+        self.kv_reads = 0
+
+    def ack(self, ack_ids):
+        self.acked.extend(ack_ids)
+
+    def get_time_based_threads(self, exec_bundle_id=None):
+        self.kv_reads += 1
+        return set(self.running)
+
+    def register_time_based_thread_end(self, interceptor_instance_id, exec_bundle_id=None):
+        self.running.discard(interceptor_instance_id)
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from flowcept.commons.daos.docdb_dao.docdb_dead_letter import DocDBDeadLetter, find_unwritable, write_with_retries
+from flowcept.commons.flowcept_logger import FlowceptLogger
+from flowcept.flowceptor.consumers import document_inserter
+from flowcept.flowceptor.consumers.document_inserter import DocumentInserter
+from tests.doc_db_inserter.doc_db_inserter_test_utils import FakeDocDAO
+
+
+class TestDocDBDeadLetter(unittest.TestCase):
+    def test_retries(self):
+        dao = FakeDocDAO(failures=2)
+        assert write_with_retries(dao.upsert_curated_tasks, {"1": {}}, 2, 0, FlowceptLogger())
+        assert dao.writes == 3
+        dao = FakeDocDAO(failures=2)
+        assert not write_with_retries(dao.upsert_curated_tasks, {"1": {}}, 1, 0, FlowceptLogger())
+
+    def test_bisection_isolates_poison_documents(self):
+        dao = FakeDocDAO(poison=["3", "6"])
+        docs = {str(i): {"task_id": str(i)} for i in range(8)}
+        assert list(find_unwritable(dao.upsert_curated_tasks, docs, FlowceptLogger())) == ["3", "6"]
+        assert sorted(dao.tasks) == ["0", "1", "2", "4", "5", "7"]
+        # If no write succeeds within the first tries, the DocDB is assumed down, and nothing else is tried.
+        dao = FakeDocDAO(failures=100)
+        docs = {str(i): {"task_id": str(i)} for i in range(1000)}
+        assert find_unwritable(dao.upsert_curated_tasks, docs, FlowceptLogger()) is None
+        assert dao.writes == 20
+        # Nor once the time to bisect is over.
+        dao = FakeDocDAO(poison=["3"])
+        assert find_unwritable(dao.upsert_curated_tasks, docs, FlowceptLogger(), max_seconds=0) is None
+        assert dao.writes == 0
+
+    def test_flush_is_not_committed_while_the_docdb_is_down(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dead_letter = DocDBDeadLetter(os.path.join(tmp, "dead_letter.msgpack"))
+            commits = []
+            with patch.object(document_inserter, "DB_INSERT_RETRY_BACKOFF", 0):
+                DocumentInserter.flush_function(
+                    [{"task_id": str(i)} for i in range(4)],
+                    [FakeDocDAO(down=True)],
+                    FlowceptLogger(),
+                    on_commit=lambda *args: commits.append(args),
+                    dead_letter=dead_letter,
+                )
+            assert commits == [(False, 4)]
+            assert os.listdir(tmp) == []
+
+    def test_flush_dead_letters_and_replays(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dead_letter = DocDBDeadLetter(os.path.join(tmp, "dead_letter.msgpack"))
+            dao = FakeDocDAO(poison=["2"])
+            commits = []
+            with patch.object(document_inserter, "DB_INSERT_RETRY_BACKOFF", 0):
+                DocumentInserter.flush_function(
+                    [{"task_id": str(i)} for i in range(4)],
+                    [dao],
+                    FlowceptLogger(),
+                    on_commit=lambda *args: commits.append(args),
+                    dead_letter=dead_letter,
+                )
+            assert sorted(dao.tasks) == ["0", "1", "3"]
+            assert commits == [(True, 4)]
+
+            dao.poison.clear()
+            assert dead_letter.replay(lambda dao_name: dao if dao_name == "FakeDocDAO" else None) == (1, 0)
+            assert dao.tasks["2"] == {"task_id": "2"}
+            assert os.listdir(tmp) == []
+
+            dead_letter.append("MongoDBDAO", "tasks", {"5": {"task_id": "5"}})
+            assert dead_letter.replay(lambda dao_name: None) == (0, 1)
+            assert os.listdir(tmp) == ["dead_letter.msgpack"]
+
+    def test_replay_keeps_the_document_types(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dead_letter = DocDBDeadLetter(os.path.join(tmp, "dead_letter.msgpack"))
+            doc = {"task_id": "1", "started_at": datetime(2024, 1, 2, 3, 4, 5), "used": {"x": b"\x00"}}
+            dead_letter.append("FakeDocDAO", "tasks", {"1": doc})
+            dao = FakeDocDAO()
+            assert dead_letter.replay(lambda dao_name: dao) == (1, 0)
+            assert dao.tasks["1"] == doc
+
+
+if __name__ == "__main__":
+    unittest.main()
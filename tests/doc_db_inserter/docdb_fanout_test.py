@@ -0,0 +1,50 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from unittest.mock import patch
+
+from flowcept.commons.flowcept_logger import FlowceptLogger
+from flowcept.flowceptor.consumers import document_inserter
+from flowcept.flowceptor.consumers.document_inserter import DocumentInserter
+from tests.doc_db_inserter.doc_db_inserter_test_utils import FakeDocDAO
+
+
+class TestDocDBFanOut(unittest.TestCase):
+    def test_daos_are_written_concurrently(self):
+        barrier = Barrier(3)
+        daos = [FakeDocDAO(barrier=barrier) for _ in range(3)]
+        commits = []
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            DocumentInserter.flush_function(
+                [{"task_id": "1", "status": "RUNNING"}, {"task_id": "1", "status": "FINISHED"}],
+                daos,
+                FlowceptLogger(),
+                on_commit=lambda *args: commits.append(args),
+                dao_executor=executor,
+            )
+        for dao in daos:
+            assert dao.tasks["1"]["status"] == "FINISHED"
+        # The curated documents are shared by all DAOs.
+        assert daos[0].tasks["1"] is daos[1].tasks["1"]
+        assert commits == [(True, 2)]
+
+    def test_failing_dao_does_not_stop_the_others(self):
+        daos = [FakeDocDAO(down=True), FakeDocDAO()]
+        commits = []
+        with (
+            ThreadPoolExecutor(max_workers=2) as executor,
+            patch.object(document_inserter, "DB_INSERT_RETRY_BACKOFF", 0),
+        ):
+            DocumentInserter.flush_function(
+                [{"task_id": "1"}],
+                daos,
+                FlowceptLogger(),
+                on_commit=lambda *args: commits.append(args),
+                dao_executor=executor,
+            )
+        assert list(daos[1].tasks) == ["1"]
+        assert commits == [(False, 1)]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.flowcept_logger import FlowceptLogger
+from flowcept.flowceptor.consumers.document_inserter import DocumentInserter
+from tests.doc_db_inserter.doc_db_inserter_test_utils import FakeDocDAO, FakeMQDao
+
+
+class _CheckedAckMQDao(FakeMQDao):
+    """Records acks of task updates that were not persisted yet. Ack ids are (task_id, seq), or other strings."""
+
+    def __init__(self, dao):
+        super().__init__()
+        self.dao = dao
+        self.early_acks = []
+
+    def ack(self, ack_ids):
+        for ack_id in ack_ids:
+            if isinstance(ack_id, tuple):
+                task_id, seq = ack_id
+                if self.dao.tasks.get(task_id, {}).get("seq", -1) < seq:
+                    self.early_acks.append(ack_id)
+        super().ack(ack_ids)
+
+
+class TestDocumentInserterPipeline(unittest.TestCase):
+    def test_flush_acks_the_persisted_messages(self):
+        dao = FakeDocDAO()
+        mq_dao = FakeMQDao()
+        buffer = [{"task_id": "1", MQDao.ACK_ID_FIELD: "a"}, {"task_id": "2", MQDao.ACK_ID_FIELD: "b"}, {}]
+        commits = []
+        n_docs, write_seconds = DocumentInserter.flush_function(
+            buffer, [dao], FlowceptLogger(), mq_dao=mq_dao, on_commit=lambda *args: commits.append(args)
+        )
+        # The flush trigger is not a document.
+        assert n_docs == 2 and write_seconds >= 0
+        assert dao.task_writes == [[{"task_id": "1"}, {"task_id": "2"}]]
+        assert mq_dao.acked == ["a", "b"]
+        assert commits == [(True, 2)]
+
+    def test_pipeline(self):
+        dao = FakeDocDAO()
+        mq_dao = _CheckedAckMQDao(dao)
+        inserter = DocumentInserter(doc_daos=[dao], mq_dao=mq_dao, pipeline_workers=4)
+        inserter.start_buffer()
+        n_tasks, n_updates = 50, 5
+        for seq in range(n_updates):
+            for i in range(n_tasks):
+                msg = {"type": "task", "task_id": str(i), "seq": seq, MQDao.ACK_ID_FIELD: (str(i), seq)}
+                assert inserter.message_handler(msg)
+        # An iteration without the "used" it needs for its task_id fails to be enriched.
+        inserter.message_handler({"type": "task", "group_id": "g", MQDao.ACK_ID_FIELD: "failed"})
+        inserter.message_handler({"type": "other", MQDao.ACK_ID_FIELD: "other"})
+        inserter.stop_buffer()
+
+        # Stopping drained the queues, and updates to a task were handled in order, across threads.
+        assert all(queue.empty() for queue in inserter._pipeline_queues)
+        assert not any(thread.is_alive() for thread in inserter._pipeline_threads)
+        assert {task_id: task["seq"] for task_id, task in dao.tasks.items()} == {
+            str(i): n_updates - 1 for i in range(n_tasks)
+        }
+        # Task updates were only acknowledged once persisted, and the failed message never.
+        assert mq_dao.early_acks == []
+        assert sorted(ack_id for ack_id in mq_dao.acked if isinstance(ack_id, tuple)) == sorted(
+            (str(i), seq) for i in range(n_tasks) for seq in range(n_updates)
+        )
+        assert "other" in mq_dao.acked
+        assert "failed" not in mq_dao.acked
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+from time import sleep
+from unittest.mock import patch
+
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.flowcept_logger import FlowceptLogger
+from flowcept.flowceptor.consumers import document_inserter
+from flowcept.flowceptor.consumers.consumer_utils import InFlightTaskCache
+from flowcept.flowceptor.consumers.document_inserter import DocumentInserter
+from tests.doc_db_inserter.doc_db_inserter_test_utils import FakeDocDAO, FakeMQDao
+
+
+class TestInFlightTaskCache(unittest.TestCase):
+    def test_task_is_written_once_it_finishes(self):
+        cache = InFlightTaskCache(window=60, max_tasks=100)
+        running = {"task_id": "t1", "status": "RUNNING"}
+        assert cache.merge([running, {"task_id": "t2", "status": "FINISHED"}]) == [
+            {"task_id": "t2", "status": "FINISHED"}
+        ]
+        # The first flush is not released while t1 is held.
+        assert cache.release(["a"], 2) == []
+        finished = {"task_id": "t1", "status": "FINISHED"}
+        assert cache.merge([finished]) == [running, finished]
+        assert cache.release(["b"], 1) == [(True, ["a"], 2), (True, ["b"], 1)]
+        assert len(cache) == 0
+
+    def test_flushes_are_released_in_order(self):
+        cache = InFlightTaskCache(window=60, max_tasks=100)
+        cache.merge([{"task_id": "t1", "status": "RUNNING"}])
+        assert cache.release(["a"], 1) == []
+        cache.merge([{"task_id": "t2", "status": "RUNNING"}])
+        assert cache.release(["b"], 1) == []
+        cache.merge([{"task_id": "t2", "status": "ERROR"}])
+        # t1, held since the first flush, still blocks the later flushes.
+        assert cache.release(["c"], 1) == []
+        cache.merge([{"task_id": "t1", "finished": True}])
+        assert [ack_ids for _, ack_ids, _ in cache.release([], 1)] == [["a"], ["b"], ["c"], []]
+
+    def test_failed_flushes_are_not_acknowledged(self):
+        cache = InFlightTaskCache(window=60, max_tasks=100)
+        cache.merge([{"task_id": "t1", "status": "RUNNING"}])
+        assert cache.release(["a"], 1) == []
+        # The failed flush could have written messages held since the first flush, which fails too.
+        cache.merge([{"task_id": "t2", "status": "FINISHED"}])
+        assert cache.release(["b"], 1, committed=False) == []
+        cache.merge([{"task_id": "t1", "status": "FINISHED"}])
+        assert cache.release(["c"], 1) == [(False, ["a"], 1), (False, ["b"], 1), (True, ["c"], 1)]
+        cache.merge([{"task_id": "t3", "status": "FINISHED"}])
+        assert cache.release(["d"], 1) == [(True, ["d"], 1)]
+
+    def test_expiration_and_eviction(self):
+        cache = InFlightTaskCache(window=0.1, max_tasks=2)
+        to_write = cache.merge([{"task_id": str(i), "status": "RUNNING"} for i in range(3)])
+        # The least recently updated task is evicted.
+        assert to_write == [{"task_id": "0", "status": "RUNNING"}]
+        assert not cache.has_expired()
+        sleep(0.15)
+        assert cache.has_expired()
+        assert len(cache.merge([])) == 2
+        assert len(cache) == 0
+
+    def test_close_writes_everything(self):
+        cache = InFlightTaskCache(window=60, max_tasks=100)
+        cache.merge([{"task_id": "t1", "status": "RUNNING"}, {"used": {"x": 1}}])
+        cache.close()
+        assert cache.merge([{"task_id": "t2", "status": "RUNNING"}]) == [
+            {"task_id": "t2", "status": "RUNNING"},
+            {"task_id": "t1", "status": "RUNNING"},
+        ]
+
+    def test_flush_after_a_failed_flush(self):
+        cache = InFlightTaskCache(window=60, max_tasks=100)
+        dao, mq_dao, commits = FakeDocDAO(), FakeMQDao(), []
+
+        def flush(msgs):
+            buffer = [{**msg, MQDao.ACK_ID_FIELD: msg["task_id"]} for msg in msgs]
+            with patch.object(document_inserter, "DB_INSERT_RETRIES", 0):
+                DocumentInserter.flush_function(
+                    buffer,
+                    [dao],
+                    FlowceptLogger(),
+                    mq_dao=mq_dao,
+                    on_commit=lambda *args: commits.append(args),
+                    inflight_cache=cache,
+                    dead_letter=None,
+                )
+
+        dao.down = True
+        flush([{"task_id": "t1", "status": "FINISHED"}])
+        dao.down = False
+        flush([{"task_id": "t2", "status": "FINISHED"}])
+        assert mq_dao.acked == ["t2"] and list(dao.tasks) == ["t2"]
+        assert commits == [(False, 1), (True, 1)]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flowcept.commons.compression import CODEC_IDS
+from flowcept.commons.daos.docdb_dao import lmdb_dao
+from flowcept.commons.daos.docdb_dao.lmdb_dao import LMDBDAO, _decode, _encode
+
+
+TASK = {
+    "task_id": "1",
+    "workflow_id": "wf1",
+    "status": "FINISHED",
+    "used": {"x": 1, "y": [1.5, 2.5]},
+    "generated": {"loss": 0.1, "accuracy": 0.9},
+    "telemetry_at_end": {"cpu": {"percent_all": 10.0}, "per_cpu": [1.0] * 500},
+}
+
+
+class TestLMDBEncoding(unittest.TestCase):
+    def test_encoding(self):
+        assert _decode(_encode(TASK)) == TASK
+        assert _decode(json.dumps(TASK).encode()) == TASK
+        keep = {"task_id", "generated"}.__contains__
+        assert _decode(_encode(TASK), keep) == {"task_id": "1", "generated": TASK["generated"]}
+        assert _decode(json.dumps(TASK).encode(), keep) == {"task_id": "1", "generated": TASK["generated"]}
+        with patch.object(lmdb_dao, "_CODEC_ID", CODEC_IDS["zlib"]):
+            value = _encode(TASK)
+        assert len(value) < len(_encode(TASK))
+        assert _decode(value) == TASK
+        assert _decode(value, keep) == {"task_id": "1", "generated": TASK["generated"]}
+
+    def test_query_projection(self):
+        with tempfile.TemporaryDirectory() as tmp, patch.dict(lmdb_dao.LMDB_SETTINGS, {"path": tmp}):
+            dao = LMDBDAO()
+            assert dao.upsert_curated_tasks({"1": TASK})
+            assert dao.query({"status": "FINISHED"}, projection=["task_id", "generated.loss"]) == [
+                {"task_id": "1", "generated": {"loss": 0.1}}
+            ]
+            assert dao.query({"workflow_id": "wf1"}, projection={"telemetry_at_end": 0, "used": 0}) == [
+                {k: v for k, v in TASK.items() if k not in ("telemetry_at_end", "used")}
+            ]
+            assert dao.query({"used": {"x": 1, "y": [1.5, 2.5]}}, projection=["task_id"]) == [{"task_id": "1"}]
+            assert dao.query(
+                {"task_id": "1"}, projection={"telemetry_at_end.per_cpu": 0, "used.y": 0, "status": 0}
+            ) == [
+                {
+                    "task_id": "1",
+                    "workflow_id": "wf1",
+                    "used": {"x": 1},
+                    "generated": TASK["generated"],
+                    "telemetry_at_end": {"cpu": {"percent_all": 10.0}},
+                }
+            ]
+            dao.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
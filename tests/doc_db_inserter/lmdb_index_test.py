@@ -0,0 +1,62 @@
+import json
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import lmdb
+
+from flowcept.commons.daos.docdb_dao import lmdb_dao
+from flowcept.commons.daos.docdb_dao.lmdb_dao import LMDBDAO
+
+
+class TestLMDBIndexes(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._settings = patch.dict(lmdb_dao.LMDB_SETTINGS, {"path": self._tmp.name})
+        self._settings.start()
+
+    def tearDown(self):
+        self._settings.stop()
+        self._tmp.cleanup()
+
+    def test_queries_use_indexes(self):
+        dao = LMDBDAO()
+        tasks = {
+            str(i): {"task_id": str(i), "workflow_id": f"wf{i % 3}", "status": "RUNNING", "used": {"i": i}}
+            for i in range(30)
+        }
+        assert dao.upsert_curated_tasks(tasks, "task_id")
+        assert dao.upsert_curated_tasks({"4": {"task_id": "4", "workflow_id": "wf1", "status": "FINISHED"}})
+        with dao._env.begin() as txn:
+            candidates = list(dao._candidate_values(txn, dao._tasks_db, "tasks", {"workflow_id": "wf1"}))
+            assert len(candidates) == 10
+            candidates = list(
+                dao._candidate_values(txn, dao._tasks_db, "tasks", {"workflow_id": "wf1", "status": "FINISHED"})
+            )
+            assert len(candidates) == 1
+
+        assert [t["task_id"] for t in dao.query({"workflow_id": "wf1", "status": "FINISHED"})] == ["4"]
+        assert len(dao.query({"status": "RUNNING"})) == 29
+        assert dao.query({"workflow_id": "wf2", "status": "FINISHED"}) == []
+        assert dao.query({"task_id": "7"}) == [tasks["7"]]
+        assert dao.query({"workflow_id": "missing"}) == []
+        assert len(dao.query({"used": {"i": 5}})) == 1
+        dao.close()
+
+    def test_existing_tasks_are_indexed_on_open(self):
+        env = lmdb.open(self._tmp.name, max_dbs=2)
+        tasks_db = env.open_db(b"tasks")
+        with env.begin(write=True, db=tasks_db) as txn:
+            for i in range(5):
+                txn.put(str(i).encode(), json.dumps({"task_id": str(i), "activity_id": f"a{i % 2}"}).encode())
+        env.close()
+        dao = LMDBDAO()
+        with dao._env.begin() as txn:
+            candidates = list(dao._candidate_values(txn, dao._tasks_db, "tasks", {"activity_id": "a0"}))
+        assert len(candidates) == 3
+        assert [t["task_id"] for t in dao.query({"activity_id": "a1"})] == ["1", "3"]
+        dao.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
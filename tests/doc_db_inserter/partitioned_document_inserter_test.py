@@ -0,0 +1,92 @@
+import unittest
+from collections import deque
+
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.configs import LMDB_ENABLED, MONGO_ENABLED
+from flowcept.flowceptor.consumers.partitioned_document_inserter import PartitionedDocumentInserter, message_kind
+from tests.doc_db_inserter.doc_db_inserter_test_utils import FakeMQDao
+
+
+@unittest.skipIf(not (MONGO_ENABLED or LMDB_ENABLED), "All DocDBs are disabled")
+class TestPartitionedDocumentInserter(unittest.TestCase):
+    def setUp(self):
+        self._routers = []
+
+    def tearDown(self):
+        for router in self._routers:
+            for buffer in router._routing_buffers:
+                buffer.stop()
+
+    def _router(self, n_workers):
+        # The worker processes are not started, so only the routing and acknowledgment bookkeeping runs.
+        router = PartitionedDocumentInserter(n_workers, mq_dao=FakeMQDao())
+        self._routers.append(router)
+        return router
+
+    def test_message_kind(self):
+        assert message_kind({"type": "task"}) == "task"
+        assert message_kind({"task_id": "1"}) == "task"
+        assert message_kind({"type": "flowcept_control", "info": "stop_document_inserter"}) == "control"
+        assert message_kind({"type": "workflow"}) == "workflow"
+        assert message_kind({"name": "wf", "workflow_id": "1"}) == "workflow"
+        assert message_kind({"type": "other"}) == "other"
+
+    def test_partitioning_is_deterministic(self):
+        router = self._router(4)
+        workers = {router._get_worker({"task_id": str(i)}, "task") for i in range(100)}
+        assert workers == {0, 1, 2, 3}
+        for i in range(100):
+            msg = {"task_id": str(i), "status": "RUNNING"}
+            assert router._get_worker(msg, "task") == router._get_worker({"task_id": str(i)}, "task")
+        assert router._get_worker({"type": "other"}, "other") == 0
+        workers = {router._get_worker({"workflow_id": str(i)}, "workflow") for i in range(100)}
+        assert workers == {0, 1, 2, 3}
+
+    def _route(self, router, msgs):
+        for msg, ack_id in msgs:
+            router.message_handler({**msg, MQDao.ACK_ID_FIELD: ack_id})
+
+    def _report(self, router, reports):
+        for report in reports:
+            router._report_queue.put(report)
+        router._report_queue.put(None)
+        router._handle_reports()
+
+    def _task_ids(self, router, worker, n):
+        task_ids = (str(i) for i in range(1000))
+        return [t for t in task_ids if router._get_worker({"task_id": t}, "task") == worker][:n]
+
+    def test_acks_follow_each_worker(self):
+        router = self._router(2)
+        (t0, t1), (t2,) = self._task_ids(router, 0, 2), self._task_ids(router, 1, 1)
+        self._route(
+            router,
+            [({"type": "task", "task_id": t0}, "a"), ({"type": "task", "task_id": t2}, "b")]
+            + [({"type": "other"}, "c"), ({"type": "task", "task_id": t1}, "d")],
+        )
+        # A worker does not wait for the others, and a failed flush does not poison the next ones.
+        self._report(router, [(1, "buffered", True, 1), (0, "other", True, 1), (0, "buffered", True, 1)])
+        assert router._mq_dao.acked == ["b", "c", "a"]
+        self._report(router, [(0, "buffered", False, 1)])
+        assert router._mq_dao.acked == ["b", "c", "a"]
+        self._route(router, [({"type": "task", "task_id": t0}, "e")])
+        self._report(router, [(0, "buffered", True, 1)])
+        assert router._mq_dao.acked == ["b", "c", "a", "e"]
+
+    def test_dropped_messages_are_not_acked(self):
+        router = self._router(2)
+        task_ids = self._task_ids(router, 0, 4)
+        self._route(router, [({"type": "task", "task_id": t}, t) for t in task_ids[:3]])
+        # The second message raised in its worker, which buffered and flushed the other two.
+        self._report(router, [(0, "dropped", False, 2), (0, "buffered", True, 1)])
+        assert router._mq_dao.acked == [task_ids[0]]
+        self._report(router, [(0, "buffered", True, 1)])
+        assert router._mq_dao.acked == [task_ids[0], task_ids[2]]
+        # A dropped last message is resolved without waiting for other messages.
+        self._route(router, [({"type": "task", "task_id": task_ids[3]}, task_ids[3])])
+        self._report(router, [(0, "dropped", False, 4)])
+        assert router._pending_acks[0] == [deque(), deque()]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from threading import Thread, Timer
+from time import monotonic
+
+from flowcept.flowceptor.consumers.document_inserter import DocumentInserter
+from tests.doc_db_inserter.doc_db_inserter_test_utils import FakeDocDAO, FakeMQDao
+
+
+def _stop_message(interceptor_instance_id, exec_bundle_id="bundle"):
+    return {
+        "type": "flowcept_control",
+        "info": "mq_dao_thread_stopped",
+        "interceptor_instance_id": interceptor_instance_id,
+        "exec_bundle_id": exec_bundle_id,
+    }
+
+
+class TestSafeStop(unittest.TestCase):
+    def setUp(self):
+        self._inserters = []
+
+    def tearDown(self):
+        for inserter in self._inserters:
+            inserter.stop_buffer()
+
+    def _inserter(self, mq_dao):
+        inserter = DocumentInserter(doc_daos=[FakeDocDAO()], mq_dao=mq_dao, pipeline_workers=0)
+        self._inserters.append(inserter)
+        return inserter
+
+    def test_wait_ends_on_last_stop_message(self):
+        mq_dao = FakeMQDao({"a", "b"})
+        inserter = self._inserter(mq_dao)
+        inserter._handle_control_message(_stop_message("a"))
+
+        def send_stop():
+            inserter._handle_control_message(_stop_message("b", exec_bundle_id="other_bundle"))
+            inserter._handle_control_message(_stop_message("b"))
+
+        Timer(0.2, send_stop).start()
+        t0 = monotonic()
+        inserter._wait_for_interceptors("bundle")
+        assert monotonic() - t0 < 0.9
+        assert mq_dao.kv_reads == 1
+        # The stop messages of the bundle are forgotten once the wait ends.
+        assert list(inserter._stopped_interceptors) == ["other_bundle"]
+
+    def test_wait_falls_back_to_the_kv_set(self):
+        # The stop message was handled by another inserter, which updated the KV DB set.
+        mq_dao = FakeMQDao({"a"})
+        inserter = self._inserter(mq_dao)
+        Timer(0.1, lambda: mq_dao.running.clear()).start()
+        thread = Thread(target=inserter._wait_for_interceptors, args=("bundle",))
+        thread.start()
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+        assert mq_dao.kv_reads >= 2
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from flowcept.commons.flowcept_logger import FlowceptLogger
+from flowcept.flowceptor.consumers.consumer_utils import curate_dict_workflow_messages
+from flowcept.flowceptor.consumers.document_inserter import DocumentInserter
+from tests.doc_db_inserter.doc_db_inserter_test_utils import FakeDocDAO
+
+
+class TestWorkflowBuffering(unittest.TestCase):
+    def test_workflows_are_merged_by_workflow_id(self):
+        first = {"workflow_id": "wf1", "name": "a", "custom_metadata": {"x": 1}, "interceptor_ids": ["i1"]}
+        merged = curate_dict_workflow_messages(
+            [
+                first,
+                {"workflow_id": "wf2", "name": "b"},
+                {"workflow_id": "wf1", "custom_metadata": {"y": 2}, "interceptor_ids": ["i2"], "used": {}},
+                {"name": "no id"},
+                {"workflow_id": "wf1", "name": "c"},
+            ]
+        )
+        assert list(merged) == ["wf1", "wf2"]
+        assert merged["wf1"] == {
+            "workflow_id": "wf1",
+            "name": "c",
+            "custom_metadata": {"x": 1, "y": 2},
+            "interceptor_ids": ["i1", "i2"],
+        }
+        # The received messages are not changed.
+        assert first["custom_metadata"] == {"x": 1} and first["interceptor_ids"] == ["i1"]
+
+    def test_flush_writes_tasks_and_workflows_in_bulk(self):
+        dao = FakeDocDAO()
+        buffer = [
+            {"task_id": "t1"},
+            {"workflow_id": "wf1", "name": "a", "type": "workflow"},
+            {"task_id": "t2"},
+            {"workflow_id": "wf1", "custom_metadata": {"x": 1}, "type": "workflow"},
+        ]
+        commits = []
+        DocumentInserter.flush_function(buffer, [dao], FlowceptLogger(), on_commit=lambda *args: commits.append(args))
+        assert dao.task_writes == [[{"task_id": "t1"}, {"task_id": "t2"}]]
+        assert len(dao.workflow_writes) == 1
+        assert dao.workflow_writes[0]["wf1"]["name"] == "a"
+        assert dao.workflow_writes[0]["wf1"]["custom_metadata"] == {"x": 1}
+        assert commits == [(True, 4)]
+
+    def test_flush_of_workflows_only(self):
+        dao = FakeDocDAO()
+        DocumentInserter.flush_function([{"workflow_id": "wf1", "type": "workflow"}], [dao], FlowceptLogger())
+        assert dao.task_writes == []
+        assert len(dao.workflow_writes) == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+from threading import Event
+from time import sleep
+
+from flowcept.commons.adaptive_flush import AdaptiveFlushController
+from flowcept.commons.autoflush_buffer import AutoflushBuffer
+
+
+def _controller(**kwargs):
+    return AdaptiveFlushController(min_size=10, max_size=1000, min_interval=0.1, max_interval=10, **kwargs)
+
+
+class TestAdaptiveFlush(unittest.TestCase):
+    def setUp(self):
+        self._flushes_done = Event()
+        self._buffers = []
+
+    def tearDown(self):
+        self._flushes_done.set()
+        for buffer in self._buffers:
+            buffer.stop()
+
+    def _buffer(self, max_size, flush_interval, pending):
+        """Get a buffer with `pending` items, whose flushes only finish when the test does."""
+        buffer = AutoflushBuffer(flush_function=lambda items: self._flushes_done.wait(), max_size=max_size)
+        buffer.flush_interval = flush_interval
+        buffer.extend(list(range(pending)))
+        self._buffers.append(buffer)
+        return buffer
+
+    def test_latency_target(self):
+        controller = _controller(target_latency=0.1)
+        buffer = self._buffer(max_size=100, flush_interval=1, pending=500)
+        controller(buffer, 100, 0.05)
+        assert buffer.max_size == 150 and buffer.flush_interval < 1  # Backlog within the target.
+        controller(buffer, 150, 0.3)
+        assert buffer.max_size == 100  # Too slow.
+        buffer = self._buffer(max_size=buffer.max_size, flush_interval=buffer.flush_interval, pending=0)
+        interval = buffer.flush_interval
+        controller(buffer, 5, 0.01)
+        assert buffer.max_size == 100 and buffer.flush_interval > interval  # Small time-based flushes.
+
+    def test_throughput_search(self):
+        controller = _controller()
+        buffer = self._buffer(max_size=100, flush_interval=1, pending=0)
+        controller(buffer, 100, 0.1)
+        assert buffer.max_size == 150
+        controller(buffer, 150, 0.1)  # Faster per item: keep growing.
+        assert buffer.max_size == 225
+        controller(buffer, 225, 1)  # Slower per item: shrink.
+        assert buffer.max_size == 150
+
+    def test_bounds(self):
+        controller = _controller(target_latency=0.1)
+        buffer = self._buffer(max_size=900, flush_interval=0.1, pending=10_000)
+        for _ in range(10):
+            controller(buffer, buffer.max_size, 0.01)
+        assert buffer.max_size == 1000 and buffer.flush_interval == 0.1
+        for _ in range(20):
+            controller(buffer, buffer.max_size, 10)
+        assert buffer.max_size == 10
+
+    def test_buffer_callback(self):
+        flushed = []
+        controller = _controller(target_latency=0.001)
+        buffer = AutoflushBuffer(
+            flush_function=lambda items: flushed.extend(items) or sleep(0.01),
+            max_size=100,
+            flush_interval=0.05,
+            on_flush=controller,
+        )
+        for i in range(1000):
+            buffer.append(i)
+        buffer.stop()
+        assert len(flushed) == 1000
+        assert buffer.max_size < 100
+
+    def test_flush_function_reports_what_it_wrote(self):
+        observed = []
+        buffer = AutoflushBuffer(
+            flush_function=lambda items: (len([i for i in items if i is not None]), 0.5),
+            max_size=4,
+            flush_interval=60,
+            on_flush=lambda _, n_items, seconds: observed.append((n_items, seconds)),
+        )
+        buffer.extend([1, None, 2, None])
+        buffer.stop()
+        assert observed == [(2, 0.5)]
+
+    def test_flushed_items_are_no_longer_pending(self):
+        observed = []
+        buffer = AutoflushBuffer(
+            flush_function=lambda items: None,
+            max_size=4,
+            flush_interval=60,
+            on_flush=lambda flushed_buffer, n_items, seconds: observed.append((n_items, flushed_buffer.pending)),
+        )
+        buffer.extend([1, 2, 3, 4])
+        buffer.stop()
+        assert observed == [(4, 0)]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+from threading import Thread
+from time import perf_counter, sleep
+
+from flowcept.commons.autoflush_buffer import AutoflushBuffer
+
+
+class TestAutoflushBuffer(unittest.TestCase):
+    def _buffer(self, flushed, **kwargs):
+        return AutoflushBuffer(flush_function=lambda buffer: flushed.extend(buffer), **kwargs)
+
+    def test_concurrent_appends_are_not_lost(self):
+        flushed = []
+        buffer = self._buffer(flushed, max_size=7, flush_interval=0.001)
+        n_threads, n_items = 4, 20_000
+
+        def produce(t):
+            for i in range(n_items):
+                buffer.append((t, i))
+
+        threads = [Thread(target=produce, args=(t,)) for t in range(n_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        buffer.stop()
+        assert len(flushed) == n_threads * n_items
+        assert len(set(flushed)) == n_threads * n_items
+
+    def test_drop_policies(self):
+        for policy, expected in [("drop_newest", [0, 1, 2]), ("drop_oldest", [7, 8, 9])]:
+            flushed = []
+            buffer = self._buffer(flushed, flush_interval=60, max_pending=3, backpressure_policy=policy)
+            for i in range(10):
+                buffer.append(i)
+            assert buffer.dropped_count == 7
+            buffer.stop()
+            assert flushed == expected
+
+    def test_block_policy(self):
+        flushed = []
+
+        def slow_flush(buffer):
+            sleep(0.01)
+            flushed.extend(buffer)
+
+        buffer = AutoflushBuffer(flush_function=slow_flush, flush_interval=60, max_pending=5, block_timeout=10)
+        for i in range(50):
+            buffer.append(i)
+            assert buffer.pending <= 5
+        buffer.stop()
+        assert flushed == list(range(50))
+        assert buffer.blocked_count > 0 and buffer.dropped_count == 0
+
+    def test_spill_to_disk(self):
+        flushed = []
+        spill_dir = tempfile.mkdtemp()
+        buffer = self._buffer(
+            flushed,
+            flush_interval=60,
+            max_pending=10,
+            backpressure_policy="spill_to_disk",
+            spill_path=os.path.join(spill_dir, "spill.jsonl"),
+        )
+        buffer.SPILL_SEGMENT_ITEMS = 7
+        for i in range(100):
+            buffer.append({"i": i})
+        assert buffer.spilled_count == 90
+        assert len(os.listdir(spill_dir)) == 13
+        buffer.stop()
+        assert [m["i"] for m in flushed] == list(range(100))
+        assert os.listdir(spill_dir) == []
+
+    def test_many_pending_items(self):
+        n, chunk = 200_000, 10_000
+        for kwargs in [{}, {"max_pending": n // 2, "backpressure_policy": "drop_oldest"}]:
+            flushed = []
+            buffer = self._buffer(flushed, flush_interval=60, **kwargs)
+            seconds = []
+            for start in range(0, n, chunk):
+                t0 = perf_counter()
+                for i in range(start, start + chunk):
+                    buffer.append(i)
+                seconds.append(perf_counter() - t0)
+            # Appending with the most items pending, and dropping the oldest ones if bounded, costs about as much
+            # as appending the first ones.
+            assert min(seconds[-3:]) < 5 * min(seconds[:3]), seconds
+            pending = kwargs.get("max_pending", n)
+            assert buffer.pending == pending and buffer.dropped_count == n - pending
+            buffer.stop()
+            assert flushed == list(range(n - pending, n))
@@ -0,0 +1,70 @@
+import json
+import unittest
+from threading import Thread
+from time import sleep
+
+from flowcept.commons.autoflush_buffer import AutoflushBuffer
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.flowcept_metrics import get_metrics, MetricsRegistry
+
+
+class TestFlowceptMetrics(unittest.TestCase):
+    def test_registry(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("requests_total", "Requests.", kind="a")
+        counter.inc()
+        counter.inc(2)
+        assert registry.counter("requests_total", kind="a") is counter
+        assert registry.counter("requests_total", kind="b") is not counter
+        gauge = registry.gauge("depth", "Depth.")
+        gauge.set(1)
+        gauge.track(lambda: 10)
+        histogram = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+        for v in (0.05, 0.5, 5):
+            histogram.observe(v)
+        with self.assertRaises(Exception):
+            registry.gauge("requests_total", kind="a")
+
+        snapshot = json.loads(registry.to_json())
+        assert snapshot["requests_total"] == [
+            {"labels": {"kind": "a"}, "value": 3},
+            {"labels": {"kind": "b"}, "value": 0},
+        ]
+        assert snapshot["depth"][0]["value"] == 11
+        assert snapshot["latency_seconds"][0]["value"]["buckets"] == {"0.1": 1, "1": 1, "+Inf": 1}
+
+        text = registry.to_prometheus()
+        assert "# TYPE requests_total counter" in text
+        assert 'requests_total{kind="a"} 3' in text
+        assert 'latency_seconds_bucket{le="1"} 2' in text
+        assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+        assert "latency_seconds_count 3" in text
+
+        registry.reset()
+        assert counter.value == 0 and histogram.count == 0 and gauge.value == 10
+
+    def test_buffer_metrics(self):
+        metrics = get_metrics()
+        flushes = metrics.histogram("flowcept_buffer_flush_items", buffer="metrics_test")
+        pending = metrics.gauge("flowcept_buffer_pending", buffer="metrics_test")
+        buffer = AutoflushBuffer(
+            flush_function=lambda b: sleep(0.01), max_size=10, flush_interval=60, name="metrics_test"
+        )
+        for i in range(25):
+            buffer.append(i)
+        assert 0 < pending.value <= 25
+        buffer.stop()
+        assert pending.value == 0
+        assert flushes.sum == 25
+
+    def test_registry_is_process_wide(self):
+        assert get_metrics() is get_metrics()
+        assert isinstance(get_metrics(), MetricsRegistry)
+
+    def test_encoded_bytes_are_counted_per_thread(self):
+        dao = MQDao()
+        data = dao._encode({"task_id": "1"})
+        other = Thread(target=lambda: [dao._encode({"task_id": str(i)}) for i in range(100)])
+        other.start()
+        other.join()
+        assert dao._get_encoded_bytes() == len(data)
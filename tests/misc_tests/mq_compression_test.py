@@ -0,0 +1,21 @@
+import unittest
+
+import msgpack
+
+from flowcept.commons.compression import COMPRESSED_MARKER, decompress
+from flowcept.commons.daos.mq_dao.mq_compression import compress
+
+
+class TestMQCompression(unittest.TestCase):
+    def test_compress_roundtrip(self):
+        msg = {"type": "task", "telemetry_at_start": {"cpu": {"percent_all": 10.0}}, "per_cpu": [1.0] * 1000}
+        data = msgpack.dumps(msg)
+        compressed = compress(data, codec="zlib")
+        assert compressed[0] == COMPRESSED_MARKER
+        assert len(compressed) < len(data)
+        assert msgpack.loads(decompress(compressed)) == msg
+
+    def test_uncompressed_payloads_pass_through(self):
+        data = msgpack.dumps({"type": "task", "task_id": "1"})
+        assert compress(data, codec="zlib") == data  # Below the minimum size
+        assert decompress(data) == data
@@ -0,0 +1,29 @@
+import unittest
+
+import msgpack
+
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+
+
+class TestMQEnvelope(unittest.TestCase):
+    def test_envelope_roundtrip(self):
+        msgs = [{"type": "task", "task_id": str(i), "used": {"i": i}} for i in range(10)]
+        frame = msgpack.dumps(MQDao.pack_envelope(msgs))
+        received = []
+        assert MQDao.dispatch(msgpack.loads(frame, strict_map_key=False), lambda m: received.append(m) or True)
+        assert received == msgs
+
+    def test_regular_message(self):
+        msg = {"type": "task", "task_id": "1"}
+        assert MQDao.unpack_envelope(msg) == [msg]
+
+    def test_stop_breaks_dispatch(self):
+        msgs = [{"type": "task", "task_id": "0"}, {"type": "flowcept_control"}, {"type": "task", "task_id": "1"}]
+        received = []
+
+        def handler(m):
+            received.append(m)
+            return m["type"] != "flowcept_control"
+
+        assert not MQDao.dispatch(MQDao.pack_envelope(msgs), handler)
+        assert received == msgs[:2]
@@ -0,0 +1,173 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.daos.mq_dao.mq_serialization import dumps
+from flowcept.commons.daos.mq_dao.mq_spill_log import MQSpillLog, MQSpillLogReplayer
+
+try:
+    from flowcept.commons.daos.mq_dao import mq_dao_kafka
+except ImportError:
+    mq_dao_kafka = None
+
+
+class FakeKafkaMessage:
+    def __init__(self, value, offset=0, partition=0, topic="interception", key=None):
+        self._value, self._offset, self._partition, self._topic, self._key = value, offset, partition, topic, key
+
+    def value(self):
+        return self._value
+
+    def offset(self):
+        return self._offset
+
+    def partition(self):
+        return self._partition
+
+    def topic(self):
+        return self._topic
+
+    def key(self):
+        return self._key
+
+    def error(self):
+        return None
+
+
+class FakeConsumer:
+    def __init__(self):
+        self.batches = []
+        self.commits = []
+        self.closed = False
+
+    def commit(self, offsets, asynchronous):
+        if self.closed:
+            raise RuntimeError("Consumer closed")
+        self.commits.append(([(tp.topic, tp.partition, tp.offset) for tp in offsets], asynchronous))
+
+    def consume(self, num_messages, timeout):
+        return self.batches.pop(0) if len(self.batches) else []
+
+    def unsubscribe(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeProducer:
+    def __init__(self, *args, **kwargs):
+        self.pending = []
+        self.delivered = []
+        self.n_failures = 0
+        self.n_timeouts = 0
+        self.n_flushes = 0
+
+    def produce(self, topic, key=None, value=None, on_delivery=None):
+        self.pending.append((FakeKafkaMessage(value, topic=topic, key=key), on_delivery))
+
+    def poll(self, timeout):
+        pending, self.pending = self.pending, []
+        for msg, on_delivery in pending:
+            if self.n_failures:
+                self.n_failures -= 1
+                on_delivery("Broker down", msg)
+            else:
+                self.delivered.append(msg)
+                on_delivery(None, msg)
+        return len(pending)
+
+    def flush(self, timeout=None):
+        self.n_flushes += 1
+        if self.n_timeouts:
+            self.n_timeouts -= 1
+            return len(self.pending)
+        self.poll(0)
+        return 0
+
+
+@unittest.skipIf(mq_dao_kafka is None, "confluent_kafka is not installed")
+class TestMQKafka(unittest.TestCase):
+    def setUp(self):
+        with patch.object(mq_dao_kafka, "Producer", FakeProducer):
+            self.dao = mq_dao_kafka.MQDaoKafka()
+        self.dao._consumer = FakeConsumer()
+
+    def _handle(self, messages, ack_after_commit=True):
+        self.dao.ack_after_commit = ack_after_commit
+        received = []
+        kafka_msgs = [FakeKafkaMessage(self.dao._encode(m, dumps), offset=i) for i, m in enumerate(messages)]
+        self.dao._handle_batch(kafka_msgs, lambda msg: received.append(msg) or True)
+        return received
+
+    def test_commits_up_to_the_oldest_unpersisted_offset(self):
+        received = self._handle([{"type": "task", "task_id": str(i)} for i in range(3)])
+        ack_ids = [m[MQDao.ACK_ID_FIELD] for m in received]
+        self.dao.ack([ack_ids[1]])
+        self.dao.ack([ack_ids[0]])
+        self.dao.ack([ack_ids[2]])
+        commits = [offsets[0][2] for offsets, _ in self.dao._consumer.commits]
+        self.assertEqual(commits, [0, 2, 3])
+
+    def test_envelope_is_committed_once_all_its_messages_are(self):
+        received = self._handle([MQDao.pack_envelope([{"type": "task", "task_id": "1"}, {"type": "other"}])])
+        ack_ids = [m[MQDao.ACK_ID_FIELD] for m in received]
+        self.assertEqual(len(ack_ids), 2)
+        self.dao.ack(ack_ids[-1:])
+        self.assertEqual(self.dao._consumer.commits, [])
+        self.dao.ack(ack_ids[:1])
+        self.assertEqual(self.dao._consumer.commits, [([("interception", 0, 1)], True)])
+
+    def test_unsubscribe_commits_before_closing(self):
+        received = self._handle([{"type": "task", "task_id": "1"}])
+        consumer = self.dao._consumer
+        consumer.batches.append([FakeKafkaMessage(self.dao._encode({"type": "stop"}, dumps), offset=1)])
+        self.dao.message_listener(lambda msg: msg["type"] != "stop")
+        self.assertFalse(consumer.closed)
+        # E.g., by the final flush of the document inserter, after the listener returned.
+        self.dao.ack([received[0][MQDao.ACK_ID_FIELD]])
+        self.dao.unsubscribe()
+        self.assertEqual(consumer.commits[-1], ([("interception", 0, 1)], False))
+        self.assertTrue(consumer.closed)
+
+    def test_async_producer_does_not_wait_for_the_broker(self):
+        self.dao._async_producer = True
+        self.assertTrue(self.dao._bulk_publish([{"type": "task", "task_id": "1"}]))
+        self.dao.send_message({"type": "task", "task_id": "2"})
+        self.assertEqual(self.dao._producer.n_flushes, 0)
+        self.assertEqual(len(self.dao._producer.delivered), 2)
+
+    def test_async_producer_retries_failed_deliveries(self):
+        self.dao._async_producer = True
+        self.dao._producer.n_failures = 1
+        self.dao._bulk_publish([{"type": "task", "task_id": "1"}])
+        self.assertEqual(len(self.dao._failed_deliveries), 1)
+        self.dao._bulk_publish([{"type": "task", "task_id": "2"}])
+        self.assertEqual(len(self.dao._failed_deliveries), 0)
+        self.assertEqual(len(self.dao._producer.delivered), 2)
+
+    def test_sync_publish_fails_if_the_broker_did_not_take_the_batch(self):
+        self.assertTrue(self.dao._bulk_publish([{"type": "task", "task_id": "1"}]))
+        self.dao._producer.n_failures = 1
+        self.assertFalse(self.dao._bulk_publish([{"type": "task", "task_id": "2"}, {"type": "task", "task_id": "3"}]))
+        # The failed batch is republished as a whole, so its failed deliveries are not retried again.
+        self.assertEqual(self.dao._failed_deliveries, [])
+        self.dao._producer.n_timeouts = 1
+        self.assertFalse(self.dao._bulk_publish([{"type": "task", "task_id": "4"}]))
+
+    def test_undelivered_messages_are_spilled_on_stop(self):
+        with tempfile.TemporaryDirectory() as path:
+            spill_log = MQSpillLog(path, segment_size=1024**2, max_size=1024**2)
+            self.dao._spill_log = spill_log
+            self.dao._spill_log_replayer = MQSpillLogReplayer(
+                spill_log, publish_function=None, liveness_test=lambda: False, interval=60, batch_size=10
+            )
+            self.dao._async_producer = True
+            self.dao._producer.n_failures = 2
+            self.dao._bulk_publish([{"type": "task", "task_id": "1"}])
+            self.dao._stop(check_safe_stops=False)
+            self.assertIsNone(self.dao._spill_log)
+            replayed = []
+            self.assertTrue(spill_log.replay(lambda messages: not replayed.extend(messages), batch_size=10))
+            self.assertEqual([m["task_id"] for m in replayed], ["1"])
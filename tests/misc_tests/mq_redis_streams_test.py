@@ -0,0 +1,93 @@
+import unittest
+
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.daos.mq_dao.mq_dao_redis_streams import MQDaoRedisStreams
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestMQRedisStreams(unittest.TestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.producer = MQDaoRedisStreams()
+        self.producer._producer = fakeredis.FakeRedis(server=server)
+        self.producer._producers = [self.producer._producer]
+        self.consumer = MQDaoRedisStreams()
+        self.consumer._producer = fakeredis.FakeRedis(server=server)
+        self.consumer._producers = [self.consumer._producer]
+        self.consumer.subscribe()
+
+    def _consume(self, dao):
+        received = []
+
+        def handler(msg):
+            received.append(msg)
+            return msg.get("info") != "stop_document_inserter"
+
+        dao.message_listener(handler)
+        return received
+
+    def test_publish_consume_and_stop(self):
+        self.producer._bulk_publish([{"type": "task", "task_id": str(i)} for i in range(5)])
+        self.producer.send_document_inserter_stop()
+        received = self._consume(self.consumer)
+        assert [m["task_id"] for m in received[:5]] == [str(i) for i in range(5)]
+        assert received[-1]["info"] == "stop_document_inserter"
+        assert self.consumer._producer.xpending(self.consumer._stream, self.consumer._group)["pending"] == 0
+
+    def test_unacked_entries_are_redelivered(self):
+        self.consumer.ack_after_commit = True
+        self.producer._bulk_publish([MQDao.pack_envelope([{"type": "task", "task_id": "1"}])])
+        self.producer.send_document_inserter_stop()
+        received = self._consume(self.consumer)
+        ack_ids = [m[MQDao.ACK_ID_FIELD] for m in received if MQDao.ACK_ID_FIELD in m]
+        assert len(ack_ids) == 1
+        assert self.consumer._producer.xpending(self.consumer._stream, self.consumer._group)["pending"] == 1
+
+        # A restarted consumer with the same name first gets its pending entries back.
+        self.producer.send_document_inserter_stop()
+        received = self._consume(self.consumer)
+        assert received[0]["task_id"] == "1"
+        self.consumer.ack(ack_ids)
+        assert self.consumer._producer.xpending(self.consumer._stream, self.consumer._group)["pending"] == 0
+
+    def test_envelope_is_acked_once_all_its_messages_are(self):
+        self.consumer.ack_after_commit = True
+        envelope = MQDao.pack_envelope([{"type": "task", "task_id": "1"}, {"type": "telemetry_summary"}])
+        self.producer._bulk_publish([envelope])
+        self.producer.send_document_inserter_stop()
+        received = self._consume(self.consumer)
+        ack_ids = [m[MQDao.ACK_ID_FIELD] for m in received if MQDao.ACK_ID_FIELD in m]
+        assert len(ack_ids) == 2
+
+        # Acking the message of another kind first must not acknowledge the task, still to be persisted.
+        self.consumer.ack(ack_ids[-1:])
+        assert self.consumer._producer.xpending(self.consumer._stream, self.consumer._group)["pending"] == 1
+        self.consumer.ack(ack_ids[:1])
+        assert self.consumer._producer.xpending(self.consumer._stream, self.consumer._group)["pending"] == 0
+
+    def test_pending_entries_are_read_once(self):
+        self.consumer.ack_after_commit = True
+        self.producer._bulk_publish([{"type": "task", "task_id": str(i)} for i in range(3)])
+        self.producer.send_document_inserter_stop()
+        self._consume(self.consumer)
+        assert self.consumer._producer.xpending(self.consumer._stream, self.consumer._group)["pending"] == 3
+
+        # Restarted without a stop message queued: it is only sent once a new entry was read.
+        received = []
+
+        def handler(msg):
+            received.append(msg)
+            if msg.get("task_id") == "2":
+                self.producer._bulk_publish([{"type": "task", "task_id": "3"}])
+            elif msg.get("task_id") == "3":
+                self.producer.send_document_inserter_stop()
+            # Giving up if the pending entries keep being redelivered.
+            return msg.get("info") != "stop_document_inserter" and len(received) < 20
+
+        self.consumer.message_listener(handler)
+        assert [m.get("task_id") for m in received] == ["0", "1", "2", "3", None]
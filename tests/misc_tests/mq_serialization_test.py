@@ -0,0 +1,82 @@
+import argparse
+import unittest
+from unittest.mock import patch
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import msgpack
+import numpy as np
+
+from flowcept.commons.daos.mq_dao.mq_serialization import dumps_ext, loads, register_encoder, summarize_array
+from flowcept.commons.utils import replace_non_serializable
+from flowcept.instrumentation import flowcept_task
+
+
+class _Opaque:
+    pass
+
+
+class _Point:
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+
+class TestMQSerialization(unittest.TestCase):
+    def test_numpy_datetime_uuid(self):
+        now = datetime.now(timezone.utc)
+        uid = uuid4()
+        msg = {
+            "used": {"a": np.arange(6, dtype=np.float32).reshape(2, 3), "n": np.int64(3), "f": np.float32(0.5)},
+            "generated": {"when": now, "id": uid, "flags": np.array([True, False]), "s": {1}},
+        }
+        data = dumps_ext(msg)
+
+        plain = loads(data)
+        assert plain["used"] == {"a": [[0, 1, 2], [3, 4, 5]], "n": 3, "f": 0.5}
+        assert plain["generated"] == {"when": now.isoformat(), "id": str(uid), "flags": [True, False], "s": [1]}
+
+        native = loads(data, native=True)
+        assert native["used"]["a"].dtype == np.float32 and native["used"]["a"].shape == (2, 3)
+        assert native["generated"]["when"] == now
+        assert native["generated"]["id"] == uid
+        # Plain msgpack consumers still read payloads without extension types.
+        assert loads(msgpack.dumps({"x": 1})) == {"x": 1}
+
+    def test_large_arrays_are_summarized(self):
+        big = np.arange(100_000, dtype=np.float64)
+        summary = loads(dumps_ext({"big": big}))["big"]
+        assert summary == summarize_array(big)
+        assert summary["shape"] == [100_000] and summary["max"] == 99_999
+
+    def test_pandas(self):
+        import pandas as pd
+
+        df = pd.DataFrame({"a": [1, 2], "b": ["x", "y"]})
+        plain = loads(dumps_ext({"df": df, "s": df["a"]}))
+        assert plain["df"] == {"index": [0, 1], "columns": {"a": [1, 2], "b": ["x", "y"]}}
+        assert plain["s"] == {"index": [0, 1], "values": [1, 2], "name": "a"}
+        native = loads(dumps_ext({"df": df}), native=True)
+        pd.testing.assert_frame_equal(native["df"], df)
+
+    def test_fallback_and_registry(self):
+        ns = argparse.Namespace(lr=0.1)
+        opaque = _Opaque()
+        msg = {"ns": ns, "o": opaque}
+        assert loads(dumps_ext(msg)) == replace_non_serializable(msg)
+        register_encoder(_Point, lambda p: [p.x, p.y])
+        assert loads(dumps_ext({"p": _Point(1, 2)})) == {"p": [1, 2]}
+
+    def test_captured_args_do_not_reference_user_objects(self):
+        array, opaque = np.zeros(3), _Opaque()
+        with patch.object(flowcept_task, "_serialized_by_mq", lambda: True):
+            args = flowcept_task.default_args_handler(array, obj=opaque, when=datetime(2024, 1, 2))
+            used = flowcept_task._capture(args)
+        array[0] = 1
+        # Sent as serialized when captured.
+        data = dumps_ext({"type": "task", "used": used})
+        assert used.data in data
+        msg = loads(data, native=True)
+        assert msg["used"]["arg_0"].tolist() == [0, 0, 0]
+        assert msg["used"]["obj"] == loads(dumps_ext(opaque)) and isinstance(msg["used"]["obj"], str)
+        assert msg["used"]["when"] == datetime(2024, 1, 2)
+        assert loads(data)["used"]["when"] == "2024-01-02T00:00:00"
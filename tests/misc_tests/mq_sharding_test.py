@@ -0,0 +1,128 @@
+import unittest
+from unittest.mock import patch
+
+from flowcept.commons.compression import decompress
+from flowcept.commons.daos.mq_dao import mq_dao_base
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.daos.mq_dao.mq_dao_redis_streams import MQDaoRedisStreams
+from flowcept.commons.daos.mq_dao.mq_serialization import loads
+from flowcept.commons.daos.mq_dao.mq_sharding import ConsistentHashRing
+from flowcept.commons.daos.mq_dao.mq_string_table import intern_strings
+from flowcept.commons.daos.mq_dao.mq_wire_format import encode_task, decode_task
+from flowcept.flowceptor.consumers import base_consumer
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class TestMQSharding(unittest.TestCase):
+    def test_ring_is_stable_and_balanced(self):
+        shards = ["host1:6379", "host2:6379", "host3:6379"]
+        ring = ConsistentHashRing(shards)
+        keys = [f"wf_{i}" for i in range(3000)]
+        assignment = [ring.get_shard(k) for k in keys]
+        self.assertEqual(assignment, [ConsistentHashRing(shards).get_shard(k) for k in keys])
+        counts = [assignment.count(i) for i in range(len(shards))]
+        self.assertTrue(all(c > 600 for c in counts), counts)
+
+    def test_adding_a_shard_only_moves_its_keys(self):
+        keys = [f"wf_{i}" for i in range(3000)]
+        ring = ConsistentHashRing(["a", "b", "c"])
+        grown = ConsistentHashRing(["a", "b", "c", "d"])
+        for k in keys:
+            if grown.get_shard(k) != 3:
+                self.assertEqual(ring.get_shard(k), grown.get_shard(k))
+
+    def test_split_by_shard_keeps_workflows_together(self):
+        dao = MQDao()
+        dao._shard_ring = ConsistentHashRing(["a", "b"])
+        msgs = [{"workflow_id": f"wf_{i % 5}", "task_id": str(i)} for i in range(50)]
+        groups = dao._split_by_shard(msgs)
+        self.assertEqual(sum(len(g) for g in groups), 50)
+        for group in groups:
+            self.assertEqual(len({dao._get_shard(m) for m in group}), 1)
+        envelope = MQDao.pack_envelope(msgs[:3])
+        self.assertEqual(dao._get_shard(envelope), dao._get_shard(msgs[0]))
+        self.assertEqual(MQDao()._split_by_shard(msgs), [msgs])
+
+    def test_compact_messages_are_routed_by_their_shard_key(self):
+        dao = MQDao()
+        dao._shard_ring = ConsistentHashRing(["a", "b"])
+        msgs = [{"type": "task", "workflow_id": f"wf_{i}", "task_id": str(i)} for i in range(20)]
+        self.assertEqual(len({dao._get_shard(m) for m in msgs}), 2)
+        for msg in msgs:
+            compact = encode_task(msg)
+            self.assertEqual(dao._get_shard(compact), dao._get_shard(msg))
+            self.assertEqual(dao._get_shard(MQDao.pack_envelope([compact])), dao._get_shard(msg))
+
+    def test_interned_envelopes_are_routed_by_their_strings(self):
+        dao = MQDao()
+        dao._shard_ring = ConsistentHashRing(["a", "b"])
+        for wf in ["wf_0", "wf_1", "wf_2", "wf_3"]:
+            msgs = [{"type": "task", "workflow_id": wf, "task_id": f"{wf}_{i}"} for i in range(3)]
+            interned, strings, interned_fields = intern_strings(msgs)
+            self.assertEqual(interned[0]["workflow_id"], 0)
+            for packed in [interned, [encode_task(m) for m in interned]]:
+                envelope = MQDao.pack_envelope(packed, strings, interned_fields)
+                # Also how spilled envelopes are routed when replayed.
+                self.assertEqual(dao._get_shard(envelope), dao._get_shard(msgs[0]))
+        self.assertEqual(len({dao._get_shard({"workflow_id": f"wf_{i}"}) for i in range(4)}), 2)
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_compact_envelopes_reach_their_shard(self):
+        dao = MQDaoRedisStreams()
+        dao._producers = [fakeredis.FakeRedis(server=fakeredis.FakeServer()) for _ in range(2)]
+        dao._shard_ring = ConsistentHashRing(["a", "b"])
+        msgs = [{"type": "task", "workflow_id": f"wf_{i}", "task_id": str(i)} for i in range(20)]
+        with patch.object(mq_dao_base, "MQ_WIRE_FORMAT", "compact"), patch.object(mq_dao_base, "MQ_ENVELOPE", True):
+            dao.bulk_publish(msgs)
+        # One envelope per shard, holding the tasks of the workflows routed to it.
+        for shard, producer in enumerate(dao._producers):
+            entries = producer.xrange(dao._stream)
+            self.assertEqual(len(entries), 1)
+            envelope = loads(decompress(entries[0][1][b"data"]))
+            task_ids = sorted(decode_task(m)["task_id"] for m in envelope["msgs"])
+            self.assertEqual(task_ids, sorted(m["task_id"] for m in msgs if dao._get_shard(m) == shard))
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_liveness_test_pings_every_shard(self):
+        dao = MQDaoRedisStreams()
+        servers = [fakeredis.FakeServer() for _ in range(2)]
+        dao._producers = [fakeredis.FakeRedis(server=server) for server in servers]
+        dao._producer = dao._producers[0]
+        self.assertTrue(dao.liveness_test())
+        servers[1].connected = False
+        self.assertFalse(dao.liveness_test())
+
+    def test_replay_only_spills_again_the_failed_shard(self):
+        class FakeSpillLog:
+            def __init__(self):
+                self.spilled = []
+
+            def append(self, messages):
+                self.spilled.extend(messages)
+
+        dao = MQDao()
+        dao._shard_ring = ConsistentHashRing(["a", "b"])
+        dao._spill_log = FakeSpillLog()
+        msgs = [{"workflow_id": f"wf_{i % 5}", "task_id": str(i)} for i in range(50)]
+        failed_shard = dao._get_shard(msgs[0])
+        published = []
+        with patch.object(
+            MQDao,
+            "_bulk_publish",
+            lambda _, chunk: dao._get_shard(chunk[0]) != failed_shard and not published.extend(chunk),
+            create=True,
+        ):
+            self.assertTrue(dao._publish_spilled(msgs))
+            self.assertEqual(sorted(published + dao._spill_log.spilled, key=lambda m: int(m["task_id"])), msgs)
+            self.assertEqual({dao._get_shard(m) for m in dao._spill_log.spilled}, {failed_shard})
+            self.assertFalse(dao._publish_spilled([m for m in msgs if dao._get_shard(m) == failed_shard]))
+
+    def test_mq_without_hosts_rejects_instances(self):
+        for mq_type in ["mofka", "shm"]:
+            with patch.object(base_consumer, "MQ_ENABLED", True), patch.object(base_consumer, "MQ_TYPE", mq_type):
+                with self.assertRaises(Exception):
+                    base_consumer.BaseConsumer(mq_host="localhost", mq_port=6379)
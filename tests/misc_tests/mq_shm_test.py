@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from uuid import uuid4
+
+from flowcept.commons.daos.mq_dao import mq_dao_shm
+from flowcept.commons.daos.mq_dao.mq_dao_shm import MQDaoShm
+
+
+def _produce(settings, worker, n):
+    with patch.object(mq_dao_shm, "MQ_SETTINGS", settings):
+        dao = MQDaoShm()
+        dao._bulk_publish([{"type": "task", "task_id": f"{worker}_{i}"} for i in range(n)])
+
+
+class TestMQShm(unittest.TestCase):
+    def setUp(self):
+        # A small ring, so the tests wrap around it.
+        self.settings = {"shm_name": f"flowcept_test_{uuid4().hex[:8]}", "shm_size": 4096, "shm_publish_timeout": 5}
+        self.patcher = patch.object(mq_dao_shm, "MQ_SETTINGS", self.settings)
+        self.patcher.start()
+        self.consumer = MQDaoShm()
+        self.consumer.subscribe()
+
+    def tearDown(self):
+        self.consumer.unsubscribe()
+        self.patcher.stop()
+        os.remove(os.path.join(tempfile.gettempdir(), f"{self.settings['shm_name']}.lock"))
+
+    def _consume(self):
+        received = []
+
+        def handler(msg):
+            received.append(msg)
+            return msg.get("info") != "stop_document_inserter"
+
+        self.consumer.message_listener(handler)
+        return received
+
+    def test_publish_consume_and_stop(self):
+        producer = MQDaoShm()
+        # Many times the ring size, stopping mid-batch every time: the unread messages are kept.
+        received = []
+        for i in range(50):
+            assert producer._bulk_publish([{"type": "task", "task_id": f"{i}_{j}", "pad": "x" * 100} for j in range(5)])
+            self.consumer.message_listener(lambda msg: received.append(msg) or not msg["task_id"].endswith("_2"))
+        producer.send_document_inserter_stop()
+        received.extend(self._consume())
+        assert [m["task_id"] for m in received[:-1]] == [f"{i}_{j}" for i in range(50) for j in range(5)]
+        assert received[-1]["info"] == "stop_document_inserter"
+
+    def test_many_producer_processes(self):
+        ctx = multiprocessing.get_context("spawn")
+        workers = [ctx.Process(target=_produce, args=(self.settings, w, 200)) for w in range(3)]
+        for w in workers:
+            w.start()
+        received = []
+
+        def handler(msg):
+            received.append(msg)
+            return len(received) < 600
+
+        self.consumer.message_listener(handler)
+        for w in workers:
+            w.join()
+        for w in range(3):
+            ids = [m["task_id"] for m in received if m["task_id"].startswith(f"{w}_")]
+            assert ids == [f"{w}_{i}" for i in range(200)]
+
+    def test_only_one_consumer(self):
+        other = MQDaoShm()
+        other._set(MQDaoShm._CONSUMER_PID, 1)  # init, which is always alive
+        with self.assertRaises(Exception):
+            other.subscribe()
+        other._set(MQDaoShm._CONSUMER_PID, 0)
@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flowcept.commons.daos.mq_dao import mq_spill_log
+from flowcept.commons.daos.mq_dao.mq_spill_log import MQSpillLog
+
+
+class TestMQSpillLog(unittest.TestCase):
+    def test_spill_and_replay(self):
+        spill_log = MQSpillLog(tempfile.mkdtemp(), segment_size=1024, max_size=10 * 1024**2)
+        msgs = [{"type": "task", "task_id": str(i), "used": {"i": i}} for i in range(500)]
+        for i in range(0, len(msgs), 50):
+            spill_log.append(msgs[i : i + 50])
+        assert not spill_log.is_empty()
+
+        # The MQ is still down.
+        assert not spill_log.replay(lambda batch: False, batch_size=100)
+        assert not spill_log.is_empty()
+
+        published = []
+        assert spill_log.replay(lambda batch: published.extend(batch) or True, batch_size=100)
+        assert published == msgs
+        assert spill_log.is_empty()
+
+    def test_size_cap(self):
+        spill_log = MQSpillLog(tempfile.mkdtemp(), segment_size=1024, max_size=4 * 1024)
+        for i in range(100):
+            spill_log.append([{"task_id": str(i), "payload": "x" * 100}])
+        assert spill_log.discarded_bytes > 0
+        published = []
+        spill_log.replay(lambda batch: published.extend(batch) or True, batch_size=100)
+        assert 0 < len(published) < 100
+        assert published[-1]["task_id"] == "99"
+
+    def test_directory_is_only_listed_over_the_cap(self):
+        spill_log = MQSpillLog(tempfile.mkdtemp(), segment_size=1024, max_size=10 * 1024**2)
+        with patch.object(mq_spill_log, "glob", wraps=mq_spill_log.glob) as glob:
+            for i in range(100):
+                spill_log.append([{"task_id": str(i), "payload": "x" * 100}])
+            assert glob.call_count == 0
+
+    def test_segments_of_dead_replayers_are_recovered(self):
+        path = tempfile.mkdtemp()
+        spill_log = MQSpillLog(path, segment_size=10 * 1024**2, max_size=10 * 1024**2)
+        spill_log.append([{"task_id": "1"}])
+        spill_log.seal()
+        spill_log.append([{"task_id": "2"}])
+        spill_log.seal()
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        first, second = sorted(os.listdir(path))
+        # Claimed by a replayer killed mid-replay, and by one still running.
+        os.rename(os.path.join(path, first), os.path.join(path, f"{first}.replaying_{dead.pid}_0000abcd"))
+        os.rename(os.path.join(path, second), os.path.join(path, f"{second}.replaying_{os.getpid()}_0000abcd"))
+
+        published = []
+        assert MQSpillLog(path, segment_size=1024, max_size=10 * 1024**2).replay(
+            lambda batch: published.extend(batch) or True, batch_size=100
+        )
+        assert published == [{"task_id": "1"}]
+        assert os.listdir(path) == [f"{second}.replaying_{os.getpid()}_0000abcd"]
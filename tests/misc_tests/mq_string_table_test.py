@@ -0,0 +1,71 @@
+import json
+import os
+import pathlib
+import unittest
+
+import msgpack
+
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.daos.mq_dao.mq_string_table import intern_strings
+from flowcept.commons.daos.mq_dao.mq_wire_format import encode_task
+
+
+def _sample_tasks():
+    fpath = os.path.join(pathlib.Path(__file__).parent.parent.resolve(), "api", "sample_data.json")
+    with open(fpath) as f:
+        docs = json.load(f)
+    tasks = []
+    for doc in docs:
+        doc.pop("_id", None)
+        doc["type"] = "task"
+        doc["workflow_id"] = "0a3f5e8e-9c1f-4c3e-a0b4-0b8f1e6f6f1a"
+        doc["hostname"] = doc.get("node_name")
+        tasks.append(doc)
+    return tasks
+
+
+def _roundtrip(envelope):
+    frame = msgpack.dumps(envelope)
+    received = []
+    MQDao.dispatch(msgpack.loads(frame, strict_map_key=False), lambda m: received.append(m) or True)
+    return frame, received
+
+
+class TestMQStringTable(unittest.TestCase):
+    def test_roundtrip(self):
+        tasks = _sample_tasks()
+        messages, strings, fields = intern_strings(tasks)
+        assert "workflow_id" in fields and "campaign_id" in fields
+        assert messages[0]["workflow_id"] == strings.index(tasks[0]["workflow_id"])
+        assert tasks[0]["workflow_id"] != messages[0]["workflow_id"]  # Not modified in place.
+        _, received = _roundtrip(MQDao.pack_envelope(messages, strings, fields))
+        assert received == tasks
+
+    def test_non_string_values_are_not_interned(self):
+        tasks = [{"type": "task", "group_id": 1, "hostname": "a"}, {"type": "task", "group_id": "g", "hostname": "a"}]
+        tasks.append({"type": "workflow", "hostname": "a"})
+        tasks.append(["not", "a", "dict"])
+        messages, strings, fields = intern_strings(tasks)
+        assert fields == ["hostname"] and strings == ["a"]
+        _, received = _roundtrip(MQDao.pack_envelope(messages, strings, fields))
+        assert received == tasks
+
+    def test_unique_values_are_not_interned(self):
+        tasks = [{"type": "task", "task_id": str(i), "hostname": str(i)} for i in range(3)]
+        messages, strings, fields = intern_strings(tasks)
+        assert messages is tasks and not strings
+
+    def test_bytes_per_message(self):
+        """Interning, and then the compact wire format, make the sample data smaller."""
+        tasks = _sample_tasks()
+        before, _ = _roundtrip(MQDao.pack_envelope(tasks))
+        messages, strings, fields = intern_strings(tasks)
+        after, received = _roundtrip(MQDao.pack_envelope(messages, strings, fields))
+        assert received == tasks
+        compact, received = _roundtrip(MQDao.pack_envelope([encode_task(m) for m in messages], strings, fields))
+        assert received == tasks
+        assert len(compact) < len(after) < 0.9 * len(before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+from uuid import uuid4
+
+import msgpack
+
+from flowcept.commons.daos.mq_dao.mq_dao_base import MQDao
+from flowcept.commons.daos.mq_dao.mq_wire_format import (
+    COMPACT_MARKER,
+    WIRE_FORMAT_VERSION,
+    decode_task,
+    encode_task,
+    get_field,
+    is_compact_task,
+)
+from flowcept.commons.flowcept_dataclasses.task_object import TaskObject
+from flowcept.commons.flowcept_dataclasses.telemetry import Telemetry
+from flowcept.commons.vocabulary import Status
+
+
+def _task():
+    return {
+        "type": "task",
+        "task_id": str(uuid4()),
+        "workflow_id": "wf",
+        "activity_id": "forward",
+        "subtype": "child_forward",
+        "status": Status.FINISHED.value,
+        "started_at": 1.5,
+        "ended_at": 2.5,
+        "used": {"x": [1, 2]},
+        "generated": {"y": 3},
+        "telemetry_at_start": {"cpu": {"percent_all": 10.0}, "memory": {"virtual": {"used": 1}}},
+        "telemetry_at_end": {"cpu": {"percent_all": 20.0}, "gpu_extra": 1},
+        "hostname": "node0",
+    }
+
+
+class TestMQWireFormat(unittest.TestCase):
+    def test_roundtrip(self):
+        task = _task()
+        encoded = encode_task(task)
+        assert is_compact_task(encoded)
+        assert encoded[:2] == [COMPACT_MARKER, WIRE_FORMAT_VERSION]
+        decoded = decode_task(msgpack.loads(msgpack.dumps(encoded), strict_map_key=False))
+        assert decoded == task
+
+    def test_unknown_fields_and_status(self):
+        task = _task()
+        task["my_field"] = {"a": 1}
+        task["status"] = "PAUSED"
+        task["telemetry_at_start"] = "not a dict"
+        assert decode_task(encode_task(task)) == task
+
+    def test_status_enum(self):
+        task = _task()
+        task["status"] = Status.ERROR
+        assert decode_task(encode_task(task))["status"] == Status.ERROR.value
+
+    def test_other_messages_untouched(self):
+        msg = {"type": "workflow", "workflow_id": "wf"}
+        assert encode_task(msg) is msg
+        assert not is_compact_task(msg)
+        assert MQDao.unpack_envelope(msg) == [msg]
+
+    def test_get_field(self):
+        encoded = encode_task(_task())
+        assert get_field(encoded, "workflow_id") == "wf"
+        assert get_field(encoded, "hostname") == "node0"
+        assert get_field(encoded, "campaign_id") is None
+        assert get_field(encoded, "not_a_field") is None
+
+    def test_envelope(self):
+        tasks = [_task() for _ in range(5)]
+        frame = msgpack.dumps(MQDao.pack_envelope([encode_task(t) for t in tasks]))
+        received = []
+        assert MQDao.dispatch(msgpack.loads(frame, strict_map_key=False), lambda m: received.append(m) or True)
+        assert received == tasks
+
+    def test_smaller(self):
+        task = _task()
+        assert len(msgpack.dumps(encode_task(task))) < len(msgpack.dumps(task))
+
+    def test_all_fields_have_ids(self):
+        # New TaskObject or Telemetry fields must be appended to a new version of the field tables.
+        task = {f: f for f in TaskObject.__annotations__ if f != "type"}
+        encoded = encode_task({"type": "task", **task})
+        assert not isinstance(encoded[-1], dict)
+        telemetry = {f: f for f in Telemetry.__annotations__}
+        encoded = encode_task({"type": "task", "telemetry_at_end": telemetry})
+        assert not isinstance(encoded[-1][-1], dict)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import copy
+import json
+import unittest
+from pathlib import Path
+
+from flowcept.commons.flowcept_logger import FlowceptLogger
+from flowcept.commons.task_data_preprocess import (
+    add_telemetry_summaries,
+    summarize_telemetry,
+    summarize_telemetry_batch,
+    tag_critical_task,
+    tag_critical_tasks,
+)
+
+SAMPLE_DATA_PATH = Path(__file__).parent.parent / "api" / "sample_data_with_telemetry_and_rai.json"
+
+
+class TelemetrySummaryBatchTest(unittest.TestCase):
+    def setUp(self):
+        with open(SAMPLE_DATA_PATH) as f:
+            tasks = json.load(f)
+        self.tasks = [t for t in tasks if t.get("telemetry_at_start") and t.get("telemetry_at_end")]
+        self.logger = FlowceptLogger()
+
+    def test_batch_matches_per_task_summaries(self):
+        tasks = copy.deepcopy(self.tasks)
+        # Tasks missing some telemetry fields or timestamps.
+        del tasks[0]["telemetry_at_end"]["cpu"]["times_avg"]
+        del tasks[1]["ended_at"]
+        del tasks[2]["telemetry_at_start"]["network"]
+        tasks[3]["generated"]["result"] = 0.95
+
+        summaries = summarize_telemetry_batch(tasks)
+        all_tags = tag_critical_tasks(tasks, summaries)
+        self.assertEqual(len(tasks), len(summaries))
+        for task, summary, tags in zip(tasks, summaries, all_tags):
+            expected = summarize_telemetry(task, self.logger)
+            if "cpu" in expected and "times_avg" not in task["telemetry_at_end"]["cpu"]:
+                del expected["cpu"]
+            self.assertEqual(expected, summary)
+            self.assertEqual(tag_critical_task(task.get("generated", {}), expected), tags)
+        self.assertNotIn("cpu", summaries[0])
+        self.assertNotIn("duration_sec", summaries[1])
+        self.assertNotIn("network", summaries[2])
+        self.assertIn("high_output", all_tags[3])
+
+    def test_activity_thresholds(self):
+        tasks = copy.deepcopy(self.tasks[:2])
+        tasks[0]["activity_id"] = "slow_activity"
+        tasks[1]["activity_id"] = "other_activity"
+        summaries = summarize_telemetry_batch(tasks)
+        thresholds = {"default": {"long_duration": 1e9}, "slow_activity": {"long_duration": 0.1}}
+        all_tags = tag_critical_tasks(tasks, summaries, activity_thresholds=thresholds)
+        self.assertIn("long_duration", all_tags[0])
+        self.assertNotIn("long_duration", all_tags[1])
+
+    def test_add_telemetry_summaries(self):
+        tasks = copy.deepcopy(self.tasks[:3])
+        tasks.append({"task_id": "no_telemetry", "activity_id": "x"})
+        self.assertEqual(3, add_telemetry_summaries(tasks))
+        for task in tasks[:3]:
+            self.assertIn("duration_sec", task["telemetry_summary"])
+            self.assertIn("low_output", task["tags"])
+        self.assertNotIn("telemetry_summary", tasks[3])
+        self.assertNotIn("tags", tasks[3])